@@ -1,2 +1,4 @@
 # flake8: noqa
-from .linak_device import LinakDesk, DPGCommandReadError
\ No newline at end of file
+from .linak_device import LinakDesk, DPGCommandReadError
+from .command import DPGCommandTimeoutError
+from .async_device import AsyncLinakDesk
@@ -0,0 +1,173 @@
+#
+# asyncio counterpart of 'BTLEConnection'.
+#
+
+import asyncio
+import logging
+import functools
+
+from .connection import BTLEConnection
+from .command import DPGCommand, DPGCommandTimeoutError
+import linak_dpg_bt.linak_service as linak_service
+import linak_dpg_bt.constants as constants
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncBTLEConnection:
+    """Awaitable interface to 'BTLEConnection'.
+
+    Incoming data is watched by event loop ('loop.add_reader()' on bluepy-helper's pipe), so
+    no notification thread is needed. DPG commands are completed by notification handler
+    and awaited without blocking the loop.
+
+    Connecting, GATT writes and reads are blocking calls of bluepy and are executed in
+    'executor' (loop's default executor if None, limited to 'min(32, cpus + 4)' threads).
+    Threads are used only for the duration of single operation, so many desks can share
+    one bounded executor: pass the same 'ThreadPoolExecutor(max_workers=N)' to all of them,
+    at most N GATT operations are in progress, others wait in its queue.
+    """
+
+    logger = None
+
+    ## delay of next processing attempt when connection is busy
+    BUSY_RETRY_DELAY = 0.005
+
+
+    def __init__(self, mac, peripheralFactory=None, executor=None, connection=None):
+        """
+        :param connection: existing 'BTLEConnection' to wrap, new one is created if None
+        """
+        if connection == None:
+            connection = BTLEConnection(mac, peripheralFactory)
+        self._conn = connection
+        self._executor = executor
+        self._loop = None
+        self._fileno = None
+        self._dpgLock = None
+
+    @property
+    def mac(self):
+        return self._conn.mac
+
+    @property
+    def connection(self):
+        """Wrapped synchronous connection."""
+        return self._conn
+
+    def isConnected(self):
+        return self._conn.isConnected()
+
+    async def connect(self):
+        self._loop = asyncio.get_running_loop()
+        if self._dpgLock == None:
+            self._dpgLock = asyncio.Lock()
+        await self.run( self._conn.connect )
+        self._start_reading()
+
+    async def disconnect(self):
+        self._stop_reading()
+        await self.run( self._conn.disconnect )
+
+    async def run(self, function, *args, **kwargs):
+        """Execute blocking function in executor."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial( function, *args, **kwargs )
+        return await loop.run_in_executor( self._executor, call )
+
+    ## ================= GATT =================
+
+    async def subscribe_to_notification_enum(self, characteristicEnum, callback):
+        await self.run( self._conn.subscribe_to_notification_enum, characteristicEnum, callback )
+
+    async def read_characteristic_by_enum(self, characteristicEnum):
+        return await self.run( self._conn.read_characteristic_by_enum, characteristicEnum )
+
+    async def read_characteristic_by_handle(self, characteristicHandle):
+        return await self.run( self._conn.read_characteristic_by_handle, characteristicHandle )
+
+    async def send_control_command(self, controlCommand):
+        await self.run( self._conn.write_command, linak_service.Characteristic.CONTROL, controlCommand, False )
+
+    async def send_directional_command(self, directionalCommand):
+        await self.run( self._conn.write_command, linak_service.Characteristic.CTRL1, directionalCommand, True )
+
+    ## ================= DPG =================
+
+    async def send_dpg_read_command(self, dpgCommandType):
+        dpgCommand = DPGCommand.get_read_command(dpgCommandType)
+        return await self._send_dpg_command( dpgCommand )
+
+    async def send_dpg_write_command(self, dpgCommandType, data):
+        dpgCommand = DPGCommand.get_write_command(dpgCommandType, data)
+        return await self._send_dpg_command( dpgCommand )
+
+    async def _send_dpg_command(self, dpgCommand):
+        loop = asyncio.get_running_loop()
+        completed = loop.create_future()
+        def on_done(command):
+            loop.call_soon_threadsafe( self._set_future, completed )
+        dpgCommand.add_done_callback( on_done )
+
+        attempts = constants.DPG_COMMAND_ATTEMPTS
+        timeout = constants.DPG_RESPONSE_TIMEOUT
+        async with self._dpgLock:
+            try:
+                for rep in range(0, attempts):
+                    await self.run( self._conn.start_dpg_command, dpgCommand )
+                    try:
+                        await asyncio.wait_for( asyncio.shield(completed), timeout )
+                        return dpgCommand.result()
+                    except asyncio.TimeoutError:
+                        self.logger.debug("Did not receive response: %s", rep)
+            finally:
+                await self.run( self._conn.cancel_dpg_command, dpgCommand )
+        raise DPGCommandTimeoutError("No response for %s after %s attempts of %ss" % (dpgCommand, attempts, timeout))
+
+    @staticmethod
+    def _set_future(future):
+        if future.done() == False:
+            future.set_result( True )
+
+    ## ================= notifications =================
+
+    def _start_reading(self):
+        fileno = self._conn.fileno()
+        if fileno == None:
+            raise RuntimeError("peripheral does not provide file descriptor")
+        self._fileno = fileno
+        self._loop.add_reader( fileno, self._on_readable )
+
+    def _stop_reading(self):
+        if self._fileno == None:
+            return
+        try:
+            self._loop.remove_reader( self._fileno )
+        except (OSError, ValueError):
+            pass
+        self._fileno = None
+
+    def _on_readable(self):
+        if self._conn.fileno() != self._fileno:
+            ## disconnected
+            self._stop_reading()
+            return
+        try:
+            handled = self._conn.handle_available_notifications( blocking=False )
+        except BaseException as e:
+            self.logger.error("exception occurred: %s %s", type(e), e)
+            self._stop_reading()
+            return
+        if handled == False:
+            ## other thread is writing to device -- it will consume pending data meanwhile
+            fileno = self._fileno
+            self._loop.remove_reader( fileno )
+            self._loop.call_later( self.BUSY_RETRY_DELAY, self._resume_reading, fileno )
+
+    def _resume_reading(self, fileno):
+        if self._fileno != fileno:
+            return
+        self._loop.add_reader( fileno, self._on_readable )
+
+AsyncBTLEConnection.logger = _LOGGER.getChild(AsyncBTLEConnection.__name__)
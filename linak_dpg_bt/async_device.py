@@ -0,0 +1,212 @@
+#
+# asyncio counterpart of 'LinakDesk'.
+#
+
+import asyncio
+import logging
+
+import linak_dpg_bt.datatype as datatype
+
+from .linak_device import LinakDesk, DPGCommandReadError
+from .async_connection import AsyncBTLEConnection
+from .init_pipeline import InitPipeline
+from .desk_mover import MotionController
+from .command import ControlCommand
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncLinakDesk:
+    """Linak desk driven by asyncio event loop.
+
+    Desk state, initialization and motion control are shared with 'LinakDesk' (available
+    through 'desk' property), but no 'NotificationHandler' thread is started -- notifications
+    are processed by the event loop. Blocking steps (initialization, GATT writes) run in
+    executor of 'AsyncBTLEConnection', moving desk has 'MotionController' thread while
+    the motion lasts.
+
+    Usage:
+        desk = AsyncLinakDesk(mac)
+        await desk.connect()
+        await desk.move_to_cm(100)
+        async for hs in desk.height_speed_updates():
+            print(hs)
+    """
+
+    logger = None
+
+
+    def __init__(self, bdaddr, peripheralFactory=None, executor=None, gattCache=None, stateCache=None):
+        """
+        :param executor: executor of blocking GATT operations, see 'AsyncBTLEConnection'
+        """
+        self._desk = LinakDesk(bdaddr, peripheralFactory, gattCache, stateCache)
+        ## notifications are handled by event loop instead of thread
+        self._desk._notificationHandler = None
+        self._conn = AsyncBTLEConnection(bdaddr, executor=executor, connection=self._desk._conn)
+        self._loop = None
+        self._streams = []
+
+    @property
+    def desk(self):
+        """Synchronous 'LinakDesk' object holding the state."""
+        return self._desk
+
+    @property
+    def connection(self):
+        return self._conn
+
+    @property
+    def name(self):
+        return self._desk._name
+
+    @property
+    def height_speed(self):
+        return self._desk._height_speed
+
+    @property
+    def current_height(self):
+        return self._desk._height_speed.height
+
+    @property
+    def current_speed(self):
+        return self._desk._height_speed.speed
+
+    @property
+    def current_height_with_offset(self):
+        return self._desk._with_desk_offset( self._desk._height_speed.height )
+
+    @property
+    def desk_offset(self):
+        return self._desk._desk_offset
+
+    @property
+    def capabilities(self):
+        return self._desk._capabilities
+
+    def favorite_position(self, favNumber):
+        return getattr( self._desk, '_fav_position_' + str(favNumber), None )
+
+    def is_connected(self):
+        return self._conn.isConnected()
+
+    def __str__(self):
+        return "%s[%s]" % (self.__class__.__name__, self._conn.mac)
+
+    ## ================= connection =================
+
+    async def connect(self, timeout=None, required=None, lazy=False):
+        """Connect and read state of the device. Returns 'InitResult'.
+
+        Executes the same 'InitPipeline' as 'LinakDesk.connect()' (in executor), raises
+        error of failed mandatory step.
+        """
+        self.logger.debug("Initializing the device")
+        self._loop = asyncio.get_running_loop()
+        desk = self._desk
+        desk.set_position_change_callback( self._height_changed )
+        await self._conn.connect()
+        pipeline = InitPipeline( desk, timeout, required, lazy )
+        desk._pipeline = pipeline
+        result = await self._conn.run( pipeline.run )
+        if result.error != None:
+            raise result.error
+        return result
+
+    async def fetch(self, varName):
+        """Returns state variable of desk (e.g. '_capabilities'), fetched from device if it was deferred."""
+        return await self._conn.run( self._desk._wait_for_variable, varName )
+
+    async def disconnect(self):
+        await self._conn.disconnect()
+
+    ## ================= DPG =================
+
+    async def read_dpg(self, dpgCommandType):
+        """Send DPG read command. Returns decoded response."""
+        return await self._conn.send_dpg_read_command( dpgCommandType )
+
+    async def write_dpg(self, dpgCommandType, data):
+        return await self._conn.send_dpg_write_command( dpgCommandType, data )
+
+    ## ================= moving =================
+
+    async def move_to_cm(self, cm, timeout=None):
+        calculated_raw = datatype.DeskPosition.raw_from_cm(cm - self._desk._desk_offset.cm)
+        return await self.move_to_raw( calculated_raw, timeout )
+
+    async def move_to_fav(self, favNumber, timeout=None):
+        fav = self.favorite_position( favNumber )
+        if fav == None or fav.position == None:
+            raise DPGCommandReadError('Favorite with position: %d does not exists' % favNumber)
+        return await self.move_to_raw( fav.position.raw, timeout )
+
+    async def move_to_raw(self, raw_value, timeout=None):
+        """Move desk to position. Returns True if target position was reached.
+
+        Motion is driven by 'MotionController' of synchronous desk (keep-alive, tolerance
+        and time limit), cancelling the coroutine cancels the motion.
+        """
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        def on_done(motion):
+            if loop.is_closed() == False:
+                loop.call_soon_threadsafe( self._set_future, finished )
+        motion = await self._conn.run( self._desk.move_to_raw, raw_value, False, None, timeout )
+        motion.add_done_callback( on_done )
+        try:
+            await finished
+        except asyncio.CancelledError:
+            await self._conn.run( motion.cancel )
+            raise
+        return motion.state == MotionController.ARRIVED
+
+    @staticmethod
+    def _set_future(future):
+        if future.done() == False:
+            future.set_result( True )
+
+    async def stop(self):
+        """Cancel motion and stop the desk."""
+        await self._conn.run( self._desk.stopMoving )
+
+    async def move_up(self):
+        await self._conn.send_control_command( ControlCommand.MOVE_1_UP )
+
+    async def move_down(self):
+        await self._conn.send_control_command( ControlCommand.MOVE_1_DOWN )
+
+    ## ================= height stream =================
+
+    async def height_speed_updates(self):
+        """Asynchronous iterator over 'HeightSpeed' notifications."""
+        queue = self._add_stream()
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._remove_stream( queue )
+
+    def _add_stream(self):
+        queue = asyncio.Queue()
+        self._streams.append( queue )
+        return queue
+
+    def _remove_stream(self, queue):
+        if queue in self._streams:
+            self._streams.remove( queue )
+
+    def _height_changed(self):
+        ## called from thread handling notifications
+        hs = self._desk._height_speed
+        loop = self._loop
+        if loop == None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe( self._publish, hs )
+
+    def _publish(self, hs):
+        for queue in list(self._streams):
+            queue.put_nowait( hs )
+
+AsyncLinakDesk.logger = _LOGGER.getChild(AsyncLinakDesk.__name__)
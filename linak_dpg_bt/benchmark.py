@@ -0,0 +1,342 @@
+#
+# Latency benchmarks of the library run against simulated desk.
+#
+# Usage:
+#     python3 -m linak_dpg_bt.benchmark --iterations 20 --latency 0.01 --output bench.json
+#
+
+import sys
+import json
+import struct
+import logging
+import argparse
+import tempfile
+import threading
+from time import sleep, perf_counter
+
+from .linak_device import LinakDesk
+import linak_dpg_bt.datatype as datatype
+import linak_dpg_bt.linak_service as linak_service
+from .simulator import SimulatedDesk
+from .command import DPGCommandType
+from .gatt_cache import GattCache
+from .state_cache import DeskStateCache
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+BENCHMARK_MAC = "AA:BB:CC:DD:EE:FF"
+
+
+def percentile(samples, pct):
+    """Percentile with linear interpolation between closest ranks."""
+    if len(samples) < 1:
+        return None
+    ordered = sorted(samples)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    fraction = rank - lower
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+
+def summarize(samples):
+    """Convert list of durations (in seconds) to dict of statistics (in milliseconds)."""
+    if len(samples) < 1:
+        return { "count": 0 }
+    toMs = lambda value: round(value * 1000.0, 3)
+    return {
+        "count": len(samples),
+        "mean":  toMs( sum(samples) / len(samples) ),
+        "min":   toMs( min(samples) ),
+        "max":   toMs( max(samples) ),
+        "p50":   toMs( percentile(samples, 50) ),
+        "p95":   toMs( percentile(samples, 95) ),
+        "p99":   toMs( percentile(samples, 99) ),
+    }
+
+
+class DeskBenchmark:
+    """Measures wall-clock latency of the main desk operations."""
+
+    logger = None
+
+    ## time limit of waiting for single notification
+    WAIT_TIMEOUT = 10.0
+
+
+    def __init__(self, iterations=10, latency=0.01, jitter=0.005, dropRate=0.0, notifyInterval=0.1):
+        self.iterations = iterations
+        self.latency = latency
+        self.jitter = jitter
+        self.dropRate = dropRate
+        self.notifyInterval = notifyInterval
+        self.cases = [
+                      ("initialize", self.bench_initialize),
+                      ("initialize_gatt_cached", self.bench_initialize_cached),
+                      ("initialize_state_cached", self.bench_initialize_state_cached),
+                      ("initialize_height_ready", self.bench_initialize_height_ready),
+                      ("lazy_current_height", self.bench_lazy_current_height),
+                      ("lazy_height_with_offset", self.bench_lazy_height_with_offset),
+                      ("dpg_read", self.bench_dpg_read),
+                      ("dpg_write", self.bench_dpg_write),
+                      ("move_to_first_notification", self.bench_move_to),
+                      ("move_to_arrival", self.bench_move_to_arrival),
+                      ("stop_to_zero_speed", self.bench_stop_moving),
+                      ("decode_height_speed_x1000", self.bench_decode_height_speed),
+                      ("height_notification_x1000", self.bench_height_notification),
+                     ]
+
+    def config(self):
+        return {
+            "iterations": self.iterations,
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "drop_rate": self.dropRate,
+            "notify_interval": self.notifyInterval,
+        }
+
+    def create_simulator(self):
+        return SimulatedDesk(latency=self.latency, jitter=self.jitter, dropRate=self.dropRate,
+                             notifyInterval=self.notifyInterval, speed=2000)
+
+    def run(self, names=None):
+        results = {}
+        for name, function in self.cases:
+            if names and name not in names:
+                continue
+            self.logger.info( "running benchmark: %s", name )
+            samples = function()
+            results[name] = summarize( samples )
+        return { "unit": "ms", "config": self.config(), "results": results }
+
+    ## ================= cases =================
+
+    def bench_initialize(self):
+        samples = []
+        sim = self.create_simulator()
+        for _ in range(self.iterations):
+            desk = LinakDesk(BENCHMARK_MAC, sim.createPeripheral)
+            startTime = perf_counter()
+            desk._connect()
+            samples.append( perf_counter() - startTime )
+            desk.disconnect()
+        return samples
+
+    def bench_initialize_height_ready(self):
+        """Time until current height (with offset) is known."""
+        samples = []
+        sim = self.create_simulator()
+        for _ in range(self.iterations):
+            desk = LinakDesk(BENCHMARK_MAC, sim.createPeripheral)
+            result = desk.connect( required=["height", "desk_offset"] )
+            if result.ready:
+                samples.append( result.readyTime )
+            desk.disconnect()
+        return samples
+
+    def bench_lazy_current_height(self):
+        """Connecting in lazy mode and reading current height."""
+        return self._bench_lazy( lambda desk: desk.current_height )
+
+    def bench_lazy_height_with_offset(self):
+        """Connecting in lazy mode and reading height with offset (state needed by 'move_to_cm()')."""
+        return self._bench_lazy( lambda desk: desk.current_height_with_offset )
+
+    def _bench_lazy(self, function):
+        samples = []
+        sim = self.create_simulator()
+        for _ in range(self.iterations):
+            desk = LinakDesk(BENCHMARK_MAC, sim.createPeripheral)
+            startTime = perf_counter()
+            desk.connect( lazy=True )
+            function( desk )
+            samples.append( perf_counter() - startTime )
+            desk.disconnect()
+        return samples
+
+    def bench_initialize_cached(self):
+        return self._bench_initialize_with_cache( False )
+
+    def bench_initialize_state_cached(self):
+        return self._bench_initialize_with_cache( True )
+
+    def _bench_initialize_with_cache(self, withState):
+        samples = []
+        sim = self.create_simulator()
+        with tempfile.TemporaryDirectory() as tmpDir:
+            def create_desk():
+                stateCache = None
+                if withState:
+                    stateCache = DeskStateCache(tmpDir + "/state.json")
+                return LinakDesk(BENCHMARK_MAC, sim.createPeripheral, GattCache(tmpDir + "/gatt.json"), stateCache)
+            ## fill cache
+            desk = create_desk()
+            desk._connect()
+            desk.disconnect()
+            for _ in range(self.iterations):
+                desk = create_desk()
+                startTime = perf_counter()
+                desk._connect()
+                samples.append( perf_counter() - startTime )
+                desk.disconnect()
+        return samples
+
+    def bench_dpg_read(self):
+        return self._bench_connected( lambda desk: desk._conn.send_dpg_read_command( DPGCommandType.GET_CAPABILITIES ) )
+
+    def bench_dpg_write(self):
+        return self._bench_connected( lambda desk: desk._conn.send_dpg_write_command( DPGCommandType.USER_ID, LinakDesk.CLIENT_ID ) )
+
+    def bench_move_to(self):
+        sim = self.create_simulator()
+        desk = self._connect_desk( sim )
+        notified = threading.Event()
+        desk.set_position_change_callback( notified.set )
+        samples = []
+        try:
+            for i in range(self.iterations):
+                target = 4000 if i % 2 == 0 else 1000
+                notified.clear()
+                startTime = perf_counter()
+                desk.moveTo( target )
+                if notified.wait( self.WAIT_TIMEOUT ):
+                    samples.append( perf_counter() - startTime )
+                desk.stopMoving()
+                self._wait_stopped( sim )
+        finally:
+            desk.disconnect()
+        return samples
+
+    def bench_move_to_arrival(self):
+        """Closed-loop move over 300 mm, from command until target is reached."""
+        sim = self.create_simulator()
+        desk = self._connect_desk( sim )
+        samples = []
+        try:
+            for i in range(self.iterations):
+                target = 4000 if i % 2 == 0 else 1000
+                writesBefore = sim.writeCounter
+                startTime = perf_counter()
+                motion = desk.move_to_raw( target )
+                if motion.state == motion.ARRIVED:
+                    samples.append( perf_counter() - startTime )
+                self.logger.debug( "move to %s: %s, desk writes: %s", target, motion, sim.writeCounter - writesBefore )
+        finally:
+            desk.disconnect()
+        return samples
+
+    def bench_stop_moving(self):
+        sim = self.create_simulator()
+        desk = self._connect_desk( sim )
+        stopped = threading.Event()
+        def speedChanged():
+            if desk.current_speed.raw == 0:
+                stopped.set()
+        desk.set_speed_change_callback( speedChanged )
+        samples = []
+        try:
+            for i in range(self.iterations):
+                target = 6000 if i % 2 == 0 else 0
+                desk.moveTo( target )
+                if self._wait_moving( sim ) == False:
+                    continue
+                stopped.clear()
+                startTime = perf_counter()
+                desk.stopMoving()
+                if stopped.wait( self.WAIT_TIMEOUT ):
+                    samples.append( perf_counter() - startTime )
+        finally:
+            desk.disconnect()
+        return samples
+
+    ## ================= micro benchmarks =================
+
+    ## notifications per sample -- sample in ms equals cost of single notification in us
+    MICRO_BATCH = 1000
+
+    def bench_decode_height_speed(self):
+        """Decoding of HEIGHT_SPEED payload."""
+        payload = struct.pack('<Hh', 3000, 380)
+        return self._bench_batch( lambda: datatype.HeightSpeed.from_bytes( payload ) )
+
+    def bench_height_notification(self):
+        """Whole HEIGHT_SPEED notification callback of 'LinakDesk' (decoding, history, waking waiters)."""
+        desk = LinakDesk(BENCHMARK_MAC, self.create_simulator().createPeripheral)
+        handle = linak_service.Characteristic.HEIGHT_SPEED.handle()
+        payload = struct.pack('<Hh', 3000, 380)
+        return self._bench_batch( lambda: desk._handle_heigh_speed_notification( handle, payload ) )
+
+    def _bench_batch(self, function):
+        samples = []
+        for _ in range(self.iterations):
+            startTime = perf_counter()
+            for _ in range(self.MICRO_BATCH):
+                function()
+            samples.append( perf_counter() - startTime )
+        return samples
+
+    ## ================= utils =================
+
+    def _bench_connected(self, function):
+        sim = self.create_simulator()
+        desk = self._connect_desk( sim )
+        samples = []
+        try:
+            for _ in range(self.iterations):
+                startTime = perf_counter()
+                function( desk )
+                samples.append( perf_counter() - startTime )
+        finally:
+            desk.disconnect()
+        return samples
+
+    def _connect_desk(self, sim):
+        desk = LinakDesk(BENCHMARK_MAC, sim.createPeripheral)
+        desk._connect()
+        return desk
+
+    def _wait_moving(self, sim):
+        for _ in range( int(self.WAIT_TIMEOUT / 0.005) ):
+            if sim.isMoving():
+                return True
+            sleep(0.005)
+        return False
+
+    def _wait_stopped(self, sim):
+        for _ in range( int(self.WAIT_TIMEOUT / 0.005) ):
+            if sim.isMoving() == False:
+                return True
+            sleep(0.005)
+        return False
+
+DeskBenchmark.logger = _LOGGER.getChild(DeskBenchmark.__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Linak desk latency benchmarks')
+    parser.add_argument('-i', '--iterations', action='store', type=int, default=10, help='Number of samples of each case' )
+    parser.add_argument('--latency', action='store', type=float, default=0.01, help='One way radio latency in seconds' )
+    parser.add_argument('--jitter', action='store', type=float, default=0.005, help='Maximum random latency jitter in seconds' )
+    parser.add_argument('--droprate', action='store', type=float, default=0.0, help='Probability of losing notification' )
+    parser.add_argument('-c', '--case', action='append', default=None, help='Run only given case (can be repeated)' )
+    parser.add_argument('-o', '--output', action='store', default=None, help='Store JSON results to file' )
+
+    args = parser.parse_args(argv)
+
+    bench = DeskBenchmark( iterations=args.iterations, latency=args.latency, jitter=args.jitter, dropRate=args.droprate )
+    results = bench.run( args.case )
+
+    output = json.dumps( results, indent=2, sort_keys=True )
+    if args.output is not None:
+        with open( args.output, "w" ) as outFile:
+            outFile.write( output + "\n" )
+    print( output )
+    return results
+
+
+if __name__ == '__main__':
+    main( sys.argv[1:] )
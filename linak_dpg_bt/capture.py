@@ -0,0 +1,184 @@
+#
+# Capture of GATT traffic and its offline replay.
+#
+# File: header 'LINAKCAP' + version byte, then records:
+#     '<dBHH' (seconds since start of capture, direction, handle, payload length) + payload
+# Directions are the same as in 'WireTrace' (WRITE, NOTIFY, READ).
+#
+
+import struct
+import logging
+import threading
+from collections import deque
+from time import monotonic, sleep
+
+from .simulator import SimulatedDesk
+from .wire_trace import WireTrace
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+MAGIC = b"LINAKCAP\x01"
+RECORD_HEADER = struct.Struct('<dBHH')
+
+
+class CaptureRecord:
+    """Single captured frame."""
+
+    __slots__ = ('timestamp', 'direction', 'handle', 'data')
+
+    def __init__(self, timestamp, direction, handle, data):
+        self.timestamp = timestamp
+        self.direction = direction
+        self.handle = handle
+        self.data = data
+
+    def __str__(self):
+        return "%s[%.6f %s 0x%04X %s]" % (self.__class__.__name__, self.timestamp,
+                                          WireTrace.DIRECTION_NAMES.get(self.direction, "?"), self.handle, self.data.hex())
+
+
+class CaptureWriter:
+    """Writes frames passed to 'record()' to capture file.
+
+    Can be set as 'BTLEConnection.capture' (see 'LinakDesk.start_capture()').
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open( path, "wb" )
+        self._file.write( MAGIC )
+        self._startTime = monotonic()
+        self.count = 0
+
+    def record(self, direction, handle, data):
+        timestamp = monotonic() - self._startTime
+        with self._lock:
+            if self._file == None:
+                return
+            self._file.write( RECORD_HEADER.pack( timestamp, direction, handle, len(data) ) )
+            self._file.write( data )
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file != None:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    """Returns list of 'CaptureRecord' objects stored in file."""
+    with open( path, "rb" ) as captureFile:
+        content = captureFile.read()
+    if content[0:len(MAGIC)] != MAGIC:
+        raise ValueError("not a capture file: %s" % path)
+    records = []
+    offset = len(MAGIC)
+    while offset + RECORD_HEADER.size <= len(content):
+        timestamp, direction, handle, length = RECORD_HEADER.unpack_from( content, offset )
+        offset += RECORD_HEADER.size
+        if offset + length > len(content):
+            ## truncated record
+            break
+        records.append( CaptureRecord( timestamp, direction, handle, content[offset:offset + length] ) )
+        offset += length
+    return records
+
+
+def feed_notifications(connection, records, speed=None):
+    """Pass recorded notifications to notification callbacks of 'BTLEConnection'.
+
+    Bypasses radio link -- exercises decoding and dispatching only.
+    :param speed: replay speed relative to real time, as fast as possible if None
+    Returns number of delivered notifications.
+    """
+    count = 0
+    startTime = monotonic()
+    firstTimestamp = None
+    for record in records:
+        if record.direction != WireTrace.NOTIFY:
+            continue
+        if speed != None:
+            if firstTimestamp == None:
+                firstTimestamp = record.timestamp
+            delay = (record.timestamp - firstTimestamp) / speed - (monotonic() - startTime)
+            if delay > 0:
+                sleep( delay )
+        connection.handleNotification( record.handle, record.data )
+        count += 1
+    return count
+
+
+class ReplayDesk(SimulatedDesk):
+    """Simulated desk answering with traffic from capture.
+
+    Every write is matched with next recorded write of the same handle and value. Notifications
+    recorded after it (up to next write) are sent back, with original delays divided by 'speed'
+    (without delays if 'speed' is None). Reads return recorded values of handle in order.
+    Writes not found in capture are handled by simulator and counted in 'mismatches'.
+    """
+
+    logger = None
+
+
+    def __init__(self, records, speed=None, **kwargs):
+        SimulatedDesk.__init__(self, **kwargs)
+        self.records = list(records)
+        self.speed = speed
+        self.mismatches = 0
+        self._cursor = 0
+        self._reads = {}
+        for record in self.records:
+            if record.direction == WireTrace.READ:
+                self._reads.setdefault( record.handle, deque() ).append( record.data )
+
+    @classmethod
+    def from_file(cls, path, speed=None, **kwargs):
+        return cls( read_capture( path ), speed, **kwargs )
+
+    def read(self, handle):
+        with self._lock:
+            values = self._reads.get( handle )
+            if values:
+                if len(values) > 1:
+                    return values.popleft()
+                ## last value stays valid
+                return values[0]
+        return SimulatedDesk.read(self, handle)
+
+    def write(self, handle, value):
+        value = bytes(value)
+        with self._lock:
+            index = self._findWrite( handle, value )
+            if index == None:
+                self.mismatches += 1
+            else:
+                self._cursor = index + 1
+        if index == None:
+            self.logger.debug( "write not found in capture: 0x%04X %s", handle, value.hex() )
+            SimulatedDesk.write(self, handle, value)
+            return
+        with self._lock:
+            self.writeCounter += 1
+        writeTime = self.records[index].timestamp
+        for record in self.records[index + 1:]:
+            if record.direction == WireTrace.WRITE:
+                break
+            if record.direction != WireTrace.NOTIFY:
+                continue
+            delay = 0.0
+            if self.speed != None:
+                delay = (record.timestamp - writeTime) / self.speed
+            self._scheduler.schedule( delay, self.notify, record.handle, record.data )
+
+    def _findWrite(self, handle, value):
+        for index in range(self._cursor, len(self.records)):
+            record = self.records[index]
+            if record.direction == WireTrace.WRITE and record.handle == handle and record.data == value:
+                return index
+        return None
+
+ReplayDesk.logger = _LOGGER.getChild(ReplayDesk.__name__)
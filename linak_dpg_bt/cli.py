@@ -2,68 +2,204 @@
 #
 #
 
+import os
 import logging
 import click
 import re
 
 from .datatype.desk_position import DeskPosition
-from .linak_device import LinakDesk
+from .fleet import DeskFleet
+from .gatt_cache import GattCache
+from .state_cache import DeskStateCache
+from .daemon import DeskDaemon, DaemonClient, COMMANDS, default_socket_path
+from .metrics import MetricsServer
+from .synchronized import enable_lock_profiling
 
 
-pass_desk = click.make_pass_decorator(LinakDesk)
+class LocalBackend:
+    """Executes commands on desks connected by this process."""
 
+    def __init__(self, fleet):
+        self.fleet = fleet
 
-def validate_mac(ctx, param, mac):
-    if re.match('^([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$', mac) is None:
-        raise click.BadParameter(mac + ' is no valid mac address')
-    return mac
+    def __len__(self):
+        return len(self.fleet)
+
+    def run(self, command, **args):
+        function = COMMANDS[command]
+        return self.fleet.run( lambda desk: function(desk, **args) )
+
+
+class DaemonBackend:
+    """Forwards commands to running daemon."""
+
+    def __init__(self, client, macs):
+        self.client = client
+        self.macs = list(macs)
+
+    def __len__(self):
+        return len(self.macs)
+
+    def run(self, command, **args):
+        return self.client.request( command, self.macs, **args )
+
+
+def validate_mac(ctx, param, macs):
+    for mac in macs:
+        if re.match('^([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$', mac) is None:
+            raise click.BadParameter(mac + ' is no valid mac address')
+    return macs
+
+
+def echo_result(backend, result, message):
+    if result.ok == False:
+        click.echo("[%s] Error: %s" % (result.mac, result.error), err=True)
+    elif len(backend) > 1:
+        click.echo("[%s] %s" % (result.mac, message))
+    else:
+        click.echo(message)
+
+
+def write_wire_trace(fleet, path):
+    with open(path, "w") as traceFile:
+        for mac in fleet.macs():
+            traceFile.write( "## %s\n" % mac )
+            fleet.desk( mac ).wire_trace.dump( traceFile )
+
+
+def stop_captures(fleet):
+    for desk in fleet:
+        desk.stop_capture()
+
+
+def write_lock_report(profiler, path):
+    with open(path, "w") as reportFile:
+        profiler.report( reportFile )
 
 
 @click.group(invoke_without_command=True)
-@click.option('-b', '--bdaddr', required=True, callback=validate_mac)
+@click.option('-b', '--bdaddr', required=True, multiple=True, callback=validate_mac,
+              help='Desk address, can be given multiple times')
+@click.option('-j', '--jobs', default=8, type=click.IntRange(1, 64),
+              help='Number of desks handled at the same time')
+@click.option('--gatt-cache', 'gattCachePath', default=None, type=click.Path(dir_okay=False),
+              help='File caching GATT services of desks, speeds up connecting')
+@click.option('--state-cache', 'stateCachePath', default=None, type=click.Path(dir_okay=False),
+              help='File caching settings of desks (offset, favorites, reminders)')
+@click.option('--lazy/--eager', default=False,
+              help='Read only state needed by command')
+@click.option('--telemetry-dir', 'telemetryDir', default=None, type=click.Path(file_okay=False),
+              help='Directory of binary logs of height/speed and DPG events (one file per desk)')
+@click.option('--wire-trace', 'wireTracePath', default=None, type=click.Path(dir_okay=False),
+              help='Record raw BLE frames and write them to file on exit')
+@click.option('--capture-dir', 'captureDir', default=None, type=click.Path(file_okay=False),
+              help='Store GATT traffic of desks to capture files (for offline replay)')
+@click.option('--lock-profile', 'lockProfilePath', default=None, type=click.Path(dir_okay=False),
+              help='Profile contention of internal locks and write report to file on exit')
+@click.option('--socket', 'socketPath', default=None, type=click.Path(dir_okay=False),
+              help='Socket of daemon, default: ' + default_socket_path())
+@click.option('--use-daemon/--no-daemon', 'useDaemon', default=True,
+              help='Send commands to daemon if it is running')
 @click.option('--debug/--normal', default=False)
 @click.pass_context
-def cli(ctx, bdaddr, debug):
+def cli(ctx, bdaddr, jobs, gattCachePath, stateCachePath, lazy, telemetryDir, wireTracePath, captureDir, lockProfilePath,
+        socketPath, useDaemon, debug):
     if debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
 
-    desk = LinakDesk(bdaddr)
-    desk.read_dpg_data()
+    serveDaemon = (ctx.invoked_subcommand == "daemon")
+    if serveDaemon == False and useDaemon:
+        client = DaemonClient(socketPath)
+        if client.available():
+            ctx.obj = DaemonBackend(client, bdaddr)
+            if ctx.invoked_subcommand is None:
+                ctx.invoke(state)
+            return
+
+    if lockProfilePath != None:
+        profiler = enable_lock_profiling()
+        ctx.call_on_close( lambda: write_lock_report(profiler, lockProfilePath) )
+
+    gattCache = None
+    if gattCachePath != None:
+        gattCache = GattCache(gattCachePath)
+    stateCache = None
+    if stateCachePath != None:
+        stateCache = DeskStateCache(stateCachePath)
+
+    fleet = DeskFleet(bdaddr, maxConcurrency=jobs, gattCache=gattCache, stateCache=stateCache, lazy=lazy,
+                      telemetryDir=telemetryDir)
+    ctx.call_on_close( fleet.close )
+    if wireTracePath != None:
+        for desk in fleet:
+            desk.enable_wire_trace()
+        ctx.call_on_close( lambda: write_wire_trace(fleet, wireTracePath) )
+    if captureDir != None:
+        os.makedirs( captureDir, exist_ok=True )
+        for mac in fleet.macs():
+            fleet.desk( mac ).start_capture( os.path.join( captureDir, mac.upper().replace(":", "") + ".cap" ) )
+        ctx.call_on_close( lambda: stop_captures(fleet) )
+
+    for result in fleet.connect_all():
+        if result.ok == False:
+            click.echo("[%s] Connecting failed: %s" % (result.mac, result.error), err=True)
+            fleet.remove( result.mac )
+            continue
+        if lazy == False and serveDaemon == False:
+            print( "State:", fleet.desk(result.mac) )
     
-    print( "State:", desk)
-    
-    ctx.obj = desk
+    ctx.obj = LocalBackend(fleet)
 
     if ctx.invoked_subcommand is None:
         ctx.invoke(state)
 
 
 @cli.command()
-@pass_desk
-def name(desk):
-    click.echo("Desk name: %s" % desk.name)
+@click.pass_obj
+def name(backend):
+    for result in backend.run( "name" ):
+        echo_result(backend, result, "Desk name: %s" % result.value)
 
 
 @cli.command()
-@pass_desk
-def get_height(desk):
-    click.echo("Desk position: %s" % desk.current_height_with_offset.human_cm)
+@click.pass_obj
+def get_height(backend):
+    for result in backend.run( "get_height" ):
+        echo_result(backend, result, "Desk position: %s" % result.value)
 
 
 @cli.command()
 @click.option('-t', '--target', required=True, type=click.IntRange(1, 200))
-@pass_desk
-def move_to(desk, target):
-  desk.move_to_cm(target)
+@click.pass_obj
+def move_to(backend, target):
+    for result in backend.run( "move_to", target=target ):
+        if result.ok == False:
+            echo_result(backend, result, None)
 
 @cli.command()
 @click.pass_context
 def state(ctx):
     """ Prints out all available information. """
-    desk = ctx.obj
-    click.echo(desk)
+    backend = ctx.obj
+    for result in backend.run( "state" ):
+        echo_result(backend, result, result.value)
+
+
+@cli.command()
+@click.option('--metrics-port', 'metricsPort', default=None, type=click.IntRange(1, 65535),
+              help='Serve metrics in Prometheus text format on localhost')
+@click.option('--supervise/--no-supervise', default=True,
+              help='Reconnect desks automatically after link loss')
+@click.pass_context
+def daemon(ctx, metricsPort, supervise):
+    """ Keeps connections open and serves other invocations of the command. """
+    backend = ctx.obj
+    socketPath = ctx.parent.params["socketPath"]
+    if metricsPort != None:
+        ctx.call_on_close( MetricsServer( port=metricsPort ).start().stop )
+    DeskDaemon(backend.fleet, socketPath, supervise).serve_forever()
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@
 
 import struct
 import logging
+import threading
 
 from enum import Enum, unique
 
@@ -13,6 +14,10 @@ import linak_dpg_bt.linak_service as linak_service
 _LOGGER = logging.getLogger(__name__)
 
 
+class DPGCommandTimeoutError(Exception):
+    pass
+
+
 @unique
 class DPGCommandType(Enum):
     ## contains tow accessors: 'name' and 'value'
@@ -48,22 +53,25 @@ class DPGCommandType(Enum):
 
     @classmethod
     def findType(cls, value):
-        for item in DPGCommandType:
-            if item.value == value:
-                return item
-        return None
+        return _COMMAND_TYPE_BY_ID.get( value )
 
     @classmethod
     def getMemoryPosition(cls, number):
-        if number == 1:
-            return cls.GET_SET_MEMORY_POSITION_1
-        if number == 2:
-            return cls.GET_SET_MEMORY_POSITION_2
-        if number == 3:
-            return cls.GET_SET_MEMORY_POSITION_3
-        if number == 4:
-            return cls.GET_SET_MEMORY_POSITION_4
-        return None
+        return _MEMORY_POSITION_BY_NUMBER.get( number )
+
+    @classmethod
+    def getMemoryPositionIndex(cls, commandType):
+        """Returns number of favorite position of command, None for other commands."""
+        return _MEMORY_POSITION_NUMBER.get( commandType )
+
+
+## lookup tables of command types
+_COMMAND_TYPE_BY_ID = { item.value: item for item in DPGCommandType }
+_MEMORY_POSITION_BY_NUMBER = { 1: DPGCommandType.GET_SET_MEMORY_POSITION_1,
+                               2: DPGCommandType.GET_SET_MEMORY_POSITION_2,
+                               3: DPGCommandType.GET_SET_MEMORY_POSITION_3,
+                               4: DPGCommandType.GET_SET_MEMORY_POSITION_4 }
+_MEMORY_POSITION_NUMBER = { item: number for number, item in _MEMORY_POSITION_BY_NUMBER.items() }
 
 
 class DPGCommand():    
@@ -110,6 +118,11 @@ class DPGCommand():
     def __init__(self, commandType, data = None):
         self.type = commandType
         self.data = data
+        self._completed = threading.Event()
+        self._result = None
+        self._error = None
+        self._doneCallbacks = []
+        self._callbacksLock = threading.Lock()
      
     def __eq__(self, other):
         if isinstance(other, int):
@@ -133,6 +146,45 @@ class DPGCommand():
     def is_read_operation(self):
         return (self.data == None)
     
+    ## ========== completion ==========
+    
+    def complete(self, result=True):
+        """Mark command as answered. 'result' is decoded response payload."""
+        self._result = result
+        self._set_completed()
+    
+    def fail(self, error):
+        """Mark command as answered with error. Error will be raised in sending thread."""
+        self._error = error
+        self._set_completed()
+    
+    def add_done_callback(self, function):
+        """Call 'function(command)' on completion (immediately if already completed)."""
+        with self._callbacksLock:
+            if self._completed.is_set() == False:
+                self._doneCallbacks.append( function )
+                return
+        function( self )
+    
+    def _set_completed(self):
+        with self._callbacksLock:
+            self._completed.set()
+            callbacks = self._doneCallbacks
+            self._doneCallbacks = []
+        for call in callbacks:
+            call( self )
+    
+    def is_completed(self):
+        return self._completed.is_set()
+    
+    def wait_for_completion(self, timeout=None):
+        return self._completed.wait( timeout )
+    
+    def result(self):
+        if self._error != None:
+            raise self._error
+        return self._result
+    
     def __str__(self):
         return 'DPGCommand[%s, %s]' % (self.type.name, self.data)
 
@@ -7,15 +7,23 @@ Handles Connection duties (reconnecting etc.) transparently.
 
 import logging
 import struct
-from time import sleep
+import select
+import threading
+from time import sleep, monotonic
 from functools import wraps
 
 from bluepy import btle
 
-from .command import DPGCommand
+from .command import DPGCommand, DPGCommandTimeoutError
+from .gatt_cache import GattTable
+from .wire_trace import HexDump, WireTrace
+from .metrics import DeskMetrics
+from .supervisor import Backoff
+from .helper_pool import PooledPeripheral
 import linak_dpg_bt.linak_service as linak_service
 import linak_dpg_bt.constants as constants
-from .synchronized import synchronized
+from .synchronized import synchronized, PriorityRLock
+from .threadcounter import getThreadName
 
 
 
@@ -32,9 +40,9 @@ def DisconnectOnException(func):
     """Decorator calling 'disconnect()' on BTLE exception."""
     
     @wraps(func)
-    def wrapper(*args):
+    def wrapper(*args, **kwargs):
         try:
-            return func(*args)
+            return func(*args, **kwargs)
         except btle.BTLEException as e:
             _LOGGER.error("bluetooth exception occurred: %s %s", type(e), e)
             connectionObj = args[0]
@@ -44,24 +52,56 @@ def DisconnectOnException(func):
 
 
 class BTLEConnection(btle.DefaultDelegate):
-    """Representation of a BTLE Connection."""
+    """Representation of a BTLE Connection.
+    
+    Radio I/O is serialized by '_methods_lock' (default lock of '@synchronized'). Motion
+    commands acquire it with priority ('_urgent_lock'), so STOP does not wait behind queued
+    DPG commands. Connection state, current DPG command and callbacks table are guarded by
+    short-held '_state_lock', so 'isConnected()', 'set_callback()' and 'disconnect()' never
+    wait for pending GATT operations.
+    """
     
     logger = None
 
 
-    def __init__(self, mac):
-        """Initialize the connection."""
+    def __init__(self, mac, peripheralFactory=None, gattCache=None, metrics=None):
+        """Initialize the connection.
+        
+        :param peripheralFactory: callable creating 'btle.Peripheral' compatible object,
+                                  e.g. 'SimulatedDesk.createPeripheral'
+        :param gattCache: 'GattCache' object allowing to skip GATT discovery on connect
+        :param metrics: 'DeskMetrics' object, metrics are stored in default registry if None
+        """
         btle.DefaultDelegate.__init__(self)
 
+        if peripheralFactory is None:
+            ## reuses bluepy-helper processes across reconnections
+            peripheralFactory = PooledPeripheral
+
+        self._methods_lock = PriorityRLock()                ## radio I/O
+        self._urgent_lock = self._methods_lock.urgent       ## radio I/O with priority
+        self._state_lock = threading.Lock()                 ## connection state and callbacks table
         self._conn = None
         self._mac = mac
+        self._peripheralFactory = peripheralFactory
+        self._gattCache = gattCache
+        self._gattTable = None
         self._callbacks = {}
+        self._notificationContext = threading.local()
         self.currentCommand = None
         self._disconnectedCallback = None
+        self._disconnectedListeners = []
+        self._connectedEvent = threading.Event()
+        self.autoConnect = True                     ## connect when used while disconnected
+        self.reactor = None                         ## 'NotificationReactor' watching connection, set by reactor
+        self.wireTrace = None                       ## 'WireTrace' recording raw frames, disabled if None
+        self.capture = None                         ## 'CaptureWriter' storing raw frames to file, disabled if None
+        if metrics == None:
+            metrics = DeskMetrics(mac)
+        self.metrics = metrics
 #         self.dpgQueue = CommandQueue(self)
         self.logger.debug("Constructed %s object: %r", self.__class__.__name__, self)
 
-    @synchronized
     def __enter__(self):
         """
         Context manager __enter__ for connecting the device
@@ -69,13 +109,19 @@ class BTLEConnection(btle.DefaultDelegate):
         :return:
         """
         
-        if self._conn != None:
-            return self
-        
-        self.connect()
+        if self.isConnected() == False:
+            if self.autoConnect == False:
+                raise ConnectionError("Not connected to %s" % self._mac)
+            self._ensure_connected()
         
         return self
 
+    @synchronized
+    def _ensure_connected(self):
+        ## other thread could connect meanwhile
+        if self._conn == None:
+            self.connect()
+
     @synchronized
     def __exit__(self, exc_type, exc_val, exc_tb):
         ### do not disconnect -- otherwise notification callbacks will be lost
@@ -89,21 +135,34 @@ class BTLEConnection(btle.DefaultDelegate):
 
     @synchronized
     @DisconnectOnException
-    def connect(self):
+    def connect(self, attempts=None):
+        """Connect to device. Raises 'ConnectionRefusedError' if all attempts failed."""
         self.disconnect()
         
+        if attempts == None:
+            attempts = constants.CONNECT_ATTEMPTS
+        backoff = Backoff( constants.CONNECT_RETRY_DELAY, constants.RECONNECT_MAX_DELAY )
         self.logger.debug("Trying to connect to %s", self._mac)
         connected = False
-        for _ in range(0,2):
+        for attempt in range(0, attempts):
+            if attempt > 0:
+                sleep( backoff.next() )
             try:
-                self._conn = btle.Peripheral()
-                self._conn.withDelegate(self)
-                self._conn.connect(self._mac, addrType='random')
+                startTime = monotonic()
+                peripheral = self._peripheralFactory()
+                peripheral.withDelegate(self)
+                peripheral.connect(self._mac, addrType='random')
+                with self._state_lock:
+                    self._conn = peripheral
+                    self._connectedEvent.set()
+                self.metrics.connected( monotonic() - startTime )
+                if self.reactor != None:
+                    self.reactor.update( self )
                 connected = True
                 break
             except btle.BTLEException as ex:
                 self.logger.debug( "Connection error: %s", ex )
-                sleep(1)
+                self.metrics.connectFailures.inc()
                 
         if connected == False:
             self.logger.error("Connection to %s failed", self._mac)
@@ -111,44 +170,112 @@ class BTLEConnection(btle.DefaultDelegate):
 
         self.logger.debug("Connected to %s", self._mac)
     
-    @synchronized
     @DisconnectOnException
     def disconnect(self):
-        if self._conn:
-            self.logger.debug("disconnecting")
-            self._conn.disconnect()
+        """Disconnect without waiting for pending I/O -- link of busy connection is closed when I/O ends."""
+        with self._state_lock:
+            peripheral = self._conn
             self._conn = None
-            if self._disconnectedCallback != None:
-                self._disconnectedCallback()
-
-    @synchronized
+            self._connectedEvent.clear()
+            listeners = list(self._disconnectedListeners)
+        if peripheral:
+            self.logger.debug("disconnecting")
+            try:
+                self._close_link( peripheral )
+            finally:
+                if self.reactor != None:
+                    self.reactor.update( self )
+                if self._disconnectedCallback != None:
+                    self._disconnectedCallback()
+                for listener in listeners:
+                    listener()
+
+    def _close_link(self, peripheral):
+        if self._methods_lock.acquire( False ):
+            try:
+                peripheral.disconnect()
+            finally:
+                self._methods_lock.release()
+            return
+        ## other thread is in the middle of I/O on the link
+        closer = threading.Thread( target=self._close_link_when_idle, args=(peripheral,), name=getThreadName("Disconnect") )
+        closer.daemon = True
+        closer.start()
+
+    def _close_link_when_idle(self, peripheral):
+        with self._methods_lock:
+            try:
+                peripheral.disconnect()
+            except btle.BTLEException as e:
+                self.logger.debug("Closing link failed: %s %s", type(e), e)
+
+    def _link(self):
+        """Returns connected peripheral. Raises 'BTLEDisconnectError' if disconnected (e.g. by other thread)."""
+        peripheral = self._conn
+        if peripheral == None:
+            raise btle.BTLEDisconnectError( "Device disconnected", None )
+        return peripheral
+
+    @synchronized("_state_lock")
     def isConnected(self):
         return (self._conn != None)
 
+    def wait_connected(self, timeout=None):
+        """Wait until connection is established. Returns False on timeout."""
+        return self._connectedEvent.wait( timeout )
+
+    @synchronized("_state_lock")
     def set_disconnected_callback(self, callback):
         self._disconnectedCallback = callback
 
+    @synchronized("_state_lock")
+    def add_disconnected_listener(self, listener):
+        """Add callable called after every disconnection (independent of disconnected callback)."""
+        self._disconnectedListeners.append( listener )
+
+    @synchronized("_state_lock")
+    def remove_disconnected_listener(self, listener):
+        if listener in self._disconnectedListeners:
+            self._disconnectedListeners.remove( listener )
+
     def handleNotification(self, handle, data):
         """Handle Callback from a Bluetooth (GATT) request."""
-        if handle in self._callbacks:
-#             self.logger.debug("Got notification from %s: %s", linak_service.Characteristic.find(handle), to_hex_string(data))
-            callback = self._callbacks[handle]
+        self._record( WireTrace.NOTIFY, handle, data )
+        self.metrics.notification( handle )
+        callback = self._callbacks.get( handle )
+        if callback != None:
+#             self.logger.debug("Got notification from %s: %s", linak_service.Characteristic.find(handle), HexDump(data))
+            self._notificationContext.active = True
             try:
                 callback(handle, data)
             except TypeError as e:
                 self.logger.error( "error: %s for %s", e, repr(callback) )
                 raise e
+            finally:
+                self._notificationContext.active = False
         else:
-            self.logger.debug("Got notification without callback from %s: %s", linak_service.Characteristic.find(handle), to_hex_string(data))
+            self.logger.debug("Got notification without callback from %s: %s", linak_service.Characteristic.find(handle), HexDump(data))
+
+    def _lock_wait_observer(self, lockName, waited):
+        """Called by '@synchronized' when connection lock was contended."""
+        self.metrics.lockWait.observe( waited )
+
+    def in_notification(self):
+        """Returns True if called from notification callback."""
+        return getattr(self._notificationContext, "active", False)
 
     @property
     def mac(self):
         """Return the MAC address of the connected device."""
         return self._mac
 
+    @synchronized("_state_lock")
     def set_callback(self, handle, function):
         """Set the callback for a Notification handle. It will be called with the parameter data, which is binary."""
-        self._callbacks[handle] = function
+        ## copy on write -- notifications are dispatched without lock
+        callbacks = dict(self._callbacks)
+        callbacks[handle] = function
+        self._callbacks = callbacks
 
     @synchronized
     @DisconnectOnException
@@ -158,8 +285,9 @@ class BTLEConnection(btle.DefaultDelegate):
             charEnum = linak_service.Characteristic.findByHandle(handle)
             if charEnum == None:
                 charEnum = handle
-            self.logger.debug("Writing request %s to %s w_resp=%s", to_hex_string(value), charEnum, with_response)
-            self._conn.writeCharacteristic(handle, value, withResponse=with_response)
+            self.logger.debug("Writing request %s to %s w_resp=%s", HexDump(value), charEnum, with_response)
+            self._trace_write(handle, value)
+            self._link().writeCharacteristic(handle, value, withResponse=with_response)
             if timeout:
                 self.logger.debug("Waiting for notifications for %s", timeout)
                 self._waitForNotifications(timeout)
@@ -175,6 +303,7 @@ class BTLEConnection(btle.DefaultDelegate):
     ## =======================================================
     
     
+    @synchronized("_state_lock")
     def handleCurrentCommand(self):
         ##return self.dpgQueue.markCommandHandled()
         oldCommand = self.currentCommand
@@ -183,46 +312,104 @@ class BTLEConnection(btle.DefaultDelegate):
         
     @synchronized
     @DisconnectOnException
-    def send_dpg_read_command(self, dpgCommandType):
+    def send_dpg_read_command(self, dpgCommandType, deadline=None):
+        """:param deadline: 'time.monotonic()' value after which no more attempts are made"""
         dpgCommand = DPGCommand.get_read_command(dpgCommandType)
-        return self._send_command_repeated(linak_service.Characteristic.DPG, dpgCommand)
+        return self._send_command_repeated(linak_service.Characteristic.DPG, dpgCommand, deadline=deadline)
     
     @synchronized
     @DisconnectOnException
-    def send_dpg_write_command(self, dpgCommandType, data):
+    def send_dpg_write_command(self, dpgCommandType, data, deadline=None):
         dpgCommand = DPGCommand.get_write_command(dpgCommandType, data)
-        return self._send_command_repeated(linak_service.Characteristic.DPG, dpgCommand)
+        return self._send_command_repeated(linak_service.Characteristic.DPG, dpgCommand, deadline=deadline)
     
     @synchronized
     @DisconnectOnException
+    def start_dpg_command(self, dpgCommand):
+        """Send DPG command without waiting for response. Response completes 'dpgCommand' object."""
+        self._set_current_command( dpgCommand )
+        self._write_command(linak_service.Characteristic.DPG, dpgCommand)
+
+    @synchronized("_state_lock")
+    def _set_current_command(self, dpgCommand):
+        self.currentCommand = dpgCommand
+
+    @synchronized("_state_lock")
+    def cancel_dpg_command(self, dpgCommand):
+        """Stop waiting for response of given command."""
+        if self.currentCommand is dpgCommand:
+            self.currentCommand = None
+
+    @synchronized
+    @DisconnectOnException
+    def write_command(self, characteristicEnum, commandObj, with_response=False):
+        """Write command to characteristic without waiting for notifications."""
+        self._write_command(characteristicEnum, commandObj, with_response)
+
+    @synchronized("_urgent_lock")
+    @DisconnectOnException
     def send_control_command(self, controlCommand):
         return self._send_command_single(linak_service.Characteristic.CONTROL, controlCommand, False)
     
-    @synchronized
+    @synchronized("_urgent_lock")
     @DisconnectOnException
     def send_directional_command(self, directionalCommand):
-        return self._send_command_single(linak_service.Characteristic.CTRL1, directionalCommand)
+        ## no waiting for notifications -- repeated move would hold I/O lock and delay STOP,
+        ## HEIGHT_SPEED notifications are handled by reactor or notification handler
+        self._write_command(linak_service.Characteristic.CTRL1, directionalCommand, True)
+        return True
     
-    def _send_command_repeated(self, characteristicEnum, commandObj, with_response = True):
-        ##self.logger.debug("Waiting for notifications for %s", timeout)
-        for rep in range(0, 3):
-            self._send_command_single(characteristicEnum, commandObj, with_response)
-            ##sleep(0.2)
-            if self.currentCommand == None:
-                ## command handled -- do not resent again
-                return True
-            
+    def _send_command_repeated(self, characteristicEnum, commandObj, with_response = True, deadline = None):
+        """Send command and wait for its response. Returns decoded response payload.
+        
+        Raises 'DPGCommandTimeoutError' if device did not respond.
+        """
+        self._set_current_command( commandObj )
+        attempts = constants.DPG_COMMAND_ATTEMPTS
+        timeout = constants.DPG_RESPONSE_TIMEOUT
+        startTime = monotonic()
+        for rep in range(0, attempts):
+            attemptTimeout = timeout
+            if deadline != None:
+                attemptTimeout = min(timeout, deadline - monotonic())
+                if attemptTimeout <= 0:
+                    break
+            if rep > 0:
+                self.metrics.retries.inc()
+            self._write_command(characteristicEnum, commandObj, with_response)
+            if self._wait_for_completion(commandObj, attemptTimeout):
+                self.metrics.command_latency( commandObj.type ).observe( monotonic() - startTime )
+                return commandObj.result()
             self.logger.debug("Did not receive response: %s", rep)
+            ## workaround for case of not coming (missing) notifications
+            self._pull_notifications()
+            if commandObj.is_completed():
+                self.metrics.command_latency( commandObj.type ).observe( monotonic() - startTime )
+                return commandObj.result()
         
-        ### here notification callback is already handled
-        ##self.logger.debug("Command handled")
-        return False
+        self.cancel_dpg_command( commandObj )
+        self.metrics.timeouts.inc()
+        raise DPGCommandTimeoutError("No response for %s after %s attempts of %ss" % (commandObj, attempts, timeout))
+
+    def _wait_for_completion(self, commandObj, timeout):
+        deadline = monotonic() + timeout
+        while commandObj.is_completed() == False:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            self._waitForNotifications( remaining )
+        return True
+
+    def _write_command(self, characteristicEnum, commandObj, with_response=True):
+        value = commandObj.wrap_command()
+        self.logger.debug("Sending %s: %s to %s w_resp=%s", commandObj, HexDump(value), characteristicEnum, with_response)
+        self._trace_write( characteristicEnum.handle(), value )
+        self._link().writeCharacteristic( characteristicEnum.handle(), value, withResponse=with_response)
                 
     ### if with_response = True then exception will be raised in case of problems
     def _send_command_single(self, characteristicEnum, commandObj, with_response=True):
-        self.currentCommand = commandObj
         value = commandObj.wrap_command()
-        self.logger.debug("Sending %s: %s to %s w_resp=%s", commandObj, to_hex_string(value), characteristicEnum, with_response)
+        self.logger.debug("Sending %s: %s to %s w_resp=%s", commandObj, HexDump(value), characteristicEnum, with_response)
         return self._write_to_characteristic( characteristicEnum.handle(), value, with_response=with_response)
     
     @synchronized
@@ -233,13 +420,45 @@ class BTLEConnection(btle.DefaultDelegate):
         
         with_response=False
         
-        self.logger.debug("Writing value %s:%s to %s w_resp=%s", type(value), to_hex_string(value), characteristicEnum, with_response)
+        self.logger.debug("Writing value %s:%s to %s w_resp=%s", type(value), HexDump(value), characteristicEnum, with_response)
         notificationHandle = characteristicEnum.handle() + 1                                ## +1 is required!
         self._write_to_characteristic( notificationHandle, value, with_response )
                 
         notification_resp_handle = characteristicEnum.handle()
         self.set_callback(notification_resp_handle, callback)
 
+    @synchronized
+    @DisconnectOnException
+    def subscribe_to_notifications(self, subscriptions):
+        """Subscribe to list of '(characteristicEnum, callback)' pairs.
+        
+        CCCD writes are sent one after another without waiting for response. Single read
+        of last CCCD confirms that all of them were processed. Returns the read value.
+        """
+        value = struct.pack('BB', 1, 0)
+        for characteristicEnum, callback in subscriptions:
+            self.logger.debug("Subscribing to %s", characteristicEnum)
+            self.set_callback(characteristicEnum.handle(), callback)
+            self._trace_write( characteristicEnum.handle() + 1, value )
+            self._link().writeCharacteristic( characteristicEnum.handle() + 1, value, withResponse=False )     ## +1 is required!
+        if len(subscriptions) < 1:
+            return None
+        lastEnum = subscriptions[-1][0]
+        return self._link().readCharacteristic( lastEnum.handle() + 1 )
+
+    def _trace_write(self, handle, value):
+        self.metrics.write( handle )
+        self._record( WireTrace.WRITE, handle, value )
+
+    def _trace_read(self, handle, value):
+        self._record( WireTrace.READ, handle, value )
+
+    def _record(self, direction, handle, data):
+        if self.wireTrace != None:
+            self.wireTrace.record( direction, handle, data )
+        if self.capture != None:
+            self.capture.record( direction, handle, data )
+
     def _write_to_characteristic(self, handle, value, with_response=True):
         succeed = self._write_to_characteristic_raw(handle, value, with_response)
         if succeed == True:
@@ -247,7 +466,8 @@ class BTLEConnection(btle.DefaultDelegate):
         return self._pull_notifications()
 
     def _write_to_characteristic_raw(self, handle, value, with_response = True):
-        self._conn.writeCharacteristic( handle, value, withResponse=with_response)
+        self._trace_write( handle, value )
+        self._link().writeCharacteristic( handle, value, withResponse=with_response)
         if with_response == True:
             timeout = max(constants.DEFAULT_TIMEOUT, 1)
 #             self.logger.debug("Wait for notifications for %s", timeout)
@@ -261,20 +481,76 @@ class BTLEConnection(btle.DefaultDelegate):
         This is workaround for case of not coming (missing) notifications -- just read something from device.
         """
         self.logger.debug("Receive notification timeout - trying to pull notification")
+        self.metrics.pulls.inc()
         handle = linak_service.Characteristic.DEVICE_NAME.handle()
-        self._conn.readCharacteristic( handle )               ## device name
-        timeout = max(constants.DEFAULT_TIMEOUT, 1)
-        self._waitForNotifications(timeout)
+        self._link().readCharacteristic( handle )               ## device name
         return True
 
+    ## ================= GATT table =================
+
+    @synchronized
+    @DisconnectOnException
+    def gatt_table(self):
+        """Returns services and characteristics of device ('GattTable').
+        
+        Table is discovered once per object (or loaded from GATT cache) and reused on reconnect.
+        """
+        if self._gattTable != None:
+            return self._gattTable
+        if self._gattCache != None:
+            self._gattTable = self._gattCache.load( self._mac )
+            if self._gattTable != None:
+                self.logger.debug("Loaded GATT table from cache: %s", self._gattTable)
+                return self._gattTable
+        self._discover_gatt_table()
+        return self._gattTable
+
+    @synchronized
+    @DisconnectOnException
+    def validate_gatt_table(self, firmware):
+        """Confirm GATT table against firmware version of device.
+        
+        Table cached for other firmware is discovered again. Returns False in that case.
+        """
+        table = self.gatt_table()
+        if table.firmware == firmware:
+            return True
+        valid = (table.firmware == None)
+        if valid == False:
+            self.logger.info("Firmware changed from %s to %s - discovering GATT table", table.firmware, firmware)
+            table = self._discover_gatt_table()
+        table.firmware = firmware
+        if self._gattCache != None:
+            self._gattCache.store( self._mac, table )
+        return valid
+
+    @synchronized
+    def invalidate_gatt_table(self):
+        """Drop known GATT table, e.g. after receiving SERVICE_CHANGED indication."""
+        self.logger.debug("Invalidating GATT table")
+        self._gattTable = None
+        if self._gattCache != None:
+            self._gattCache.invalidate( self._mac )
+
+    def _discover_gatt_table(self):
+        ## characteristics are needed only for storing in cache -- otherwise they are read lazily
+        withCharacteristics = (self._gattCache != None)
+        self._gattTable = GattTable.discover( self._link(), withCharacteristics )
+        self.logger.debug("Discovered GATT table: %s", self._gattTable)
+        return self._gattTable
+
+    def _characteristics_table(self):
+        table = self.gatt_table()
+        if table.characteristics == None:
+            table.discover_characteristics( self._link() )
+        return table
+
     def _is_characteristic_readable(self, handle):
-        #TODO: load all characteristics at connection time and cache Characteristic objects
-        charList = self._conn.getCharacteristics( startHnd=handle, endHnd=handle )
-        if len(charList) != 1:
+        readable = self._characteristics_table().isReadable( handle )
+        if readable == None:
             self.logger.warning("could not get characteristic")
             return True
-        char = charList[0]
-        return char.supportsRead()
+        return readable
 
     @synchronized
     @DisconnectOnException
@@ -284,9 +560,11 @@ class BTLEConnection(btle.DefaultDelegate):
             self.logger.debug("Reading char: %s", characteristicEnum)
 #             self.logger.debug("This: %s %s" % (self, self._conn) )
             handleValue = characteristicEnum.handle()
-            retVal = self._conn.readCharacteristic(handleValue)
-            bytesVal = bytearray(retVal)
-            self.logger.debug("Got value [%s]", to_hex_string(bytesVal) )
+            startTime = monotonic()
+            retVal = self._link().readCharacteristic(handleValue)
+            self.metrics.read_latency( handleValue ).observe( monotonic() - startTime )
+            self._trace_read( handleValue, retVal )
+            self.logger.debug("Got value [%s]", HexDump(retVal) )
             return retVal
         except btle.BTLEException as ex:
             self.logger.error("Got exception from bluepy while making a request: %s", ex)
@@ -295,7 +573,10 @@ class BTLEConnection(btle.DefaultDelegate):
             ## try to read characteristic by uuid
             uuidValue = characteristicEnum.uuid()
             self.logger.debug("trying to access characteristic by uuid: %s", uuidValue)
-            charsList = self._conn.getCharacteristics(uuid = uuidValue)
+            knownHandle = self._characteristics_table().findHandle( uuidValue )
+            if knownHandle != None and knownHandle != handleValue:
+                return self._link().readCharacteristic( knownHandle )
+            charsList = self._link().getCharacteristics(uuid = uuidValue)
             charLen = len(charsList)
             if charLen != 1:
                 raise btle.BTLEException( "unable to get single characteristic object from %s, got objects %s" %(uuidValue, charLen) )
@@ -309,9 +590,11 @@ class BTLEConnection(btle.DefaultDelegate):
         """Read a GATT Characteristic in sync mode."""
         try:
             self.logger.debug("Reading char: %s", hex(characteristicHandle))
-            retVal = self._conn.readCharacteristic(characteristicHandle)
-            bytesVal = bytearray(retVal)
-            self.logger.debug("Got value [%s]", to_hex_string(bytesVal) )
+            startTime = monotonic()
+            retVal = self._link().readCharacteristic(characteristicHandle)
+            self.metrics.read_latency( characteristicHandle ).observe( monotonic() - startTime )
+            self._trace_read( characteristicHandle, retVal )
+            self.logger.debug("Got value [%s]", HexDump(retVal) )
             return retVal
         except btle.BTLEException as ex:
             self.logger.error("Got exception from bluepy while making a request: %s", ex)
@@ -325,7 +608,7 @@ class BTLEConnection(btle.DefaultDelegate):
             uuidValue = characteristicEnum.uuid()
             self.logger.debug("Getting char: %s", characteristicEnum)
 #             self.logger.debug("This: %s %s" % (self, self._conn) )
-            chList = self._conn.getCharacteristics(uuid = uuidValue)
+            chList = self._link().getCharacteristics(uuid = uuidValue)
             if len(chList) != 1:
                 self.logger.debug("Got many values - returning None")
                 return None
@@ -335,18 +618,73 @@ class BTLEConnection(btle.DefaultDelegate):
             self.logger.error("Got exception from bluepy while making a request: %s", ex)
             raise ex
 
-    @synchronized
-    @DisconnectOnException
-    def processNotifications(self):
+    def processNotifications(self, timeout=0.5):
+        """Wait for notifications and handle them.
+        
+        Waiting is done without holding connection lock, so other threads can send
+        commands meanwhile. Lock is taken only for reading data available from device.
+        """
         if self.isConnected() == False:
             return False
-        ##self.logger.error("Starting processing")
-        self._waitForNotifications(0.5)
-        ##self.logger.error("Leaving processing")
+        fileno = self.fileno()
+        if fileno == None:
+            ## unable to wait for data outside of lock
+            self._handleAvailableNotifications( min(timeout, 0.05) )
+            return True
+        if self._waitForReadable(fileno, timeout) == False:
+            return True
+        self._handleAvailableNotifications()
         return True
 
+    def fileno(self):
+        """File descriptor readable when data from device is pending, None if not available."""
+        peripheral = self._conn
+        if peripheral == None:
+            return None
+        helper = getattr(peripheral, "_helper", None)
+        if helper != None:
+            ## bluepy-helper's output pipe
+            return helper.stdout.fileno()
+        if hasattr(peripheral, "fileno"):
+            return peripheral.fileno()
+        return None
+
+    def _waitForReadable(self, fileno, timeout):
+        try:
+            readable, _, _ = select.select( [fileno], [], [], timeout )
+            return len(readable) > 0
+        except (OSError, ValueError):
+            ## descriptor closed meanwhile (disconnected)
+            return False
+
+    def handle_available_notifications(self, blocking=True):
+        """Handle notifications already received from device.
+        
+        In non-blocking mode returns False if connection is busy (other thread holds the lock).
+        """
+        if self._methods_lock.acquire(blocking) == False:
+            return False
+        try:
+            self._handleAvailableNotifications()
+        finally:
+            self._methods_lock.release()
+        return True
+
+    @synchronized
+    @DisconnectOnException
+    def _handleAvailableNotifications(self, timeout=0.001):
+        if self._conn == None:
+            return
+        fileno = self.fileno()
+        ## data could be already consumed by other thread that held the lock
+        for _ in range(0, 32):
+            if fileno != None and self._waitForReadable(fileno, 0) == False:
+                break
+            if self._waitForNotifications( timeout ) == False:
+                break
+
     def _waitForNotifications(self, timeout):
-        return self._conn.waitForNotifications( timeout )
+        return self._link().waitForNotifications( timeout )
 
 BTLEConnection.logger = _LOGGER.getChild(BTLEConnection.__name__)
 
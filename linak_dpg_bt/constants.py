@@ -18,6 +18,27 @@ PROP_MEMORY_POSITION_2 = 0x8a
 
 
 DEFAULT_TIMEOUT = 3
+
+DPG_RESPONSE_TIMEOUT = 1.0                      # time limit of single DPG command attempt
+DPG_COMMAND_ATTEMPTS = 3
+
+CONNECT_ATTEMPTS = 2                            # attempts of single 'BTLEConnection.connect()' call
+CONNECT_RETRY_DELAY = 1.0                       # delay before second attempt, doubled for next ones
+
+RECONNECT_INITIAL_DELAY = 0.2                   # delay of first reconnection attempt after link loss
+RECONNECT_MAX_DELAY = 30.0                      # limit of delay between reconnection attempts
+RECONNECT_MULTIPLIER = 2.0
+RECONNECT_JITTER = 0.5                          # delays are randomly reduced by up to 50%
+
+VARIABLE_TIMEOUT = 20                           # default time limit of waiting for desk state variable
+INIT_TIMEOUT = 30                               # default time limit of connection initialization
+
+MOVE_KEEP_ALIVE_INTERVAL = 0.5                  # desk stops if move command is not repeated (~1s)
+MOVE_TOLERANCE = 10                             # raw units (1 mm) -- target is reached
+MOVE_MIN_SPEED = 200                            # raw units per second -- slowest expected moving speed
+MOVE_TIMEOUT_MARGIN = 3.0                       # seconds added to expected travel time
+
+TELEMETRY_CAPACITY = 4096                       # number of height/speed samples kept by desk (12 bytes each)
 DPG_COMMAND_HANDLE = 0x0014
 
 
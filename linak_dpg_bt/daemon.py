@@ -0,0 +1,223 @@
+#
+# Long-running process keeping connections to desks, serving requests over Unix socket.
+#
+# Protocol: single JSON object per line.
+#     request:  {"command": "get_height", "macs": ["AA:BB:CC:DD:EE:FF"], "args": {}}
+#     response: {"results": [{"mac": "AA:BB:CC:DD:EE:FF", "value": "65.0cm", "error": null}]}
+#               {"error": "unknown command: xxx"}
+#
+
+import os
+import json
+import socket
+import logging
+import threading
+import socketserver
+
+from .fleet import FleetResult
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def default_socket_path():
+    runtimeDir = os.environ.get( "XDG_RUNTIME_DIR" )
+    if runtimeDir:
+        return os.path.join( runtimeDir, "linak_dpg_bt.sock" )
+    return "/tmp/linak_dpg_bt-%s.sock" % os.getuid()
+
+
+## operations available for clients -- 'function(desk, **args)' returning JSON serializable value
+COMMANDS = {
+    "name":         lambda desk: desk.name,
+    "get_height":   lambda desk: desk.current_height_with_offset.human_cm,
+    "move_to":      lambda desk, target: desk.move_to_cm( target ).state,
+    "move_to_fav":  lambda desk, fav: desk.move_to_fav( fav ).state,
+    "stop":         lambda desk: desk.stopMoving(),
+    "state":        lambda desk: str(desk),
+    "wire_trace":   lambda desk: desk.wire_trace.dump() if desk.wire_trace != None else None,
+    "metrics":      lambda desk: desk.metrics.snapshot(),
+}
+
+
+class DeskDaemon:
+    """Serves requests to 'DeskFleet' over Unix-domain socket.
+
+    Desks requested by client, but not present in fleet, are added and connected.
+    With 'supervise' connected desks are reconnected automatically after link loss.
+    """
+
+    logger = None
+
+
+    def __init__(self, fleet, socketPath=None, supervise=False):
+        if socketPath == None:
+            socketPath = default_socket_path()
+        self.fleet = fleet
+        self.socketPath = socketPath
+        self.supervise = supervise
+        self._server = None
+        self._fleetLock = threading.Lock()
+        if supervise:
+            for desk in fleet:
+                if desk.is_connected():
+                    desk.supervise()
+
+    def start(self):
+        """Bind the socket. Requests are handled after calling 'serve_forever()'."""
+        if os.path.exists( self.socketPath ):
+            if DaemonClient( self.socketPath ).available():
+                raise RuntimeError("daemon already running on %s" % self.socketPath)
+            ## stale socket of killed daemon
+            os.unlink( self.socketPath )
+        daemon = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon._handle_connection( self.rfile, self.wfile )
+        oldMask = os.umask( 0o077 )                    ## socket accessible only by owner
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer( self.socketPath, Handler )
+        finally:
+            os.umask( oldMask )
+        self._server.daemon_threads = True
+        self.logger.info("Listening on %s", self.socketPath)
+
+    def serve_forever(self):
+        if self._server == None:
+            self.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists( self.socketPath ):
+                os.unlink( self.socketPath )
+
+    def shutdown(self):
+        if self._server != None:
+            self._server.shutdown()
+
+    def _handle_connection(self, rfile, wfile):
+        for line in rfile:
+            try:
+                request = json.loads( line.decode("utf-8") )
+                data = json.dumps( self.handle_request( request ) )
+            except ValueError as e:
+                data = json.dumps( { "error": "invalid request: %s" % e } )
+            except Exception as e:
+                ## client always gets response line
+                self.logger.exception("Handling request failed: %s %s", type(e), e)
+                data = json.dumps( { "error": "request failed: %s: %s" % (type(e).__name__, e) } )
+            wfile.write( (data + "\n").encode("utf-8") )
+            wfile.flush()
+
+    def handle_request(self, request):
+        error = self._validate( request )
+        if error != None:
+            return { "error": "invalid request: %s" % error }
+        command = request.get("command")
+        if command == "ping":
+            return { "results": [], "macs": self.fleet.macs() }
+        if command == "shutdown":
+            threading.Thread( target=self.shutdown, daemon=True ).start()
+            return { "results": [] }
+        function = COMMANDS.get( command )
+        if function == None:
+            return { "error": "unknown command: %s" % command }
+        args = request.get("args") or {}
+        macs = self._prepare_desks( request.get("macs") )
+        results = []
+        for result in self.fleet.run( lambda desk: function(desk, **args), macs ):
+            error = None
+            if result.ok == False:
+                error = "%s: %s" % (type(result.error).__name__, result.error)
+            results.append( { "mac": result.mac, "value": result.value, "error": error, "duration": result.duration } )
+        return { "results": results }
+
+    @staticmethod
+    def _validate(request):
+        """Returns description of malformed request, None if request is correct."""
+        if isinstance( request, dict ) == False:
+            return "expected JSON object"
+        macs = request.get("macs")
+        if macs != None:
+            if isinstance( macs, list ) == False or any( isinstance( mac, str ) == False for mac in macs ):
+                return "'macs' has to be list of strings"
+        args = request.get("args")
+        if args != None and isinstance( args, dict ) == False:
+            return "'args' has to be JSON object"
+        return None
+
+    def _prepare_desks(self, macs):
+        """Add missing desks and reconnect disconnected ones."""
+        with self._fleetLock:
+            if macs == None:
+                macs = self.fleet.macs()
+            toConnect = []
+            for mac in macs:
+                if mac not in self.fleet:
+                    self.fleet.add( mac )
+                desk = self.fleet.desk( mac )
+                if desk.supervisor != None:
+                    ## reconnected by supervisor
+                    continue
+                if desk.is_connected() == False:
+                    toConnect.append( mac )
+            if len(toConnect) > 0:
+                for result in self.fleet.connect_all( toConnect ):
+                    if result.ok == False:
+                        self.logger.warning("Unable to connect %s: %s", result.mac, result.error)
+                    elif self.supervise:
+                        self.fleet.desk( result.mac ).supervise()
+            return macs
+
+DeskDaemon.logger = _LOGGER.getChild(DeskDaemon.__name__)
+
+
+class DaemonClient:
+    """Sends requests to 'DeskDaemon'."""
+
+    logger = None
+
+    ## time limit of connecting to daemon
+    CONNECT_TIMEOUT = 1.0
+
+
+    def __init__(self, socketPath=None):
+        if socketPath == None:
+            socketPath = default_socket_path()
+        self.socketPath = socketPath
+
+    def available(self):
+        """Returns True if daemon is running."""
+        try:
+            self.request( "ping" )
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def request(self, command, macs=None, **args):
+        """Send request. Returns list of 'FleetResult' objects.
+
+        Errors of single desks are returned as strings in 'FleetResult.error'. Raises
+        'RuntimeError' if daemon rejected request.
+        """
+        message = { "command": command, "macs": macs, "args": args }
+        sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        try:
+            sock.settimeout( self.CONNECT_TIMEOUT )
+            sock.connect( self.socketPath )
+            ## commands (e.g. moving) can take long time
+            sock.settimeout( None )
+            sock.sendall( (json.dumps( message ) + "\n").encode("utf-8") )
+            with sock.makefile("rb") as sockFile:
+                line = sockFile.readline()
+        finally:
+            sock.close()
+        if len(line) < 1:
+            raise ValueError("connection closed by daemon")
+        response = json.loads( line.decode("utf-8") )
+        if response.get("error") != None:
+            raise RuntimeError( response["error"] )
+        return [ FleetResult( item["mac"], item["value"], item["error"], item.get("duration") ) for item in response["results"] ]
+
+DaemonClient.logger = _LOGGER.getChild(DaemonClient.__name__)
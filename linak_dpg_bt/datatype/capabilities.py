@@ -4,6 +4,8 @@
 
 
 class Capabilities:
+
+    __slots__ = ('valid', 'refByte', 'memSize', 'autoUp', 'autoDown', 'bleAllow', 'hasDisplay', 'hasLight')
     
     def __init__(self, data):
         caps = data[2:]
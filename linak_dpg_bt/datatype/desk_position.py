@@ -6,8 +6,14 @@ import struct
 import math
 
 
+## raw height, little endian
+_RAW_STRUCT = struct.Struct('<H')
+
+
 class DeskPosition:
 
+    __slots__ = ('_raw',)
+
     def __init__(self, raw):
         self._raw = raw
 
@@ -50,12 +56,11 @@ class DeskPosition:
         if data[2] != 1:
             ## not set
             return None
-        return cls.from_bytes(data[3:])
+        return cls( _RAW_STRUCT.unpack_from(data, 3)[0] )
     
     @classmethod
-    def from_bytes(cls, data):
-        offset = struct.unpack('<H', data[0:2])[0]
-        return cls( offset )
+    def from_bytes(cls, data, offset=0):
+        return cls( _RAW_STRUCT.unpack_from(data, offset)[0] )
 
     @classmethod
     def raw_from_cm(cls, cm):
@@ -63,7 +68,7 @@ class DeskPosition:
 
     @classmethod
     def bytes_from_raw(cls, raw):
-        return struct.pack('<H', raw)
+        return _RAW_STRUCT.pack(raw)
 
     @classmethod
     def from_cm(cls, cm):
@@ -5,11 +5,17 @@
 import struct
 
 
+## speed follows height in HEIGHT_SPEED payload
+_SPEED_STRUCT = struct.Struct('<H')
+
+
 class DeskSpeed:
+
+    __slots__ = ('_raw',)
     
     @classmethod
     def from_bytes(cls, data):
-        return cls(struct.unpack('H', data[2:4])[0] & 0xFFF)
+        return cls(_SPEED_STRUCT.unpack_from(data, 2)[0] & 0xFFF)
 
     def __init__(self, raw):
         self._raw = raw
@@ -7,16 +7,22 @@ import struct
 from .desk_position import DeskPosition
 
 
+## operation counter
+_COUNTER_STRUCT = struct.Struct('<I')
+
+
 class FavoritePosition:
+
+    __slots__ = ('position', 'opCounter')
     
     def __init__(self, data):
         if data[2] != 1:
             ## not set
             self.position = None
-            self.opCounter = struct.unpack('<I', data[3:])[0]
+            self.opCounter = _COUNTER_STRUCT.unpack_from(data, 3)[0]
         else:
             self.position = DeskPosition.create(data)
-            self.opCounter = struct.unpack('<I', data[5:])[0]
+            self.opCounter = _COUNTER_STRUCT.unpack_from(data, 5)[0]
         
     def isValid(self):
         return (self.position != None)
@@ -2,18 +2,24 @@
 #
 #
 
+import struct
+
 from .desk_position import DeskPosition
 from .desk_speed import DeskSpeed
 
 
+## raw height and speed -- single unpack of whole payload
+_HEIGHT_SPEED_STRUCT = struct.Struct('<HH')
+
+
 class HeightSpeed:
+
+    __slots__ = ('_height', '_speed')
     
     @classmethod
     def from_bytes(cls, data):
-        height = DeskPosition.from_bytes(data)
-        speed = DeskSpeed.from_bytes(data)
-
-        return cls(height, speed)
+        height, speed = _HEIGHT_SPEED_STRUCT.unpack_from(data)
+        return cls(DeskPosition(height), DeskSpeed(speed & 0xFFF))
 
     def __init__(self, height, speed):
         self._height = height
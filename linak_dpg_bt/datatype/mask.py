@@ -23,6 +23,8 @@ class ActuatorType(Enum):
     
     
 class Mask:
+
+    __slots__ = ('maskByte', 'actuator')
     
     def __init__(self, data):
         self.maskByte = data[0]
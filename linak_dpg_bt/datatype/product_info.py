@@ -4,10 +4,15 @@
 
 
 class ProductInfo:
+
+    __slots__ = ('version',)
     
     def __init__(self, data):
         self.version = data[2:]
         
+    def firmware(self):
+        return '.'.join("{:}".format(x) for x in self.version)
+        
     def __str__(self):
         return "%s[%s]" % (self.__class__.__name__, ' '.join("{:}".format(x) for x in self.version))
     
\ No newline at end of file
@@ -7,6 +7,10 @@ import struct
 
 
 
+## operation counter
+_COUNTER_STRUCT = struct.Struct('<I')
+
+
 def to_bin_string(data):
     return " ".join( '0b{:08b}'.format(x) for x in data )
 
@@ -22,6 +26,8 @@ class ReminderSetting:
     IMPULSE_DOWN_MASK = 0b0010000   ## 16
     WAKE_MASK         = 0b0100000   ## 32
     LIGHT_MASK        = 0b1000000   ## 64        ## bit is used only for activating the lights
+
+    __slots__ = ('reminder', 'inchEnabled', 'impulseUp', 'impulseDown', 'wake', 'lightGuide', 'r1', 'r2', 'r3', 'opCounter')
     
     
     def __init__(self, data):
@@ -39,7 +45,7 @@ class ReminderSetting:
         self.r2 = Reminder(settings[3:5])
         self.r3 = Reminder(settings[5:7])
         
-        self.opCounter = struct.unpack('<I', settings[7:11])[0]
+        self.opCounter = _COUNTER_STRUCT.unpack_from(settings, 7)[0]
     
     def info(self):
         retString = ""
@@ -228,6 +234,8 @@ class ReminderSetting:
     
     
 class Reminder:
+
+    __slots__ = ('sit', 'stand')
     
     def __init__(self, data):
         self.sit = data[0]
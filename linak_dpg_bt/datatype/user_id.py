@@ -4,6 +4,8 @@
 
 
 class UserId:
+
+    __slots__ = ('type', 'id')
     
     def __init__(self, data):
         self.type = "Guest"
@@ -3,17 +3,14 @@
 #
 
 import logging
-from time import sleep
+from time import monotonic
 
-from threading import Timer
-from threading import Thread, Event, current_thread
+from threading import Thread, Event, Lock, current_thread
 
-import functools
+from bluepy import btle
 
 import linak_dpg_bt.constants as constants
-##import linak_dpg_bt.linak_service as linak_service
-from .datatype.desk_position import DeskPosition
-from .datatype.height_speed import HeightSpeed
+from .command import ControlCommand
 
 from .synchronized import synchronized
 
@@ -25,51 +22,201 @@ _LOGGER = logging.getLogger(__name__)
 
 
 
-class DeskMover:
-    
-    logger = None
-    
-    
-    def __init__(self, conn, target):
-        self._conn = conn
-        self._target = target
-        self._running = False
-        self._stopTimer = Timer(30, self._stop_move)
-
-    def start(self):
-        self.logger.debug("Start move to: %d", self._target)
-
-        self._running = True
-        self._stopTimer.start()
+class MotionController:
+    """Moves desk to target height, driven by HEIGHT_SPEED notifications.
 
-        with self._conn as conn:
-            conn.subscribe_to_notification(constants.REFERENCE_OUTPUT_NOTIFY_HANDLE,
-                constants.REFERENCE_OUTPUT_HANDLE, self._handle_notification)
+    Move command is repeated only when desk's keep-alive requires it. Motion ends when
+    height is within tolerance of target, when desk stops by itself (e.g. obstacle),
+    after time estimated from travel distance, or when cancelled.
+    """
 
-            for _ in range(150):
-                if self._running:
-                    self._send_move_to()
-                    sleep(0.2)
-
-    def _handle_notification(self, cHandle, data):
-        hs = HeightSpeed.from_bytes(data)
-
-        self.logger.debug("Current relative height: %s, speed: %f", hs.height.human_cm, hs.speed.parsed)
-
-        if hs.speed.parsed < 0.001:
-            self._stop_move()
-
-    def _send_move_to(self):
-        self.logger.debug("Sending move to: %d", self._target)
-        self._conn.make_request(constants.MOVE_TO_HANDLE, DeskPosition.bytes_from_raw(self._target))
+    logger = None
 
-    def _stop_move(self):
-        self.logger.debug("Move stopped")
-        # send stop move
-        self._running = False
-        self._stopTimer.cancel()
+    ## states of motion
+    PENDING     = "pending"
+    MOVING      = "moving"
+    ARRIVED     = "arrived"
+    STOPPED     = "stopped"
+    TIMEOUT     = "timeout"
+    CANCELLED   = "cancelled"
+    FAILED      = "failed"
+
+
+    def __init__(self, desk, target, tolerance=None, timeout=None, keepAliveInterval=None, progressCallback=None):
+        """
+        :param desk: 'LinakDesk' object
+        :param target: raw target height (without desk offset)
+        :param timeout: time limit in seconds, estimated from travel distance if None
+        :param progressCallback: called with controller object on every height notification
+        """
+        if tolerance == None:
+            tolerance = constants.MOVE_TOLERANCE
+        if keepAliveInterval == None:
+            keepAliveInterval = constants.MOVE_KEEP_ALIVE_INTERVAL
+        self.desk = desk
+        self.target = target
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.keepAliveInterval = keepAliveInterval
+        self.progressCallback = progressCallback
+        self.state = self.PENDING
+        self.error = None
+        self.startPosition = None
+        self.position = None
+        self.writes = 0                         ## number of move commands sent
+        self.duration = None
+        self._cancelled = False
+        self._done = Event()
+        self._doneCallbacks = []
+        self._doneLock = Lock()
+        self._thread = None
+
+    @property
+    def progress(self):
+        """Fraction of distance travelled, in range [0, 1]."""
+        if self.state == self.ARRIVED:
+            return 1.0
+        if self.startPosition == None or self.position == None:
+            return 0.0
+        distance = abs(self.target - self.startPosition)
+        if distance < 1:
+            return 1.0
+        travelled = distance - abs(self.target - self.position)
+        return min( max( travelled / distance, 0.0 ), 1.0 )
+
+    @property
+    def finished(self):
+        return self._done.is_set()
 
-DeskMover.logger = _LOGGER.getChild(DeskMover.__name__)
+    def start(self):
+        """Start moving in background thread."""
+        self.startPosition = self.desk.current_height.raw
+        self.position = self.startPosition
+        if abs(self.target - self.startPosition) <= self.tolerance:
+            self.logger.debug("Move not needed, current raw height: %d", self.startPosition)
+            self._finish( self.ARRIVED )
+            return self
+        self._thread = Thread( target=self.run, name=getThreadName("Motion") )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Wait for end of motion. Returns True if target was reached."""
+        self._done.wait( timeout )
+        return self.state == self.ARRIVED
+
+    def add_done_callback(self, callback):
+        """Call 'callback(controller)' when motion ends (immediately if already finished)."""
+        with self._doneLock:
+            if self._done.is_set() == False:
+                self._doneCallbacks.append( callback )
+                return
+        callback( self )
+
+    def cancel(self):
+        """Stop controlling motion. Desk stops by itself after keep-alive interval (or use 'stopMoving()')."""
+        self._cancelled = True
+        ## wake up controller waiting for notification
+        self.desk._monitor.updated( '_motion' )
+        if self._thread != None and current_thread() != self._thread:
+            self._done.wait()
+
+    def run(self):
+        try:
+            self._run()
+        except BaseException as e:
+            self.logger.error("Motion failed: %s %s", type(e), e)
+            self.error = e
+            self._finish( self.FAILED )
+
+    def _run(self):
+        startTime = monotonic()
+        if self.startPosition == None:
+            self.startPosition = self.desk.current_height.raw
+            self.position = self.startPosition
+        timeout = self.timeout
+        if timeout == None:
+            timeout = abs(self.target - self.startPosition) / constants.MOVE_MIN_SPEED + constants.MOVE_TIMEOUT_MARGIN
+        deadline = startTime + timeout
+        monitor = self.desk._monitor
+
+        self.logger.debug("Start move from %d to %d, time limit: %.1fs", self.startPosition, self.target, timeout)
+        version = monitor.version( '_height_speed' )
+        self._send_move()
+        lastSend = monotonic()
+        self.state = self.MOVING
+        moving = False
+
+        while True:
+            now = monotonic()
+            if now >= deadline:
+                self.logger.warning("Move to %d timed out at %s", self.target, self.position)
+                self._stop_desk()
+                self._finish( self.TIMEOUT, startTime )
+                return
+            if now - lastSend >= self.keepAliveInterval:
+                self._send_move()
+                lastSend = now
+            waitTime = min( lastSend + self.keepAliveInterval, deadline ) - now
+            monitor.wait_for( lambda: self._cancelled or monitor.version( '_height_speed' ) != version, waitTime )
+            if self._cancelled:
+                self._finish( self.CANCELLED, startTime )
+                return
+            newVersion = monitor.version( '_height_speed' )
+            if newVersion == version:
+                ## no notification -- keep-alive is due
+                continue
+            version = newVersion
+
+            heightSpeed = self.desk._height_speed
+            self.position = heightSpeed.height.raw
+            if self.progressCallback != None:
+                self.progressCallback( self )
+            if abs(self.target - self.position) <= self.tolerance:
+                self._finish( self.ARRIVED, startTime )
+                return
+            if heightSpeed.speed.raw != 0:
+                moving = True
+            elif moving:
+                ## stopped before reaching target (e.g. obstacle)
+                self.logger.info("Desk stopped at %d before reaching %d", self.position, self.target)
+                self._finish( self.STOPPED, startTime )
+                return
+
+    def _send_move(self):
+        self.writes += 1
+        try:
+            self.desk.moveTo( self.target )
+        except (btle.BTLEException, ConnectionError) as e:
+            if self.desk.supervisor == None:
+                raise
+            ## link lost -- move is repeated after supervisor reconnects
+            self.logger.warning("Sending move failed: %s %s", type(e), e)
+
+    def _stop_desk(self):
+        with self.desk._conn as conn:
+            conn.send_control_command( ControlCommand.STOP_MOVING )
+
+    def _finish(self, state, startTime=None):
+        self.state = state
+        if startTime != None:
+            self.duration = monotonic() - startTime
+        self.logger.debug("Move to %d finished: %s position: %s writes: %d", self.target, state, self.position, self.writes)
+        self.desk.metrics.motion( state, self.duration, self.writes )
+        with self._doneLock:
+            self._done.set()
+            callbacks = self._doneCallbacks
+            self._doneCallbacks = []
+        for callback in callbacks:
+            callback( self )
+
+    def __str__(self):
+        return "%s[target: %s position: %s state: %s progress: %.2f writes: %d]" % (self.__class__.__name__,
+                                                                                   self.target, self.position, self.state,
+                                                                                   self.progress, self.writes)
+
+MotionController.logger = _LOGGER.getChild(MotionController.__name__)
 
 
 class CommandThread(Thread):
@@ -98,7 +245,12 @@ class CommandThread(Thread):
             if self.hFunction == None:
                 self.logger.warning( "no handle function defined" )
                 break
-            ret = self.hFunction()
+            try:
+                ret = self.hFunction()
+            except (btle.BTLEException, ConnectionError) as e:
+                ## link lost -- command is repeated in next iteration
+                self.logger.warning( "command failed: %s %s", type(e), e )
+                ret = None
             if ret == False:
                 self.logger.warning( "handler thread termination" )
                 break
@@ -145,9 +297,11 @@ class DeskMoverThread():
     def moveToFav(self, favIndex):
         self.stopMoving()
         self.logger.info( "moving to fav %s" % (favIndex) )
-        self.logger.info( "initializing new thread" )
-        favHandler = functools.partial(self._handle_moveToFav, favIndex)
-        self.spawnThread( favHandler )
+        fav = self.device.favorite_position(favIndex+1)
+        if fav.position == None:
+            self.logger.warning( "favorite %s not set" % (favIndex) )
+            return None
+        return self.device.move_to_raw( fav.position.raw, wait=False )
 
     def stopMoving(self):
         currentThread = self.extractThread()
@@ -183,16 +337,6 @@ class DeskMoverThread():
     def _handle_moveBottom(self):
         return self.device.moveToBottom()
 
-    def _handle_moveToFav(self, favIndex):
-        ret = self.device.moveToFav(favIndex)
-        if ret == False:
-            return False
-        if self.device.current_speed.raw < 1:
-            ## stopped moving
-            self.logger.info( "device stopped" )
-            self.stopMoving()
-            return False
-        return True
 
 DeskMoverThread.logger = _LOGGER.getChild(DeskMoverThread.__name__)
 
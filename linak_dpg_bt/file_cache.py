@@ -0,0 +1,71 @@
+#
+# Base of caches stored in JSON file.
+#
+
+import os
+import json
+import logging
+import threading
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class JsonFileCache:
+    """Dict of JSON entries keyed by MAC address, kept in single file.
+
+    File is read on first access and rewritten (atomically) after every change.
+    """
+
+    logger = None
+
+    DEFAULT_DIR = os.path.join( os.path.expanduser("~"), ".cache", "linak_dpg_bt" )
+
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def load_entry(self, mac):
+        with self._lock:
+            return self._get_entries().get( mac.upper() )
+
+    def store_entry(self, mac, entry):
+        with self._lock:
+            self._get_entries()[ mac.upper() ] = entry
+            self._save()
+
+    def invalidate(self, mac):
+        with self._lock:
+            if self._get_entries().pop( mac.upper(), None ) != None:
+                self._save()
+
+    def _get_entries(self):
+        if self._entries != None:
+            return self._entries
+        self._entries = dict()
+        try:
+            with open(self.path, "r") as cacheFile:
+                data = json.load( cacheFile )
+            if isinstance(data, dict):
+                self._entries = data
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            self.logger.warning( "unable to read cache %s: %s %s", self.path, type(e), e )
+        return self._entries
+
+    def _save(self):
+        try:
+            dirPath = os.path.dirname( self.path )
+            if dirPath:
+                os.makedirs( dirPath, exist_ok=True )
+            tmpPath = self.path + ".tmp"
+            with open(tmpPath, "w") as cacheFile:
+                json.dump( self._entries, cacheFile, indent=1, sort_keys=True )
+            os.replace( tmpPath, self.path )
+        except OSError as e:
+            self.logger.warning( "unable to write cache %s: %s %s", self.path, type(e), e )
+
+JsonFileCache.logger = _LOGGER.getChild(JsonFileCache.__name__)
@@ -0,0 +1,184 @@
+#
+#
+#
+
+import logging
+from time import perf_counter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .linak_device import LinakDesk
+from .telemetry_log import TelemetryLog
+from .reactor import NotificationReactor
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def normalize_mac(mac):
+    """Desks are keyed by upper case MAC address."""
+    return mac.upper()
+
+
+class FleetResult:
+    """Result of operation executed on single desk of fleet."""
+
+    def __init__(self, mac, value=None, error=None, duration=None):
+        self.mac = mac
+        self.value = value
+        self.error = error
+        self.duration = duration
+
+    @property
+    def ok(self):
+        return self.error == None
+
+    def __str__(self):
+        if self.ok:
+            return "%s[%s %s]" % (self.__class__.__name__, self.mac, self.value)
+        return "%s[%s error: %s]" % (self.__class__.__name__, self.mac, self.error)
+
+
+class DeskFleet:
+    """Set of desks keyed by MAC address.
+
+    Operations are executed on all desks in parallel, but at most 'maxConcurrency'
+    desks are handled at the same time. Each operation returns iterator yielding
+    'FleetResult' objects in order of completion.
+    """
+
+    logger = None
+
+
+    def __init__(self, macs=(), maxConcurrency=8, peripheralFactory=None, gattCache=None, stateCache=None, lazy=False,
+                 telemetryDir=None, useReactor=True):
+        """
+        :param peripheralFactory: passed to constructor of every 'LinakDesk', desks
+                                  with own factories can be added by 'add(mac, desk)'
+        :param gattCache: 'GattCache' shared by all desks
+        :param stateCache: 'DeskStateCache' shared by all desks
+        :param lazy: connect in lazy mode (state is read on first access)
+        :param telemetryDir: directory of binary telemetry logs (one 'TelemetryLog' file per desk)
+        :param useReactor: notifications of all desks are handled by shared 'NotificationReactor'
+                           thread instead of thread per desk
+        """
+        self._desks = OrderedDict()
+        self._peripheralFactory = peripheralFactory
+        self._gattCache = gattCache
+        self._stateCache = stateCache
+        self._lazy = lazy
+        self._telemetryDir = telemetryDir
+        self._reactor = NotificationReactor.instance() if useReactor else None
+        self._executor = ThreadPoolExecutor( max_workers=maxConcurrency, thread_name_prefix="DeskFleet" )
+        for mac in macs:
+            self.add( mac )
+
+    def __len__(self):
+        return len(self._desks)
+
+    def __iter__(self):
+        return iter( list(self._desks.values()) )
+
+    def __contains__(self, mac):
+        return normalize_mac(mac) in self._desks
+
+    def macs(self):
+        return list(self._desks.keys())
+
+    def desk(self, mac):
+        return self._desks[ normalize_mac(mac) ]
+
+    def add(self, mac, desk=None):
+        mac = normalize_mac(mac)
+        if desk == None:
+            telemetryLog = None
+            if self._telemetryDir != None:
+                telemetryLog = TelemetryLog.for_desk( self._telemetryDir, mac )
+            desk = LinakDesk(mac, self._peripheralFactory, self._gattCache, self._stateCache, telemetryLog,
+                             self._reactor)
+        self._desks[mac] = desk
+        return desk
+
+    def remove(self, mac):
+        return self._desks.pop(normalize_mac(mac), None)
+
+    def close(self):
+        self.disconnect_all()
+        self._executor.shutdown()
+        for desk in self:
+            if desk._telemetryLog != None:
+                desk._telemetryLog.close()
+
+    ## ================= operations =================
+
+    def run(self, function, macs=None):
+        """Call 'function(desk)' on every desk. Returns iterator yielding 'FleetResult' as calls complete.
+
+        All calls are submitted before return, also when result is not iterated.
+        """
+        if macs == None:
+            macs = self.macs()
+        futures = {}
+        for mac in macs:
+            mac = normalize_mac(mac)
+            desk = self._desks[mac]
+            future = self._executor.submit( self._call, function, desk )
+            futures[future] = mac
+        return self._results( futures )
+
+    def _results(self, futures):
+        for future in as_completed( futures ):
+            mac = futures[future]
+            value, error, duration = future.result()
+            if error != None:
+                self.logger.warning( "operation failed on %s: %s %s", mac, type(error), error )
+            yield FleetResult( mac, value, error, duration )
+
+    def run_all(self, function, macs=None):
+        """Blocking version of 'run()'. Returns dict of results keyed by MAC."""
+        return { result.mac: result for result in self.run(function, macs) }
+
+    def connect_all(self, macs=None):
+        return self.run( lambda desk: self._connect_desk(desk, self._lazy), macs )
+
+    def disconnect_all(self):
+        for desk in self:
+            try:
+                desk.disconnect()
+            except BaseException as e:
+                self.logger.warning( "disconnecting failed: %s %s", type(e), e )
+
+    def read_heights(self):
+        """Yields results with current height with offset (DeskPosition)."""
+        return self.run( lambda desk: desk.current_height_with_offset )
+
+    def move_all_to_fav(self, favNumber):
+        return self.run( lambda desk: desk.move_to_fav(favNumber) )
+
+    def move_all_to_cm(self, cm):
+        return self.run( lambda desk: desk.move_to_cm(cm) )
+
+    def stop_all(self):
+        return self.run( lambda desk: desk.stopMoving() )
+
+    def push_reminder_settings(self, reminderSetting):
+        """Send reminder settings (ReminderSetting object) to all desks."""
+        return self.run( lambda desk: desk.set_reminder_settings( reminderSetting ) )
+
+    @staticmethod
+    def _connect_desk(desk, lazy=False):
+        result = desk.connect( lazy=lazy )
+        if result.error != None:
+            raise result.error
+        return result
+
+    @staticmethod
+    def _call(function, desk):
+        startTime = perf_counter()
+        try:
+            value = function( desk )
+            return (value, None, perf_counter() - startTime)
+        except BaseException as e:
+            return (None, e, perf_counter() - startTime)
+
+DeskFleet.logger = _LOGGER.getChild(DeskFleet.__name__)
@@ -0,0 +1,120 @@
+#
+# Cache of GATT services and characteristics of desks.
+#
+
+import os
+import logging
+
+from bluepy import btle
+
+from .file_cache import JsonFileCache
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class GattTable:
+    """Services and characteristics discovered on device.
+
+    Services are kept as dict 'uuid -> (startHandle, endHandle)', characteristics as dict
+    'valueHandle -> (uuid, properties)'. Characteristics can be None if were not discovered yet.
+    """
+
+    def __init__(self, services, characteristics=None, firmware=None):
+        self.services = services
+        self.characteristics = characteristics
+        self.firmware = firmware
+
+    @classmethod
+    def discover(cls, peripheral, withCharacteristics=True):
+        services = {}
+        for serv in peripheral.getServices():
+            services[ str(serv.uuid).upper() ] = (serv.hndStart, serv.hndEnd)
+        table = cls( services )
+        if withCharacteristics:
+            table.discover_characteristics( peripheral )
+        return table
+
+    def discover_characteristics(self, peripheral):
+        characteristics = {}
+        for char in peripheral.getCharacteristics():
+            characteristics[ char.getHandle() ] = ( str(char.uuid).upper(), char.properties )
+        self.characteristics = characteristics
+
+    def hasService(self, uuid):
+        return str(uuid).upper() in self.services
+
+    def findHandle(self, uuid):
+        """Returns value handle of characteristic with given uuid or None."""
+        if self.characteristics == None:
+            return None
+        uuid = str(uuid).upper()
+        for handle, (charUuid, _) in self.characteristics.items():
+            if charUuid == uuid:
+                return handle
+        return None
+
+    def isReadable(self, handle):
+        """Returns None if characteristic is unknown."""
+        if self.characteristics == None:
+            return None
+        char = self.characteristics.get( handle )
+        if char == None:
+            return None
+        return (char[1] & btle.Characteristic.props["READ"]) != 0
+
+    def to_dict(self):
+        data = dict()
+        data["firmware"] = self.firmware
+        data["services"] = { uuid: list(handles) for uuid, handles in self.services.items() }
+        if self.characteristics != None:
+            data["characteristics"] = { str(handle): list(char) for handle, char in self.characteristics.items() }
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        services = { uuid: tuple(handles) for uuid, handles in data["services"].items() }
+        characteristics = data.get("characteristics")
+        if characteristics != None:
+            characteristics = { int(handle): tuple(char) for handle, char in characteristics.items() }
+        return cls( services, characteristics, data.get("firmware") )
+
+    def __str__(self):
+        charsNum = None
+        if self.characteristics != None:
+            charsNum = len(self.characteristics)
+        return "%s[services: %s characteristics: %s firmware: %s]" % (self.__class__.__name__, len(self.services), charsNum, self.firmware)
+
+
+class GattCache(JsonFileCache):
+    """GATT tables of devices stored in JSON file, keyed by MAC address.
+
+    Each entry holds firmware version (product info) of device, so entry is replaced
+    when firmware changes.
+    """
+
+    logger = None
+
+    DEFAULT_PATH = os.path.join( JsonFileCache.DEFAULT_DIR, "gatt.json" )
+
+
+    def __init__(self, path=None):
+        if path == None:
+            path = self.DEFAULT_PATH
+        JsonFileCache.__init__(self, path)
+
+    def load(self, mac):
+        """Returns 'GattTable' of device or None if not cached."""
+        entry = self.load_entry( mac )
+        if entry == None:
+            return None
+        try:
+            return GattTable.from_dict( entry )
+        except (KeyError, TypeError, ValueError) as e:
+            self.logger.warning( "invalid cache entry of %s: %s %s", mac, type(e), e )
+            return None
+
+    def store(self, mac, table):
+        self.store_entry( mac, table.to_dict() )
+
+GattCache.logger = _LOGGER.getChild(GattCache.__name__)
@@ -0,0 +1,212 @@
+#
+# Reusing bluepy-helper processes.
+#
+# Every 'btle.Peripheral' starts own bluepy-helper subprocess and stops it on disconnect.
+# 'PooledPeripheral' takes helper from 'HelperPool' instead and gives it back on disconnect
+# (also after failed connection attempt or link loss), so reconnecting desks do not fork
+# new processes.
+#
+
+import os
+import atexit
+import select
+import logging
+import threading
+import subprocess
+from time import monotonic
+
+from bluepy import btle
+
+from .metrics import REGISTRY
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HelperProcess:
+    """Running bluepy-helper process with poller of its output."""
+
+    __slots__ = ('process', 'poller', 'iface', 'idleSince', '_stderr')
+
+    def __init__(self, helperPath, iface=None):
+        self.iface = iface
+        self.idleSince = None
+        args = [ helperPath ]
+        if iface is not None:
+            args.append( str(iface) )
+        self._stderr = open( os.devnull, "w" )
+        self.process = subprocess.Popen( args,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=self._stderr,
+                                         universal_newlines=True,
+                                         preexec_fn=btle.preexec_function )
+        self.poller = select.poll()
+        self.poller.register( self.process.stdout, select.POLLIN )
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def drain(self):
+        """Discard output left by previous connection (e.g. late notifications)."""
+        while len( self.poller.poll(0) ) > 0:
+            if self.process.stdout.readline() == "":
+                break
+
+    def stop(self):
+        try:
+            if self.alive():
+                self.process.stdin.write( "quit\n" )
+                self.process.stdin.flush()
+            self.process.wait()
+        except OSError:
+            ## helper died meanwhile
+            self.process.kill()
+            self.process.wait()
+        finally:
+            self.poller.unregister( self.process.stdout )
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self._stderr.close()
+
+
+class HelperPool:
+    """Idle bluepy-helper processes kept per adapter.
+
+    At most 'maxIdle' processes are kept per adapter, processes idle for more
+    than 'idleTimeout' seconds are stopped on next use of pool.
+    """
+
+    logger = None
+
+
+    def __init__(self, maxIdle=4, idleTimeout=60.0, helperPath=None, registry=None):
+        if helperPath == None:
+            helperPath = btle.helperExe
+        if registry == None:
+            registry = REGISTRY
+        self.maxIdle = maxIdle
+        self.idleTimeout = idleTimeout
+        self.helperPath = helperPath
+        self.registry = registry
+        self.spawned = 0
+        self.reused = 0
+        self.stopped = 0
+        self._idle = {}                                 ## iface -> list of HelperProcess
+        self._lock = threading.Lock()
+
+    def acquire(self, iface=None):
+        """Returns idle helper of given adapter or starts new one."""
+        expired = self._reap()
+        helper = None
+        with self._lock:
+            idle = self._idle.get( iface, [] )
+            while len(idle) > 0:
+                candidate = idle.pop()
+                if candidate.alive():
+                    helper = candidate
+                    break
+                expired.append( candidate )
+        self._stop( expired )
+        if helper != None:
+            helper.drain()
+            self._count( "reused", iface )
+            return helper
+        helper = HelperProcess( self.helperPath, iface )
+        self._count( "spawned", iface )
+        self.logger.debug("Started helper process %s", helper.process.pid)
+        return helper
+
+    def release(self, helper):
+        """Take back helper of disconnected peripheral."""
+        toStop = self._reap()
+        if helper.alive():
+            with self._lock:
+                idle = self._idle.setdefault( helper.iface, [] )
+                if len(idle) < self.maxIdle:
+                    helper.idleSince = monotonic()
+                    idle.append( helper )
+                else:
+                    toStop.append( helper )
+        else:
+            toStop.append( helper )
+        self._stop( toStop )
+
+    def close(self):
+        """Stop all idle helpers."""
+        with self._lock:
+            toStop = [ helper for idle in self._idle.values() for helper in idle ]
+            self._idle.clear()
+        self._stop( toStop )
+
+    def stats(self):
+        with self._lock:
+            idle = sum( len(items) for items in self._idle.values() )
+        return { "spawned": self.spawned, "reused": self.reused, "stopped": self.stopped, "idle": idle }
+
+    def _reap(self):
+        """Remove expired helpers from pool. Returns list of them (to be stopped outside of lock)."""
+        deadline = monotonic() - self.idleTimeout
+        expired = []
+        with self._lock:
+            for idle in self._idle.values():
+                while len(idle) > 0 and idle[0].idleSince < deadline:
+                    expired.append( idle.pop(0) )
+        return expired
+
+    def _stop(self, helpers):
+        for helper in helpers:
+            helper.stop()
+            self._count( "stopped", helper.iface )
+
+    def _count(self, event, iface):
+        with self._lock:
+            setattr( self, event, getattr(self, event) + 1 )
+        adapter = "default" if iface is None else str(iface)
+        self.registry.counter( "linak_helper_%s_total" % event, "bluepy-helper processes %s" % event,
+                               adapter=adapter ).inc()
+
+HelperPool.logger = _LOGGER.getChild(HelperPool.__name__)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def default_pool():
+    """Process wide 'HelperPool', idle helpers are stopped at exit."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool == None:
+            _default_pool = HelperPool()
+            atexit.register( _default_pool.close )
+        return _default_pool
+
+
+class PooledPeripheral(btle.Peripheral):
+    """'btle.Peripheral' taking bluepy-helper process from 'HelperPool'."""
+
+    def __init__(self, deviceAddr=None, addrType=btle.ADDR_TYPE_PUBLIC, iface=None, pool=None):
+        if pool == None:
+            pool = default_pool()
+        self._pool = pool
+        self._pooledHelper = None
+        btle.Peripheral.__init__(self, deviceAddr, addrType, iface)
+
+    def _startHelper(self, iface=None):
+        if self._helper is not None:
+            return
+        helper = self._pool.acquire( iface )
+        self._pooledHelper = helper
+        self._helper = helper.process
+        self._poller = helper.poller
+
+    def _stopHelper(self):
+        helper = self._pooledHelper
+        if helper == None:
+            btle.Peripheral._stopHelper(self)
+            return
+        ## helper is disconnected from device here -- it can serve next connection
+        self._pooledHelper = None
+        self._helper = None
+        self._poller = None
+        self._pool.release( helper )
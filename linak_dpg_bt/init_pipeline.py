@@ -0,0 +1,325 @@
+#
+# Initialization of desk connection.
+#
+
+import logging
+import threading
+from time import monotonic
+
+import linak_dpg_bt.linak_service as linak_service
+import linak_dpg_bt.datatype as datatype
+import linak_dpg_bt.constants as constants
+
+from .command import DPGCommandType
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class InitError(Exception):
+    """Raised when mandatory initialization step failed."""
+    pass
+
+
+class InitResult:
+    """Outcome of desk initialization.
+
+    Mandatory steps (connection, discovery, subscription, handshake) have to succeed,
+    otherwise 'error' is set. Other steps are listed in 'completed', 'failed' (step -> exception),
+    'pending' (not executed before deadline) or 'deferred' (left for fetching on first access).
+    """
+
+    def __init__(self, required):
+        self.required = list(required)
+        self.completed = []
+        self.restored = []
+        self.failed = {}
+        self.pending = []
+        self.deferred = []
+        self.error = None
+        self.readyTime = None               ## seconds until required steps were completed
+        self.duration = None
+
+    @property
+    def ready(self):
+        """All required steps completed (or restored from cache)."""
+        if self.error != None:
+            return False
+        for step in self.required:
+            if step not in self.completed and step not in self.restored:
+                return False
+        return True
+
+    @property
+    def complete(self):
+        return self.ready and len(self.failed) == 0 and len(self.pending) == 0
+
+    def __str__(self):
+        return "%s[ready: %s duration: %s completed: %s restored: %s failed: %s pending: %s deferred: %s]" % (self.__class__.__name__,
+                                                                                            self.ready, self.duration,
+                                                                                            self.completed, self.restored,
+                                                                                            list(self.failed.keys()), self.pending,
+                                                                                            self.deferred)
+
+
+class InitPipeline:
+    """Brings up connection to 'LinakDesk' within single time budget.
+
+    Mandatory steps are executed first. Then optional steps are executed, those listed
+    in 'required' go first. Steps that did not fit before deadline are reported as pending.
+
+    In lazy mode only link is established (discovery and subscriptions) and only 'required'
+    steps are executed. Remaining state is fetched by 'fetch()' when caller accesses it.
+    """
+
+    logger = None
+
+    ## optional steps in default order
+    STEPS = [ "height", "desk_offset", "capabilities", "favorites", "reminder", "mask", "manufacturer", "model" ]
+
+    ## steps that have to be executed before given step
+    DEPENDENCIES = { "favorites": ["capabilities"] }
+
+    ## steps satisfied by state restored from cache
+    CACHED_STEPS = [ "desk_offset", "capabilities", "favorites", "reminder" ]
+
+    ## steps sending DPG commands -- require handshake
+    DPG_STEPS = [ "desk_offset", "capabilities", "favorites", "reminder",
+                  "favorite_1", "favorite_2", "favorite_3", "favorite_4" ]
+
+    ## state variables of 'LinakDesk' and steps fetching them
+    VARIABLE_STEPS = { '_name':             "name",
+                       '_userType':         "handshake",
+                       '_firmware':         "handshake",
+                       '_height_speed':     "height",
+                       '_desk_offset':      "desk_offset",
+                       '_capabilities':     "capabilities",
+                       '_reminder':         "reminder",
+                       '_mask':             "mask",
+                       '_manu':             "manufacturer",
+                       '_model':            "model",
+                       '_fav_position_1':   "favorite_1",
+                       '_fav_position_2':   "favorite_2",
+                       '_fav_position_3':   "favorite_3",
+                       '_fav_position_4':   "favorite_4" }
+
+
+    def __init__(self, desk, timeout=None, required=None, lazy=False):
+        """
+        :param timeout: overall time limit in seconds, 'constants.INIT_TIMEOUT' if None
+        :param required: names of steps the caller needs (see 'STEPS'), all if None (none in lazy mode)
+        :param lazy: fetch state on first access instead of during initialization
+        """
+        if timeout == None:
+            timeout = constants.INIT_TIMEOUT
+        if required == None:
+            if lazy:
+                required = []
+            else:
+                required = self.STEPS
+        for step in required:
+            if step not in self.STEPS:
+                raise ValueError("unknown initialization step: %s" % step)
+        self.desk = desk
+        self.timeout = timeout
+        self.required = list(required)
+        self.lazy = lazy
+        self.deadline = None
+        self.cachedState = None
+        self.finished = False
+        self._handshakeDone = False
+        self._fetchLock = threading.RLock()
+
+    def order(self):
+        """Returns optional steps in order of execution."""
+        ordered = []
+        def add(step):
+            for dependency in self.DEPENDENCIES.get(step, []):
+                add( dependency )
+            if step not in ordered:
+                ordered.append( step )
+        for step in self.required:
+            add( step )
+        if self.lazy == False:
+            for step in self.STEPS:
+                add( step )
+        return ordered
+
+    def run(self):
+        desk = self.desk
+        startTime = monotonic()
+        self.deadline = startTime + self.timeout
+        result = InitResult( self.required )
+
+        ## settings known from previous connection are available immediately
+        self.cachedState = desk._restore_state()
+
+        order = self.order()
+        try:
+            with desk._conn as conn:
+                self._discover( conn )
+                self._subscribe( conn )
+                if self.lazy == False or any(step in self.DPG_STEPS for step in order):
+                    self._ensure_handshake( conn )
+        except BaseException as e:
+            self.logger.error( "Initialization failed: %s %s", type(e), e )
+            result.error = e
+            result.duration = monotonic() - startTime
+            return result
+
+        if self.cachedState != None:
+            result.restored = list(self.CACHED_STEPS)
+
+        for step in order:
+            if result.ready and result.readyTime == None:
+                result.readyTime = monotonic() - startTime
+            if step in result.restored:
+                continue
+            if any(dependency in result.failed for dependency in self.DEPENDENCIES.get(step, [])):
+                result.failed[step] = InitError("dependency failed")
+                continue
+            if monotonic() >= self.deadline:
+                result.pending.append( step )
+                continue
+            try:
+                getattr(self, "_step_" + step)( desk._conn )
+                result.completed.append( step )
+            except BaseException as e:
+                self.logger.error( "Initialization step %s failed: %s %s", step, type(e), e )
+                result.failed[step] = e
+        if result.ready and result.readyTime == None:
+            result.readyTime = monotonic() - startTime
+
+        if self.cachedState == None and "favorites" in result.completed:
+            desk._store_state()
+
+        result.deferred = [ step for step in self.STEPS if step not in order and step not in result.restored ]
+
+        desk._start_notification_handler()
+        if self.cachedState != None and self._handshakeDone:
+            desk._start_state_refresh( self.cachedState )
+
+        self.finished = True
+        result.duration = monotonic() - startTime
+        self.logger.debug("Initialization done: %s", result)
+        return result
+
+    ## ================= mandatory steps =================
+
+    def _discover(self, conn):
+        ## discovered once, then taken from cache
+        gattTable = conn.gatt_table()
+        self.desk._check_services( gattTable )
+
+    def _subscribe(self, conn):
+        notificationState = conn.subscribe_to_notifications( self.desk._notification_subscriptions() )
+        self.logger.debug("Notification status: %s", notificationState)
+
+    def _ensure_handshake(self, conn):
+        with self._fetchLock:
+            if self._handshakeDone:
+                return
+            self._handshake( conn )
+            self._handshakeDone = True
+
+    def _handshake(self, conn):
+        desk = self.desk
+        ## we need to query for name before doing anything, without it device does not respond
+        self._step_name( conn )
+
+        conn.send_dpg_read_command( DPGCommandType.USER_ID, deadline=self.deadline )
+        conn.send_dpg_read_command( DPGCommandType.GET_SETUP, deadline=self.deadline )
+
+        productInfo = conn.send_dpg_read_command( DPGCommandType.PRODUCT_INFO, deadline=self.deadline )
+        desk._set_variable( '_firmware', productInfo.firmware() )
+        conn.validate_gatt_table( desk._firmware )
+        if self.cachedState != None and self.cachedState.firmware != desk._firmware:
+            self.logger.info("Firmware changed from %s to %s - reading state from device", self.cachedState.firmware, desk._firmware)
+            self.cachedState = None
+
+        conn.send_dpg_write_command( DPGCommandType.USER_ID, desk.CLIENT_ID, deadline=self.deadline )
+
+    ## ================= fetching on demand =================
+
+    def fetch(self, varName, timeout=None):
+        """Fetch state variable of desk. Returns False if there is no step providing the variable."""
+        step = self.VARIABLE_STEPS.get( varName )
+        if step == None:
+            return False
+        if timeout == None:
+            timeout = constants.VARIABLE_TIMEOUT
+        conn = self.desk._conn
+        with self._fetchLock:
+            if getattr(self.desk, varName) != None:
+                ## fetched meanwhile by other thread
+                return True
+            self.logger.debug("Fetching %s", varName)
+            self.deadline = monotonic() + timeout
+            if step == "handshake" or step in self.DPG_STEPS:
+                wasDone = self._handshakeDone
+                self._ensure_handshake( conn )
+                if wasDone == False and self.cachedState != None:
+                    self.desk._start_state_refresh( self.cachedState )
+            if step != "handshake":
+                getattr(self, "_step_" + step)( conn )
+        return True
+
+    ## ================= optional steps =================
+
+    def _step_name(self, conn):
+        deviceName = conn.read_characteristic_by_enum(linak_service.Characteristic.DEVICE_NAME)
+        self.desk._set_variable('_name', deviceName.decode("utf-8"))
+        self.logger.debug("Received name: %s", self.desk._name)
+
+    def _step_height(self, conn):
+        heightData = conn.read_characteristic_by_enum(linak_service.Characteristic.HEIGHT_SPEED)
+        self.desk._handle_heigh_speed_notification( linak_service.Characteristic.HEIGHT_SPEED.handle(), heightData )
+
+    def _step_desk_offset(self, conn):
+        conn.send_dpg_read_command( DPGCommandType.DESK_OFFSET, deadline=self.deadline )
+
+    def _step_capabilities(self, conn):
+        conn.send_dpg_read_command( DPGCommandType.GET_CAPABILITIES, deadline=self.deadline )
+
+    def _step_favorites(self, conn):
+        favNum = self.desk._capabilities.memSize
+        for favNumber in range(1, min(favNum, 4) + 1):
+            self._step_favorite( conn, favNumber )
+
+    def _step_favorite(self, conn, favNumber):
+        conn.send_dpg_read_command( DPGCommandType.getMemoryPosition( favNumber ), deadline=self.deadline )
+
+    def _step_favorite_1(self, conn):
+        self._step_favorite( conn, 1 )
+
+    def _step_favorite_2(self, conn):
+        self._step_favorite( conn, 2 )
+
+    def _step_favorite_3(self, conn):
+        self._step_favorite( conn, 3 )
+
+    def _step_favorite_4(self, conn):
+        self._step_favorite( conn, 4 )
+
+    def _step_reminder(self, conn):
+        conn.send_dpg_read_command( DPGCommandType.REMINDER_SETTING, deadline=self.deadline )
+
+    def _step_mask(self, conn):
+        maskData = conn.read_characteristic_by_enum(linak_service.Characteristic.MASK)
+        self.desk._set_variable('_mask', datatype.Mask( maskData ))
+
+    def _step_manufacturer(self, conn):
+        try:
+            ## on IKEA branded devices MANUFACTURER characteristic returns binary content than
+            ## is impossible to convert to UTF-8 string. It leads to exception.
+            manufacturer = conn.read_characteristic_by_enum(linak_service.Characteristic.MANUFACTURER)
+            self.desk._set_variable('_manu', manufacturer.decode("utf-8"))
+        except UnicodeDecodeError as e:
+            self.logger.error( "Reading manufacturer failed: %s %s", type(e), e )
+            self.desk._set_variable('_manu', "<unknown manufacturer>")
+
+    def _step_model(self, conn):
+        model = conn.read_characteristic_by_enum(linak_service.Characteristic.MODEL_NUMBER)
+        self.desk._set_variable('_model', model.decode("utf-8"))
+
+InitPipeline.logger = _LOGGER.getChild(InitPipeline.__name__)
@@ -3,8 +3,8 @@
 #
 
 import logging
-from time import sleep
-from threading import Thread
+from time import sleep, monotonic
+from threading import Thread, Lock
 
 from bluepy import btle
 
@@ -12,10 +12,18 @@ import linak_dpg_bt.linak_service as linak_service
 import linak_dpg_bt.datatype as datatype
  
 from .connection import BTLEConnection
-from .desk_mover import DeskMover
-from .command import DPGCommandType, DPGCommand, ControlCommand, DirectionalCommand
+from .desk_mover import MotionController
+from .command import DPGCommandType, DPGCommand, DPGCommandTimeoutError, ControlCommand, DirectionalCommand
 from linak_dpg_bt.datatype.desk_position import DeskPosition
 from .threadcounter import getThreadName
+from .variable_monitor import VariableMonitor
+from .state_cache import DeskStateCache
+from .init_pipeline import InitPipeline
+from .telemetry import HeightSpeedHistory
+from .wire_trace import HexDump, WireTrace
+from .capture import CaptureWriter
+from .supervisor import ConnectionSupervisor
+import linak_dpg_bt.constants as constants
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -64,16 +72,13 @@ class NotificationHandler(Thread):
         while self.work == True:
             try:
                 connected = self.desk.processNotifications()
-                if connected:
-                    sleep(0.001)                      ## prevents starving other thread
-                else:
-                    sleep(0.5)                        ## not connected -- sleep 0.5s  
+                if connected == False:
+                    self.desk._conn.wait_connected(0.5)   ## not connected -- wait up to 0.5s
             except btle.BTLEException as e:
+                ## link lost -- connection is disconnected, keep waiting for reconnection
                 self.logger.error("exception occurred: %s %s", type(e), e)
-                break
             except ConnectionRefusedError as e:
                 self.logger.error("exception occurred: %s %s", type(e), e)
-                break
 
 NotificationHandler.logger = _LOGGER.getChild(NotificationHandler.__name__)
 
@@ -83,11 +88,29 @@ class LinakDesk:
     logger = None
         
     CLIENT_ID = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17]
+
+    ## decoders of DPG responses, filled after class definition (see 'register_dpg_handler()')
+    DPG_HANDLERS = {}
     
     
-    def __init__(self, bdaddr):
+    def __init__(self, bdaddr, peripheralFactory=None, gattCache=None, stateCache=None, telemetryLog=None, reactor=None):
+        """
+        :param gattCache: 'GattCache' object allowing to skip GATT discovery
+        :param stateCache: 'DeskStateCache' object allowing to restore DPG state before reading it from desk
+        :param telemetryLog: 'TelemetryLog' object recording height/speed notifications and DPG responses
+        :param reactor: 'NotificationReactor' handling notifications, own 'NotificationHandler' thread is used if None
+        """
         self._bdaddr = bdaddr
-        self._conn = BTLEConnection(bdaddr)
+        self._conn = BTLEConnection(bdaddr, peripheralFactory, gattCache)
+        self._stateCache = stateCache
+        self._telemetryLog = telemetryLog
+        self._dpgBlocks = {}
+        self._firmware = None
+        self._pipeline = None
+        self._motion = None
+        self._motionLock = Lock()
+        self._telemetry = HeightSpeedHistory( constants.TELEMETRY_CAPACITY )
+        self._supervisor = None
 
         self._name = None
         self._manu = None
@@ -100,10 +123,15 @@ class LinakDesk:
         self._fav_position_3 = None
         self._fav_position_4 = None
         self._height_speed = None
+        self._reminder = None
         self._mask = None
+        self._monitor = VariableMonitor()
         self._posChangeCallback = None
         self._speedChangeCallback = None
-        self._notificationHandler = NotificationHandler(self)
+        self._reactor = reactor
+        self._notificationHandler = None
+        if reactor == None:
+            self._notificationHandler = NotificationHandler(self)
         self._setting_callbacks = []
         self._fav_callbacks = []
         self.logger.debug("Constructed %s object: %r", self.__class__.__name__, self)
@@ -125,6 +153,10 @@ class LinakDesk:
     def capabilities(self):
         return self._wait_for_variable('_capabilities').capString()
     
+    @property
+    def firmware(self):
+        return self._wait_for_variable('_firmware')
+
     @property
     def userType(self):
         return self._wait_for_variable('_userType')
@@ -153,8 +185,8 @@ class LinakDesk:
     def favorite_position_4(self):
         return self._wait_for_variable('_fav_position_4')
 
-    def favorite_position(self, favIndex):
-        return self._wait_for_variable('_fav_position_' + str(favIndex))
+    def favorite_position(self, favIndex, timeout=None):
+        return self._wait_for_variable('_fav_position_' + str(favIndex), timeout)
 
     @property
     def current_height(self):
@@ -185,35 +217,130 @@ class LinakDesk:
             self._with_desk_offset(self.height_speed.height).human_cm,
         )
 
-    def move_to_cm(self, cm):
-        calculated_raw = datatype.DeskPosition.raw_from_cm(cm - self._desk_offset.cm)
-        self._move_to_raw(calculated_raw)
+    def move_to_cm(self, cm, wait=True, progressCallback=None):
+        calculated_raw = datatype.DeskPosition.raw_from_cm(cm - self.desk_offset.cm)
+        return self.move_to_raw(calculated_raw, wait, progressCallback)
 
-    def move_to_fav(self, fav):
-        if fav == 1:
-            raw = self.favorite_position_1.raw
-        elif fav == 2:
-            raw = self.favorite_position_2.raw
-        else:
+    def move_to_fav(self, fav, wait=True, progressCallback=None):
+        if fav < 1 or fav > 4:
             raise DPGCommandReadError('Favorite with position: %d does not exists' % fav)
+        favPos = self.favorite_position(fav)
+        if favPos == None or favPos.position == None:
+            raise DPGCommandReadError('Favorite with position: %d is not set' % fav)
+
+        return self.move_to_raw(favPos.raw, wait, progressCallback)
 
-        self._move_to_raw(raw)
+    def move_to_raw(self, raw_value, wait=True, progressCallback=None, timeout=None):
+        """Move desk to raw height (without offset). Returns 'MotionController' object.
+        
+        If 'wait' is False then returns immediately, motion is continued in background.
+        Previous motion is cancelled. Time limit is estimated from travel distance if 'timeout' is None.
+        """
+        motion = MotionController(self, raw_value, timeout=timeout, progressCallback=progressCallback)
+        with self._motionLock:
+            previous = self._motion
+            self._motion = motion
+        if previous != None:
+            previous.cancel()
+        motion.start()
+        if wait:
+            motion.wait()
+        return motion
 
-    def _wait_for_variable(self, var_name):
+    @property
+    def telemetry(self):
+        """'HeightSpeedHistory' of received height/speed notifications."""
+        return self._telemetry
+
+    @property
+    def metrics(self):
+        """'DeskMetrics' of desk (counters and latency histograms of communication)."""
+        return self._conn.metrics
+
+    @property
+    def wire_trace(self):
+        """'WireTrace' of raw frames exchanged with desk, None if tracing is disabled."""
+        return self._conn.wireTrace
+
+    def enable_wire_trace(self, capacity=4096):
+        if self._conn.wireTrace == None:
+            self._conn.wireTrace = WireTrace( capacity )
+        return self._conn.wireTrace
+
+    def disable_wire_trace(self):
+        self._conn.wireTrace = None
+
+    def start_capture(self, path):
+        """Store all GATT traffic of desk to capture file (see 'linak_dpg_bt.capture')."""
+        self.stop_capture()
+        self._conn.capture = CaptureWriter( path )
+        return self._conn.capture
+
+    def stop_capture(self):
+        capture = self._conn.capture
+        self._conn.capture = None
+        if capture != None:
+            capture.close()
+
+    @property
+    def motion(self):
+        """Last 'MotionController' object (None if desk was not moved)."""
+        return self._motion
+
+    def wait_for_variable(self, name, timeout=None):
+        """Return value of state variable (e.g. 'height_speed', 'fav_position_1').
+        
+        Waits for value if not received yet. Raises 'DPGCommandReadError' after 'timeout' seconds.
+        """
+        return self._wait_for_variable( "_" + name, timeout )
+
+    def variable_version(self, name):
+        """Return counter incremented on every change of state variable."""
+        return self._monitor.version( "_" + name )
+
+    def wait_for_update(self, name, version, timeout=None):
+        """Wait for change of state variable. Returns new version or None on timeout."""
+        return self._monitor.wait_for_update( "_" + name, version, timeout )
+
+    def _set_variable(self, var_name, value):
+        setattr(self, var_name, value)
+        self._monitor.updated( var_name )
+
+    def _wait_for_variable(self, var_name, timeout=None):
         value = getattr(self, var_name)
         if value is not None:
             return value
 
-        for _ in range(0, 100):
+        if self._fetch_variable(var_name, timeout):
             value = getattr(self, var_name)
-
             if value is not None:
                 return value
 
-            sleep(0.2)
+        if timeout is None:
+            timeout = constants.VARIABLE_TIMEOUT
+        ready = self._monitor.wait_for( lambda: getattr(self, var_name) is not None, timeout )
+        if ready:
+            return getattr(self, var_name)
 
         raise DPGCommandReadError('Cannot fetch value for %s' % var_name)
 
+    def _fetch_variable(self, var_name, timeout=None):
+        """Read variable from device if it was skipped during initialization (lazy mode or deadline)."""
+        pipeline = self._pipeline
+        if pipeline == None or pipeline.finished == False:
+            ## initialization in progress -- value will come
+            return False
+        if self._conn.in_notification():
+            ## can not send commands from notification callback
+            return False
+        if self._conn.isConnected() == False:
+            return False
+        try:
+            return pipeline.fetch( var_name, timeout )
+        except BaseException as e:
+            self.logger.error( "Fetching %s failed: %s %s", var_name, type(e), e )
+            return False
+
     def _with_desk_offset(self, value):
         return datatype.DeskPosition(value.raw + self.desk_offset.raw)
     
@@ -228,84 +355,103 @@ class LinakDesk:
 #         data = bytearray(data)
 
         currentCommand = self._conn.handleCurrentCommand()
-        #if currentCommand == None:
+        if currentCommand == None:
+            self.logger.debug("Received response without pending command: %s", HexDump(data) )
+            return
         
         if DPGCommand.is_valid_response(data) == False:
             ## Error: DPG_Control packets needs to have 0x01 in first byte
-            self.logger.debug("Received invalid response for command %s: %s", currentCommand, to_hex_string(data) )
+            self.logger.debug("Received invalid response for command %s: %s", currentCommand, HexDump(data) )
+            currentCommand.fail( DPGCommandReadError("Invalid response for %s: %s" % (currentCommand, to_hex_string(data)) ) )
             return
 
         if DPGCommand.is_valid_data(data) == False:
             ## received confirmation without data
-            self.logger.debug("Received confirmation for command %s: %s", currentCommand, to_hex_string(data) )
+            self.logger.debug("Received confirmation for command %s: %s", currentCommand, HexDump(data) )
+            currentCommand.complete( True )
             return
 
-        self.logger.debug("Received response for command %s: %s", currentCommand, to_hex_string(data) )
+        self.logger.debug("Received response for command %s: %s", currentCommand, HexDump(data) )
         
-        if currentCommand == DPGCommandType.PRODUCT_INFO:
-            info = datatype.ProductInfo( data )
-            self.logger.debug("Product info: %s", info)
-        elif currentCommand == DPGCommandType.GET_SETUP:
-            ## do nothing
-            pass
-        elif currentCommand == DPGCommandType.USER_ID:
-            uId = datatype.UserId( data )
-            self.logger.debug( "User id: %s", uId )
-            self._userType = uId.type
-        elif currentCommand == DPGCommandType.GET_CAPABILITIES:
-            self._capabilities = datatype.Capabilities( data )
-            self.logger.debug( "Caps: %s", self._capabilities )
-        elif currentCommand == DPGCommandType.GET_SET_REMINDER_TIME:
-            ##self._reminder = datatype.ReminderSetting( data )
-            ##self.logger.debug( "Reminder: %s", self._reminder )
-            pass
-        elif currentCommand == DPGCommandType.REMINDER_SETTING:
-            self._reminder = datatype.ReminderSetting.create( data )
-            self.logger.debug( "Reminder: %s", self._reminder )
-            self._call_setting_callbacks()
-        elif currentCommand == DPGCommandType.DESK_OFFSET:
-            self._desk_offset = datatype.DeskPosition.create(data)
-            self.logger.debug( "Desk offset: %s", self._desk_offset )
-        elif currentCommand == DPGCommandType.GET_SET_MEMORY_POSITION_1:
-            self._fav_position_1 = datatype.FavoritePosition(data)
-            self.logger.debug( "Favorite 1: %s", self._fav_position_1 )
-            self._call_fav_callbacks(1)
-        elif currentCommand == DPGCommandType.GET_SET_MEMORY_POSITION_2:
-            self._fav_position_2 = datatype.FavoritePosition(data)
-            self.logger.debug( "Favorite 2: %s", self._fav_position_2 )
-            self._call_fav_callbacks(2)
-        elif currentCommand == DPGCommandType.GET_SET_MEMORY_POSITION_3:
-            self._fav_position_3 = datatype.FavoritePosition(data)
-            self.logger.debug( "Favorite 3: %s", self._fav_position_3 )
-            self._call_fav_callbacks(3)
-        elif currentCommand == DPGCommandType.GET_SET_MEMORY_POSITION_4:
-            self._fav_position_4 = datatype.FavoritePosition(data)
-            self.logger.debug( "Favorite 4: %s", self._fav_position_4 )
-            self._call_fav_callbacks(4)
-        elif currentCommand == DPGCommandType.GET_LOG_ENTRY:
-            logData = data[2:]
-            if len(logData) > 4:
-                logType = logData[0]
-                if logType == 135:
-                    self.logger.debug( "New position: %s", logData[1] )
-                else:
-                    self.logger.debug( "Log: %s", to_hex_string(logData) )
-            else:
-                self.logger.debug( "no log data" )
-        else:
-            self.logger.debug( "Command not handled: %r", currentCommand )
-
-    def _move_to_raw(self, raw_value):
-        with self._conn as conn:
-            current_raw_height = self.current_height.raw
-            move_not_possible = (abs(raw_value - current_raw_height) < 10)
-
-            if move_not_possible:
-                self.logger.debug("Move not possible, current raw height: %d", current_raw_height)
-                return
+        try:
+            result = self._decode_dpg_response(currentCommand.type, data)
+        except Exception as e:
+            self.logger.exception( "Unable to decode response for %s: %s", currentCommand, HexDump(data) )
+            currentCommand.fail( e )
+            return
+        if currentCommand.data == None:
+            ## keep raw response of read command for state cache
+            self._dpgBlocks[currentCommand.type] = bytes(data)
+        if self._telemetryLog != None:
+            self._telemetryLog.append_dpg( currentCommand.type, data )
+        currentCommand.complete( result )
+
+    def _decode_dpg_response(self, commandType, data):
+        handler = self.DPG_HANDLERS.get( commandType )
+        if handler == None:
+            self.logger.debug( "Command not handled: %r", commandType )
+            return bytes(data)
+        return handler( self, commandType, data )
+
+    @classmethod
+    def register_dpg_handler(cls, commandType, handler):
+        """Register 'handler(desk, commandType, data)' decoding response of DPG command.
+
+        Returned value is the result of command.
+        """
+        handlers = dict( cls.DPG_HANDLERS )         ## do not modify table of base class
+        handlers[ commandType ] = handler
+        cls.DPG_HANDLERS = handlers
+
+    def _decode_product_info(self, commandType, data):
+        info = datatype.ProductInfo( data )
+        self.logger.debug("Product info: %s", info)
+        return info
+
+    def _decode_ignored(self, commandType, data):
+        return bytes(data)
+
+    def _decode_user_id(self, commandType, data):
+        uId = datatype.UserId( data )
+        self.logger.debug( "User id: %s", uId )
+        self._set_variable('_userType', uId.type)
+        return uId
+
+    def _decode_capabilities(self, commandType, data):
+        self._set_variable('_capabilities', datatype.Capabilities( data ))
+        self.logger.debug( "Caps: %s", self._capabilities )
+        return self._capabilities
+
+    def _decode_reminder(self, commandType, data):
+        self._set_variable('_reminder', datatype.ReminderSetting.create( data ))
+        self.logger.debug( "Reminder: %s", self._reminder )
+        self._call_setting_callbacks()
+        return self._reminder
 
-            DeskMover(conn, raw_value).start()
+    def _decode_desk_offset(self, commandType, data):
+        self._set_variable('_desk_offset', datatype.DeskPosition.create(data))
+        self.logger.debug( "Desk offset: %s", self._desk_offset )
+        return self._desk_offset
 
+    def _decode_favorite(self, commandType, data):
+        favNumber = DPGCommandType.getMemoryPositionIndex( commandType )
+        varName = '_fav_position_' + str(favNumber)
+        self._set_variable(varName, datatype.FavoritePosition(data))
+        self.logger.debug( "Favorite %s: %s", favNumber, getattr(self, varName) )
+        self._call_fav_callbacks(favNumber)
+        return getattr(self, varName)
+
+    def _decode_log_entry(self, commandType, data):
+        logData = data[2:]
+        if len(logData) > 4:
+            logType = logData[0]
+            if logType == 135:
+                self.logger.debug( "New position: %s", logData[1] )
+            else:
+                self.logger.debug( "Log: %s", HexDump(logData) )
+        else:
+            self.logger.debug( "no log data" )
+        return bytes(logData)
 
     # ===============================================================
      
@@ -337,103 +483,127 @@ class LinakDesk:
     
     def initialize(self):
         try:
-            self._connect()
-            return True
+            return self._connect().ready
         except BaseException as e:
             self.logger.exception( "Initialization failed: %s %s", type(e), e )
             return False
     
-    def _connect(self):
+    def connect(self, timeout=None, required=None, lazy=False):
+        """Connect and read state of the device. Returns 'InitResult'.
+        
+        :param timeout: overall time limit in seconds, 'constants.INIT_TIMEOUT' if None
+        :param required: names of initialization steps needed first (see 'InitPipeline.STEPS')
+        :param lazy: establish link only, state is read when accessed for the first time
+        """
         self.logger.debug("Initializing the device")
-        with self._conn as conn:
-            """ We need to query for name before doing anything, without it device doesnt respond """
+        pipeline = InitPipeline(self, timeout, required, lazy)
+        self._pipeline = pipeline
+        return pipeline.run()
 
-            peripheral = conn._conn
-            ##self.print_services()
-            services = peripheral.getServices()
-            
-            #### there is problem with services -- it arrives in random order
-            ##for s in services:
-            ##    self._handle_discovered_service(s)
-
-            ### check if required services exist
-            self._find_service(services, linak_service.Service.GENERIC_ACCESS)
-            self._find_service(services, linak_service.Service.DPG)
-            self._find_service(services, linak_service.Service.CONTROL)
-            self._find_service(services, linak_service.Service.REFERENCE_INPUT)
-            self._find_service(services, linak_service.Service.REFERENCE_OUTPUT)
-               
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.HEIGHT_SPEED, self._handle_heigh_speed_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.TWO, self._handle_reference_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.THREE, self._handle_reference_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.FOUR, self._handle_reference_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.FIVE, self._handle_reference_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.SIX, self._handle_reference_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.SEVEN, self._handle_reference_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.EIGHT, self._handle_reference_notification)
-            
-            maskData = conn.read_characteristic_by_enum(linak_service.Characteristic.MASK)
-            self._mask = datatype.Mask( maskData )
-            self.logger.debug("Received mask: %s", self._mask)
-            
-            deviceName = conn.read_characteristic_by_enum(linak_service.Characteristic.DEVICE_NAME)
-            self._name = deviceName.decode("utf-8")
-            self.logger.debug("Received name: %s", self._name)
-            
-            try: 
-                ## on IKEA branded devices MANUFACTURER characteristic returns binary content than 
-                ## is impossible to convert to UTF-8 string. It leads to exception.
-                manufacturer = conn.read_characteristic_by_enum(linak_service.Characteristic.MANUFACTURER)
-                self._manu = manufacturer.decode("utf-8")
-                self.logger.debug("Received manufacturer: %s", self._manu)
-            except UnicodeDecodeError as e:
-                self.logger.error( "Reading manufacturer failed: %s %s", type(e), e )
-                self._manu = "<unknown manufacturer>"
-                pass
-            
-            model = conn.read_characteristic_by_enum(linak_service.Characteristic.MODEL_NUMBER)
-            self._model = model.decode("utf-8")
-            self.logger.debug("Received model: %s", self._model)
-            
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.DPG, self._handle_dpg_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.ERROR, self._handle_error_notification)
-            conn.subscribe_to_notification_enum(linak_service.Characteristic.SERVICE_CHANGED, self._handle_service_notification)
-            
-            conn.send_dpg_read_command( DPGCommandType.USER_ID )
-            
-            response = conn.send_dpg_read_command( DPGCommandType.GET_SETUP )
-            if response == False:
-                return False
-            
-            conn.send_dpg_read_command( DPGCommandType.PRODUCT_INFO )
-            
-            self._read_capabilities()
-            self._read_reminder_state()
-            conn.send_dpg_read_command( DPGCommandType.DESK_OFFSET )
-            
-            conn.send_dpg_write_command( DPGCommandType.USER_ID, self.CLIENT_ID )
-                             
-            heightData = conn.read_characteristic_by_enum(linak_service.Characteristic.HEIGHT_SPEED)
-            self._handle_heigh_speed_notification( linak_service.Characteristic.HEIGHT_SPEED.handle(), heightData )
-   
-            self._read_favorities_state()
-
-            ## conn.send_dpg_read_command( DPGCommandType.GET_SET_REMINDER_TIME )
-            ## conn.send_dpg_read_command( DPGCommandType.GET_LOG_ENTRY )
-            
-            heightNotification = conn.read_characteristic_by_handle(linak_service.Characteristic.HEIGHT_SPEED.handle() + 1)
-            self.logger.debug("Notification status: %s", heightNotification)
+    def _connect(self):
+        """Connect raising error of failed initialization."""
+        result = self.connect()
+        if result.error != None:
+            raise result.error
+        return result
+
+    def _start_notification_handler(self):
+        if self._reactor != None:
+            self._reactor.register( self._conn )
+            return
+        if self._notificationHandler == None:
+            ## notifications are handled by owner of desk (e.g. event loop of 'AsyncLinakDesk')
+            return
+        if self._notificationHandler.is_alive() == False:
+            self._notificationHandler.start()
 
-        self._notificationHandler.start()
+    def _start_state_refresh(self, cachedState):
+        refreshThread = Thread(target=self._refresh_state, args=(cachedState,), name=getThreadName("StateRefresh"))
+        refreshThread.daemon = True
+        refreshThread.start()
+
+    def _restore_state(self):
+        """Set state variables from state cache. Returns 'DeskState' or None if state is not cached."""
+        if self._stateCache == None:
+            return None
+        cachedState = self._stateCache.load( self._bdaddr )
+        if cachedState == None:
+            return None
+        for commandType in (DPGCommandType.GET_CAPABILITIES, DPGCommandType.DESK_OFFSET, DPGCommandType.REMINDER_SETTING):
+            if cachedState.get( commandType ) == None:
+                self.logger.debug("Incomplete cached state: %s", cachedState)
+                return None
+        self.logger.debug("Restoring state: %s", cachedState)
+        for commandType in DeskStateCache.BLOCKS:
+            data = cachedState.get( commandType )
+            if data == None:
+                continue
+            self._decode_dpg_response( commandType, data )
+            self._dpgBlocks[commandType] = data
+        return cachedState
+
+    def _refresh_state(self, cachedState):
+        """Read blocks restored from cache and update cache if any of them changed."""
+        try:
+            changed = []
+            favNum = self._capabilities.memSize
+            for commandType in DeskStateCache.BLOCKS:
+                if commandType in DeskStateCache.STATIC_BLOCKS:
+                    continue
+                favIndex = DPGCommandType.getMemoryPositionIndex( commandType )
+                if favIndex != None and favIndex > favNum:
+                    continue
+                self._conn.send_dpg_read_command( commandType )
+                if self._dpgBlocks.get( commandType ) != cachedState.get( commandType ):
+                    changed.append( commandType.name )
+            if len(changed) > 0:
+                self.logger.debug("Changed state blocks: %s", changed)
+                self._store_state()
+        except BaseException as e:
+            if self._conn.isConnected():
+                self.logger.error( "Refreshing state failed: %s %s", type(e), e )
 
-        self.logger.debug("Initialization done")
+    def _store_state(self):
+        if self._stateCache == None:
+            return
+        self._stateCache.store( self._bdaddr, self._firmware, self._dpgBlocks )
     
+    def supervise(self, backoff=None, maxAttempts=None):
+        """Start reconnecting desk automatically after link loss. Returns 'ConnectionSupervisor'."""
+        if self._supervisor == None:
+            self._supervisor = ConnectionSupervisor( self, backoff, maxAttempts ).start()
+        return self._supervisor
+
+    @property
+    def supervisor(self):
+        """'ConnectionSupervisor' of desk, None if not supervised."""
+        return self._supervisor
+
+    def _restore_session(self):
+        """Reconnect after link loss. State read from desk is kept, only subscriptions and height are restored."""
+        conn = self._conn
+        if conn.isConnected() == False:
+            conn.connect( attempts=1 )
+        conn.subscribe_to_notifications( self._notification_subscriptions() )
+        heightData = conn.read_characteristic_by_enum( linak_service.Characteristic.HEIGHT_SPEED )
+        self._handle_heigh_speed_notification( linak_service.Characteristic.HEIGHT_SPEED.handle(), heightData )
+        if self._notificationHandler != None or self._reactor != None:
+            self._start_notification_handler()
+
     def disconnect(self):
+        if self._supervisor != None:
+            self._supervisor.stop()
+            self._supervisor = None
+        if self._reactor != None:
+            self._reactor.unregister( self._conn )
         if self._notificationHandler != None:
             self._notificationHandler.stop()
-            self._notificationHandler.join()
+            if self._notificationHandler.is_alive():
+                self._notificationHandler.join()
             self._notificationHandler = None
         self._conn.disconnect()
+        if self._telemetryLog != None:
+            self._telemetryLog.flush()
     
     def set_position_change_callback(self, callback):
         self._posChangeCallback = callback
@@ -472,8 +642,8 @@ class LinakDesk:
                 retList.append(None)
         return retList
     
-    def read_favorite_number(self):
-        caps = self._wait_for_variable("_capabilities")
+    def read_favorite_number(self, timeout=None):
+        caps = self._wait_for_variable("_capabilities", timeout)
         if caps == None:
             return None
         return caps.memSize
@@ -501,6 +671,7 @@ class LinakDesk:
             favPos = self._without_desk_offset( newValue )
             fav.position = favPos
             self.logger.info("changed position %s %s %s", str(favNumber), str(value), favPos)
+        self._monitor.updated( '_fav_position_' + str(favNumber) )
         self._call_fav_callbacks(favNumber)
 
     def moveUp(self):
@@ -539,6 +710,10 @@ class LinakDesk:
             return conn.send_directional_command( command )
      
     def stopMoving(self):
+        with self._motionLock:
+            motion = self._motion
+        if motion != None:
+            motion.cancel()
         with self._conn as conn:
 #             self.logger.debug("Sending stopMoving")
             conn.send_control_command( ControlCommand.STOP_MOVING )
@@ -550,6 +725,7 @@ class LinakDesk:
         piston = self.current_height
         newOffset = cmValue - piston.cmDouble()
         self._desk_offset.setFromCm( newOffset )
+        self._monitor.updated( '_desk_offset' )
         
         with self._conn as conn:
             value = self._desk_offset.bytes()
@@ -587,6 +763,12 @@ class LinakDesk:
             ## wait for device to react
             ## sleep(2)
 
+    def set_reminder_settings(self, reminderSetting):
+        """Send reminder settings ('ReminderSetting' object). Returns settings read back from desk."""
+        with self._conn as conn:
+            conn.send_dpg_write_command( DPGCommandType.REMINDER_SETTING, reminderSetting.raw_data() )
+            return conn.send_dpg_read_command( DPGCommandType.REMINDER_SETTING )
+
     def selectReminder(self, number):
         self._reminder.switchReminder(number)
         self.send_reminder_state()
@@ -654,6 +836,12 @@ class LinakDesk:
             self.logger.info("Sending fav: %s %s %s %s", favNumber, value, to_bin_string( value ), to_hex_string( value ) )
             conn.send_dpg_write_command( cmd, value )
 
+    def _check_services(self, gattTable):
+        for linakService in (linak_service.Service.GENERIC_ACCESS, linak_service.Service.DPG, linak_service.Service.CONTROL,
+                             linak_service.Service.REFERENCE_INPUT, linak_service.Service.REFERENCE_OUTPUT):
+            if gattTable.hasService( linakService.uuid() ) == False:
+                raise RuntimeError("service not found: ", linakService)
+
     def _find_service(self, services, linakService):
         findUUID = linakService.uuid()
         for s in services:
@@ -694,27 +882,41 @@ class LinakDesk:
 #                 self.logger.debug("Desc: %s", desc)
 
 
+    def _notification_subscriptions(self):
+        """Returns list of (characteristic, callback) pairs of notifications handled by desk."""
+        Characteristic = linak_service.Characteristic
+        return [ (Characteristic.DPG, self._handle_dpg_notification),
+                 (Characteristic.ERROR, self._handle_error_notification),
+                 (Characteristic.SERVICE_CHANGED, self._handle_service_notification),
+                 (Characteristic.TWO, self._handle_reference_notification),
+                 (Characteristic.THREE, self._handle_reference_notification),
+                 (Characteristic.FOUR, self._handle_reference_notification),
+                 (Characteristic.FIVE, self._handle_reference_notification),
+                 (Characteristic.SIX, self._handle_reference_notification),
+                 (Characteristic.SEVEN, self._handle_reference_notification),
+                 (Characteristic.EIGHT, self._handle_reference_notification),
+                 ## last -- height notifications arrive when desk is ready
+                 (Characteristic.HEIGHT_SPEED, self._handle_heigh_speed_notification) ]
+
     def _handle_error_notification(self, cHandle, data):
         """Handle Callback from a Bluetooth (GATT) errors."""
-         
-        ### convert string to byte array
-        data = bytearray(data)
- 
-        self.logger.debug("XXXXX Received error data: [%s]", to_hex_string(data) )
+        self.logger.debug("XXXXX Received error data: [%s]", HexDump(data) )
         
     def _handle_heigh_speed_notification(self, cHandle, data):
         """Handle Callback from a Bluetooth (GATT) reference."""
          
-        ### convert string to byte array
-        data = bytearray(data)
- 
-        self._height_speed = datatype.HeightSpeed.from_bytes( data )
-        pos = self.current_height_with_offset.raw
-        raw = self.current_height.raw
-        self.logger.debug("Received height: %s %s data: %s", pos, raw, self._height_speed)
-        
-        for hand in self.logger.handlers:
-            hand.flush()
+        ## decoded in place -- 'unpack_from' does not copy payload
+        heightSpeed = datatype.HeightSpeed.from_bytes( data )
+        self._telemetry.append( monotonic(), heightSpeed.height.raw, heightSpeed.speed.raw )
+        if self._telemetryLog != None:
+            self._telemetryLog.append_height_speed( heightSpeed.height.raw, heightSpeed.speed.raw )
+        self._set_variable('_height_speed', heightSpeed)
+        if self.logger.isEnabledFor( logging.DEBUG ):
+            pos = None
+            if self._desk_offset != None:
+                ## offset could be not known yet (during initialization) -- do not wait for it
+                pos = self._with_desk_offset( heightSpeed.height ).raw
+            self.logger.debug("Received height: %s %s data: %s", pos, heightSpeed.height.raw, heightSpeed)
         
         if self._posChangeCallback != None:
             self._posChangeCallback()
@@ -723,20 +925,34 @@ class LinakDesk:
             
     def _handle_reference_notification(self, cHandle, data):
         """Handle Callback from a Bluetooth (GATT) reference."""
-        
-        ### convert string to byte array
-        
-        data = bytearray(data)
-        self.logger.debug("Received reference data: [%s]", to_hex_string(data) )
+        self.logger.debug("Received reference data: [%s]", HexDump(data) )
             
     def _handle_service_notification(self, cHandle, data):
         ### convert string to byte array
         
         data = bytearray(data)
-        self.logger.debug("Received service data: [%s]", to_hex_string(data) )
+        self.logger.debug("Received service data: [%s]", HexDump(data) )
+        ## attribute handles could change -- discover again on next connection
+        self._conn.invalidate_gatt_table()
         
     def processNotifications(self):
         return self._conn.processNotifications()
                 
 LinakDesk.logger = _LOGGER.getChild(LinakDesk.__name__)
 
+## decoders of DPG responses: command type -> 'handler(desk, commandType, data)'
+LinakDesk.DPG_HANDLERS = {
+    DPGCommandType.PRODUCT_INFO:                LinakDesk._decode_product_info,
+    DPGCommandType.GET_SETUP:                   LinakDesk._decode_ignored,
+    DPGCommandType.USER_ID:                     LinakDesk._decode_user_id,
+    DPGCommandType.GET_CAPABILITIES:            LinakDesk._decode_capabilities,
+    DPGCommandType.GET_SET_REMINDER_TIME:       LinakDesk._decode_ignored,
+    DPGCommandType.REMINDER_SETTING:            LinakDesk._decode_reminder,
+    DPGCommandType.DESK_OFFSET:                 LinakDesk._decode_desk_offset,
+    DPGCommandType.GET_SET_MEMORY_POSITION_1:   LinakDesk._decode_favorite,
+    DPGCommandType.GET_SET_MEMORY_POSITION_2:   LinakDesk._decode_favorite,
+    DPGCommandType.GET_SET_MEMORY_POSITION_3:   LinakDesk._decode_favorite,
+    DPGCommandType.GET_SET_MEMORY_POSITION_4:   LinakDesk._decode_favorite,
+    DPGCommandType.GET_LOG_ENTRY:               LinakDesk._decode_log_entry,
+}
+
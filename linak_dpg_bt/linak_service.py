@@ -38,10 +38,7 @@ class Service(Enum):
     @classmethod
     def find(cls, value):
         strval = str(value).upper()
-        for item in Service:
-            if item.uuid() == strval:
-                return item
-        return None
+        return _SERVICE_BY_UUID.get( strval )
     
     @classmethod
     def findByUUID(cls, uuid):
@@ -143,17 +140,11 @@ class Characteristic(Enum):
     @classmethod
     def findByUUID(cls, uuid):
         strval = str(uuid).upper()
-        for item in Characteristic:
-            if item.uuid() == strval:
-                return item
-        return None
+        return _CHARACTERISTIC_BY_UUID.get( strval )
     
     @classmethod
     def findByHandle(cls, handle):
-        for item in Characteristic:
-            if item.handle() == handle:
-                return item
-        return None
+        return _CHARACTERISTIC_BY_HANDLE.get( handle )
 
     @staticmethod
     def printCharacteristic(characteristic):
@@ -181,4 +172,9 @@ class Characteristic(Enum):
             if charEnum != None:
                 cName = charEnum.name
         return "%s[%s]" % ( cName, uuidStr )
-    
\ No newline at end of file
+
+
+## lookup tables -- notifications and writes are resolved without scanning enums
+_SERVICE_BY_UUID = { item.uuid(): item for item in Service }
+_CHARACTERISTIC_BY_UUID = { item.uuid(): item for item in Characteristic }
+_CHARACTERISTIC_BY_HANDLE = { item.handle(): item for item in Characteristic }
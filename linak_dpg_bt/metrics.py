@@ -0,0 +1,339 @@
+#
+# Counters and latency histograms of desk communication.
+#
+# Metrics are kept in 'MetricsRegistry' (process wide 'REGISTRY' by default). They can be
+# pulled as dict ('snapshot()') or as Prometheus text format ('prometheus_text()', 'MetricsServer').
+#
+
+import logging
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import linak_dpg_bt.linak_service as linak_service
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Counter:
+    """Monotonic counter."""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """Latency histogram with HDR-like log-linear buckets.
+
+    Values are stored in microseconds. Every power of two range is split into
+    'SUB_BUCKETS' linear buckets, so relative error of percentiles is below 1/16.
+    Recording is constant time and does not allocate.
+    """
+
+    SUB_BITS        = 4
+    SUB_BUCKETS     = 1 << SUB_BITS
+    MAX_SHIFT       = 32                                ## values up to ~38 hours
+    BUCKETS         = SUB_BUCKETS + (MAX_SHIFT + 1) * SUB_BUCKETS
+
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    __slots__ = ('count', 'sum', 'min', 'max', '_counts', '_lock')
+
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self._counts = array('Q', bytes( 8 * self.BUCKETS ))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _index(cls, micros):
+        if micros < cls.SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - cls.SUB_BITS - 1
+        if shift > cls.MAX_SHIFT:
+            return cls.BUCKETS - 1
+        return cls.SUB_BUCKETS + shift * cls.SUB_BUCKETS + (micros >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def _upper_bound(cls, index):
+        """Upper bound of bucket in seconds."""
+        if index < cls.SUB_BUCKETS:
+            return (index + 1) / 1000000.0
+        shift, sub = divmod( index - cls.SUB_BUCKETS, cls.SUB_BUCKETS )
+        return ((cls.SUB_BUCKETS + sub + 1) << shift) / 1000000.0
+
+    def observe(self, seconds):
+        index = self._index( max( int(seconds * 1000000), 0 ) )
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if self.min == None or seconds < self.min:
+                self.min = seconds
+            if self.max == None or seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, quantile):
+        """Returns upper bound of value at given quantile (in range [0, 1]), None if empty."""
+        with self._lock:
+            if self.count < 1:
+                return None
+            rank = max( quantile * self.count, 1 )
+            total = 0
+            for index, bucketCount in enumerate(self._counts):
+                total += bucketCount
+                if total >= rank:
+                    return min( self._upper_bound( index ), self.max )
+            return self.max
+
+    def snapshot(self):
+        ret = { "count": self.count, "sum": self.sum, "min": self.min, "max": self.max }
+        for quantile in self.QUANTILES:
+            ret[ "p%s" % str(quantile * 100).rstrip('0').rstrip('.') ] = self.percentile( quantile )
+        return ret
+
+
+class MetricsRegistry:
+    """Set of named metrics with labels."""
+
+    COUNTER     = "counter"
+    HISTOGRAM   = "summary"                             ## exported as Prometheus summary
+
+
+    def __init__(self):
+        self._metrics = {}                              ## (name, labels) -> metric
+        self._kinds = {}                                ## name -> (type, help)
+        self._lock = threading.Lock()
+
+    def counter(self, name, helpText="", **labels):
+        return self._get( name, self.COUNTER, helpText, Counter, labels )
+
+    def histogram(self, name, helpText="", **labels):
+        return self._get( name, self.HISTOGRAM, helpText, Histogram, labels )
+
+    def _get(self, name, kind, helpText, factory, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get( key )
+        if metric != None:
+            return metric
+        with self._lock:
+            registered = self._kinds.setdefault( name, (kind, helpText) )
+            if registered[0] != kind:
+                raise ValueError("metric %s already registered as %s" % (name, registered[0]))
+            return self._metrics.setdefault( key, factory() )
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+            self._kinds.clear()
+
+    def collect(self, **labels):
+        """Returns list of (name, labels, metric) sorted by name, filtered by given labels."""
+        with self._lock:
+            items = list( self._metrics.items() )
+        ret = []
+        for (name, metricLabels), metric in sorted( items, key=lambda item: item[0] ):
+            labelsDict = dict(metricLabels)
+            if any( labelsDict.get(key) != value for key, value in labels.items() ):
+                continue
+            ret.append( (name, labelsDict, metric) )
+        return ret
+
+    def snapshot(self, **labels):
+        """Returns dict: name -> list of {"labels": dict, "value": number or dict}."""
+        ret = {}
+        for name, metricLabels, metric in self.collect( **labels ):
+            ret.setdefault( name, [] ).append( { "labels": metricLabels, "value": metric.snapshot() } )
+        return ret
+
+    def prometheus_text(self):
+        lines = []
+        lastName = None
+        for name, labels, metric in self.collect():
+            if name != lastName:
+                kind, helpText = self._kinds[name]
+                if helpText:
+                    lines.append( "# HELP %s %s" % (name, helpText) )
+                lines.append( "# TYPE %s %s" % (name, kind) )
+                lastName = name
+            if isinstance(metric, Counter):
+                lines.append( "%s%s %s" % (name, _format_labels(labels), metric.value) )
+                continue
+            for quantile in Histogram.QUANTILES:
+                value = metric.percentile( quantile )
+                if value == None:
+                    continue
+                quantileLabels = dict(labels, quantile=str(quantile))
+                lines.append( "%s%s %r" % (name, _format_labels(quantileLabels), value) )
+            lines.append( "%s_sum%s %r" % (name, _format_labels(labels), metric.sum) )
+            lines.append( "%s_count%s %s" % (name, _format_labels(labels), metric.count) )
+        return "\n".join( lines ) + "\n"
+
+
+def _format_labels(labels):
+    if len(labels) < 1:
+        return ""
+    items = []
+    for key, value in sorted( labels.items() ):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        items.append( '%s="%s"' % (key, value) )
+    return "{" + ",".join( items ) + "}"
+
+
+## default registry used by connections
+REGISTRY = MetricsRegistry()
+
+
+class DeskMetrics:
+    """Metrics of single desk, bound to labels of its MAC address.
+
+    Instruments are created once and cached, so recording is a dict lookup
+    and increment under lock.
+    """
+
+    def __init__(self, mac, registry=None):
+        if registry == None:
+            registry = REGISTRY
+        self.mac = mac
+        self.registry = registry
+        self.connects = registry.counter( "linak_connects_total", "Successful connections", mac=mac )
+        self.connectFailures = registry.counter( "linak_connect_failures_total", "Failed connection attempts", mac=mac )
+        self.reconnects = registry.counter( "linak_reconnects_total", "Connections after the first one", mac=mac )
+        self.connectTime = registry.histogram( "linak_connect_seconds", "Time of establishing connection", mac=mac )
+        self.retries = registry.counter( "linak_dpg_retries_total", "Repeated DPG commands", mac=mac )
+        self.timeouts = registry.counter( "linak_dpg_timeouts_total", "DPG commands without response", mac=mac )
+        self.pulls = registry.counter( "linak_notification_pulls_total", "Reads forcing missing notifications", mac=mac )
+        self.lockWait = registry.histogram( "linak_lock_wait_seconds", "Time waited for contended connection lock", mac=mac )
+        self.motionWrites = registry.counter( "linak_motion_writes_total", "Move commands sent by motions", mac=mac )
+        self._commandLatency = {}
+        self._notifications = {}
+        self._writes = {}
+        self._readLatency = {}
+        self._motions = {}
+        self._connected = False
+
+    def _characteristic_name(self, handle):
+        characteristic = linak_service.Characteristic.findByHandle( handle )
+        if characteristic == None:
+            return "0x%04X" % handle
+        return characteristic.name
+
+    def command_latency(self, commandType):
+        histogram = self._commandLatency.get( commandType )
+        if histogram == None:
+            histogram = self.registry.histogram( "linak_dpg_command_seconds", "DPG command round trip time",
+                                                 mac=self.mac, command=commandType.name )
+            self._commandLatency[commandType] = histogram
+        return histogram
+
+    def notification(self, handle):
+        counter = self._notifications.get( handle )
+        if counter == None:
+            counter = self.registry.counter( "linak_notifications_total", "Received notifications",
+                                             mac=self.mac, characteristic=self._characteristic_name( handle ) )
+            self._notifications[handle] = counter
+        counter.inc()
+
+    def write(self, handle):
+        counter = self._writes.get( handle )
+        if counter == None:
+            counter = self.registry.counter( "linak_writes_total", "Written characteristic values",
+                                             mac=self.mac, characteristic=self._characteristic_name( handle ) )
+            self._writes[handle] = counter
+        counter.inc()
+
+    def read_latency(self, handle):
+        histogram = self._readLatency.get( handle )
+        if histogram == None:
+            histogram = self.registry.histogram( "linak_read_seconds", "Characteristic read time",
+                                                 mac=self.mac, characteristic=self._characteristic_name( handle ) )
+            self._readLatency[handle] = histogram
+        return histogram
+
+    def connected(self, seconds):
+        if self._connected:
+            self.reconnects.inc()
+        self._connected = True
+        self.connects.inc()
+        self.connectTime.observe( seconds )
+
+    def motion(self, state, seconds, writes):
+        """Record finished 'MotionController'."""
+        metrics = self._motions.get( state )
+        if metrics == None:
+            metrics = ( self.registry.counter( "linak_motions_total", "Finished motions", mac=self.mac, state=state ),
+                        self.registry.histogram( "linak_motion_seconds", "Duration of motions", mac=self.mac, state=state ) )
+            self._motions[state] = metrics
+        metrics[0].inc()
+        if seconds != None:
+            metrics[1].observe( seconds )
+        self.motionWrites.inc( writes )
+
+    def snapshot(self):
+        return self.registry.snapshot( mac=self.mac )
+
+
+class MetricsServer:
+    """HTTP server exposing registry in Prometheus text format under '/metrics'."""
+
+    logger = None
+
+
+    def __init__(self, registry=None, port=9464, host="127.0.0.1"):
+        if registry == None:
+            registry = REGISTRY
+        self.registry = registry
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error( 404 )
+                    return
+                body = server.registry.prometheus_text().encode()
+                self.send_response( 200 )
+                self.send_header( "Content-Type", "text/plain; version=0.0.4; charset=utf-8" )
+                self.send_header( "Content-Length", str(len(body)) )
+                self.end_headers()
+                self.wfile.write( body )
+
+            def log_message(self, format, *args):
+                server.logger.debug( format, *args )
+
+        self._server = ThreadingHTTPServer( (host, port), Handler )
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread( target=self._server.serve_forever, name="MetricsServer" )
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Serving metrics on http://%s:%s/metrics", *self.address[0:2])
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread != None:
+            self._thread.join()
+            self._thread = None
+
+MetricsServer.logger = _LOGGER.getChild(MetricsServer.__name__)
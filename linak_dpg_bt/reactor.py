@@ -0,0 +1,195 @@
+#
+# Single thread handling notifications of many connections.
+#
+
+import os
+import logging
+import threading
+import selectors
+from time import monotonic
+
+from bluepy import btle
+
+from .threadcounter import getThreadName
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class NotificationReactor:
+    """Waits for data of all registered 'BTLEConnection' objects in one thread.
+
+    Descriptors of connections (bluepy-helper output pipes) are multiplexed by 'selectors'
+    (epoll on Linux) and readable connection handles its pending notifications. Thread
+    sleeps in 'select()' without timeout while nothing happens.
+
+    Connection busy with command of other thread consumes notifications itself -- its
+    descriptor is left out of selection for 'BUSY_RETRY' seconds. Connections without
+    descriptor are polled every 'POLL_INTERVAL' seconds.
+    """
+
+    logger = None
+
+    BUSY_RETRY      = 0.005
+    POLL_INTERVAL   = 0.05
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+
+    @classmethod
+    def instance(cls):
+        """Process wide reactor."""
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = NotificationReactor()
+            return cls._instance
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._wakeRead, self._wakeWrite = os.pipe()
+        os.set_blocking( self._wakeRead, False )
+        os.set_blocking( self._wakeWrite, False )
+        self._selector.register( self._wakeRead, selectors.EVENT_READ, None )
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._dirty = set()                     ## connections to synchronize with selector
+        self._fds = {}                          ## connection -> registered descriptor
+        self._busy = {}                         ## connection -> time of next check
+        self._polled = set()                    ## connections without descriptor
+        self._thread = None
+        self._stopped = False
+        self.dispatches = 0
+
+    def __len__(self):
+        return len(self._connections)
+
+    def register(self, connection):
+        """Start handling notifications of connection (also after its reconnections)."""
+        with self._lock:
+            self._connections.add( connection )
+            connection.reactor = self
+            if self._thread is None:
+                self._thread = threading.Thread( target=self.run, name=getThreadName("Reactor") )
+                self._thread.daemon = True
+                self._thread.start()
+        self.update( connection )
+
+    def unregister(self, connection):
+        with self._lock:
+            self._connections.discard( connection )
+            if connection.reactor is self:
+                connection.reactor = None
+        self.update( connection )
+
+    def update(self, connection):
+        """Called by connection after connecting or disconnecting -- descriptor has changed."""
+        with self._lock:
+            self._dirty.add( connection )
+        self._wakeup()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        self._wakeup()
+        if thread != None and threading.current_thread() != thread:
+            thread.join()
+
+    def _wakeup(self):
+        try:
+            os.write( self._wakeWrite, b'\x01' )
+        except BlockingIOError:
+            ## pipe full -- reactor is going to wake up anyway
+            pass
+
+    def run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    break
+                dirty = self._dirty
+                self._dirty = set()
+            for connection in dirty:
+                self._sync( connection )
+            for key, _ in self._selector.select( self._timeout() ):
+                if key.data is None:
+                    self._drain_wakeup()
+                    continue
+                self._dispatch( key.data )
+            self._retry_busy()
+            for connection in list(self._polled):
+                self._dispatch( connection )
+        self._selector.close()
+
+    def _timeout(self):
+        if len(self._busy) > 0:
+            return max( min( self._busy.values() ) - monotonic(), 0 )
+        if len(self._polled) > 0:
+            return self.POLL_INTERVAL
+        ## nothing to do until descriptor becomes readable
+        return None
+
+    def _drain_wakeup(self):
+        try:
+            while len( os.read( self._wakeRead, 512 ) ) > 0:
+                pass
+        except BlockingIOError:
+            pass
+
+    def _sync(self, connection):
+        """Register current descriptor of connection."""
+        self._unwatch( connection )
+        self._busy.pop( connection, None )
+        with self._lock:
+            registered = connection in self._connections
+        if registered == False or connection.isConnected() == False:
+            return
+        fileno = connection.fileno()
+        if fileno == None:
+            self._polled.add( connection )
+            return
+        try:
+            key = self._selector.get_key( fileno )
+            ## descriptor was closed and reused (e.g. pooled helper) -- previous owner is stale and
+            ## kernel does not watch descriptor any more, 'modify()' would replace only the data
+            self._fds.pop( key.data, None )
+            self._selector.unregister( fileno )
+        except KeyError:
+            pass
+        self._selector.register( fileno, selectors.EVENT_READ, connection )
+        self._fds[connection] = fileno
+
+    def _unwatch(self, connection):
+        self._polled.discard( connection )
+        fileno = self._fds.pop( connection, None )
+        if fileno == None:
+            return
+        try:
+            key = self._selector.get_key( fileno )
+            if key.data is connection:
+                self._selector.unregister( fileno )
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def _dispatch(self, connection):
+        self.dispatches += 1
+        try:
+            if connection.handle_available_notifications( blocking=False ) == False:
+                ## other thread holds connection and receives notifications itself
+                self._unwatch( connection )
+                self._busy[connection] = monotonic() + self.BUSY_RETRY
+        except (btle.BTLEException, ConnectionError, OSError) as e:
+            ## link lost -- connection disconnects itself and calls 'update()'
+            self.logger.debug("Handling notifications failed: %s %s", type(e), e)
+            self._unwatch( connection )
+        except BaseException as e:
+            self.logger.exception("Notification callback failed: %s %s", type(e), e)
+
+    def _retry_busy(self):
+        now = monotonic()
+        for connection, retryTime in list(self._busy.items()):
+            if retryTime <= now:
+                self._sync( connection )
+
+NotificationReactor.logger = _LOGGER.getChild(NotificationReactor.__name__)
@@ -0,0 +1,641 @@
+#
+#
+#
+
+import os
+import logging
+import struct
+import random
+import heapq
+import itertools
+import threading
+from collections import deque
+from time import sleep, monotonic
+
+from bluepy import btle
+
+import linak_dpg_bt.linak_service as linak_service
+from .command import DPGCommandType, ControlCommand
+from .threadcounter import getThreadName
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+GENERIC_ATTRIBUTE_UUID  = "00001801-0000-1000-8000-00805F9B34FB"
+DEVICE_INFORMATION_UUID = "0000180A-0000-1000-8000-00805F9B34FB"
+
+
+PROP_READ           = btle.Characteristic.props["READ"]
+PROP_WRITE_NO_RESP  = btle.Characteristic.props["WRITE_NO_RESP"]
+PROP_WRITE          = btle.Characteristic.props["WRITE"]
+PROP_NOTIFY         = btle.Characteristic.props["NOTIFY"]
+PROP_INDICATE       = btle.Characteristic.props["INDICATE"]
+
+
+## GATT table of simulated device: (service uuid, start handle, end handle, [(characteristic, properties)])
+## value handles are taken from 'linak_service.Characteristic', declaration handle is always 'value - 1'
+## and CCCD descriptor (if any) is always 'value + 1'
+GATT_TABLE = [
+    ( linak_service.Service.GENERIC_ACCESS.uuid(), 0x01, 0x07, [
+        (linak_service.Characteristic.DEVICE_NAME,      PROP_READ),
+    ] ),
+    ( GENERIC_ATTRIBUTE_UUID, 0x08, 0x0B, [
+        (linak_service.Characteristic.SERVICE_CHANGED,  PROP_INDICATE),
+    ] ),
+    ( linak_service.Service.CONTROL.uuid(), 0x0C, 0x11, [
+        (linak_service.Characteristic.CONTROL,          PROP_WRITE | PROP_WRITE_NO_RESP),
+        (linak_service.Characteristic.ERROR,            PROP_READ | PROP_NOTIFY),
+    ] ),
+    ( linak_service.Service.DPG.uuid(), 0x12, 0x15, [
+        (linak_service.Characteristic.DPG,              PROP_READ | PROP_WRITE | PROP_NOTIFY),
+    ] ),
+    ( DEVICE_INFORMATION_UUID, 0x16, 0x1A, [
+        (linak_service.Characteristic.MANUFACTURER,     PROP_READ),
+        (linak_service.Characteristic.MODEL_NUMBER,     PROP_READ),
+    ] ),
+    ( linak_service.Service.REFERENCE_OUTPUT.uuid(), 0x1B, 0x36, [
+        (linak_service.Characteristic.HEIGHT_SPEED,     PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.TWO,              PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.THREE,            PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.FOUR,             PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.FIVE,             PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.SIX,              PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.SEVEN,            PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.EIGHT,            PROP_READ | PROP_NOTIFY),
+        (linak_service.Characteristic.MASK,             PROP_READ),
+    ] ),
+    ( linak_service.Service.REFERENCE_INPUT.uuid(), 0x37, 0x3B, [
+        (linak_service.Characteristic.CTRL1,            PROP_READ | PROP_WRITE | PROP_WRITE_NO_RESP),
+    ] ),
+]
+
+
+class SimulationScheduler:
+    """Single daemon thread executing delayed events of all simulated desks."""
+
+    logger = None
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+
+    @classmethod
+    def instance(cls):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = SimulationScheduler()
+            return cls._instance
+
+    def __init__(self):
+        self._queue = []                        ## heap of (time, seq, function, args)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay, function, *args):
+        with self._cond:
+            eventTime = monotonic() + max(delay, 0.0)
+            heapq.heappush( self._queue, (eventTime, next(self._sequence), function, args) )
+            if self._thread is None:
+                self._thread = threading.Thread( target=self._run, name=getThreadName("SimScheduler") )
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while len(self._queue) < 1:
+                    self._cond.wait()
+                eventTime = self._queue[0][0]
+                delay = eventTime - monotonic()
+                if delay > 0:
+                    self._cond.wait( delay )
+                    continue
+                _, _, function, args = heapq.heappop( self._queue )
+            try:
+                function( *args )
+            except BaseException as e:
+                self.logger.exception( "simulation event failed: %s %s", type(e), e )
+
+SimulationScheduler.logger = _LOGGER.getChild(SimulationScheduler.__name__)
+
+
+class SimulatedDesk:
+    """
+    State machine of simulated Linak desk.
+
+    Desk answers DPG commands, executes move/stop commands and emits HEIGHT_SPEED
+    notifications while moving. Single desk can be connected by many 'SimulatedPeripheral'
+    objects. Raw heights are given in 0.1 mm units (as in 'DeskPosition').
+    """
+
+    logger = None
+
+    MAX_HEIGHT = 6500
+
+
+    def __init__(self, name="Desk 8335", manufacturer="Linak", model="DPG1C",
+                 height=0, offset=6200, favorites=(800, 4000), memSize=2,
+                 speed=380, notifyInterval=0.1, keepAliveTimeout=1.0,
+                 latency=0.0, jitter=0.0, dropRate=0.0, connectTime=0.0, seed=None):
+        """
+        :param speed: moving speed in raw units per second
+        :param notifyInterval: interval of HEIGHT_SPEED notifications while moving
+        :param keepAliveTimeout: desk stops if move command is not repeated within given time
+        :param latency: one way latency of radio link in seconds
+        :param jitter: maximum random delay added to latency
+        :param dropRate: probability of loosing notification
+        :param connectTime: time required to establish connection
+        """
+        self.name = name
+        self.manufacturer = manufacturer
+        self.model = model
+        self.productInfo = bytes([0x01, 0x05, 0x01, 0x00])
+        self.memSize = memSize
+        self.speed = speed
+        self.notifyInterval = notifyInterval
+        self.keepAliveTimeout = keepAliveTimeout
+        self.latency = latency
+        self.jitter = jitter
+        self.dropRate = dropRate
+        self.connectTime = connectTime
+
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._scheduler = SimulationScheduler.instance()
+        self._peripherals = []
+
+        self._height = height
+        self._offset = offset
+        self._opCounter = 1
+        self._favorites = []
+        for i in range(4):
+            pos = favorites[i] if i < len(favorites) else None
+            self._favorites.append( [pos, self._opCounter] )
+        self._reminder = [ 0b0100001, 55, 5, 45, 15, 30, 30, self._opCounter ]
+        self._userId = bytes([0x01])
+
+        self._target = None
+        self._direction = 0
+        self._lastKeepAlive = 0.0
+        self._lastTick = 0.0
+        self._tickScheduled = False
+
+        self.writeCounter = 0
+        self.reachable = True                       ## connecting fails if False
+
+    @property
+    def height(self):
+        with self._lock:
+            return self._height
+
+    @property
+    def offset(self):
+        with self._lock:
+            return self._offset
+
+    def isMoving(self):
+        with self._lock:
+            return self._direction != 0
+
+    def favorite(self, number):
+        with self._lock:
+            return self._favorites[number-1][0]
+
+    def createPeripheral(self, *args, **kwargs):
+        """Factory compatible with 'btle.Peripheral' constructor."""
+        return SimulatedPeripheral(self)
+
+    ## ================= radio link =================
+
+    def roundTrip(self):
+        delay = 2 * self.latency + self._randomJitter()
+        if delay > 0:
+            sleep(delay)
+
+    def _randomJitter(self):
+        if self.jitter <= 0:
+            return 0.0
+        with self._lock:
+            return self._random.uniform(0, self.jitter)
+
+    def _isDropped(self):
+        if self.dropRate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.dropRate
+
+    def dropLinks(self):
+        """Simulate loss of radio link of all connected peripherals."""
+        with self._lock:
+            peripherals = list(self._peripherals)
+        for peripheral in peripherals:
+            peripheral.linkLost()
+
+    def attach(self, peripheral):
+        with self._lock:
+            if peripheral not in self._peripherals:
+                self._peripherals.append( peripheral )
+
+    def detach(self, peripheral):
+        with self._lock:
+            if peripheral in self._peripherals:
+                self._peripherals.remove( peripheral )
+
+    def notify(self, handle, data):
+        with self._lock:
+            peripherals = list(self._peripherals)
+        for periph in peripherals:
+            if periph.isSubscribed(handle) == False:
+                continue
+            if self._isDropped():
+                self.logger.debug( "dropping notification %s", hex(handle) )
+                continue
+            delay = self.latency + self._randomJitter()
+            self._scheduler.schedule( delay, periph._deliver, handle, bytes(data) )
+
+    ## ================= GATT access =================
+
+    def read(self, handle):
+        with self._lock:
+            if handle == linak_service.Characteristic.DEVICE_NAME.handle():
+                return self.name.encode("utf-8")
+            if handle == linak_service.Characteristic.MANUFACTURER.handle():
+                return self.manufacturer.encode("utf-8")
+            if handle == linak_service.Characteristic.MODEL_NUMBER.handle():
+                return self.model.encode("utf-8")
+            if handle == linak_service.Characteristic.MASK.handle():
+                return bytes([0x01])
+            if handle == linak_service.Characteristic.HEIGHT_SPEED.handle():
+                return self._heightSpeedData()
+            if handle == linak_service.Characteristic.ERROR.handle():
+                return bytes([0x00])
+            if handle == linak_service.Characteristic.CTRL1.handle():
+                return struct.pack('<H', self._height)
+            if handle == linak_service.Characteristic.DPG.handle():
+                return bytes([0x01, 0x00])
+            charEnum = linak_service.Characteristic.findByHandle(handle)
+            if charEnum is not None:
+                return bytes(4)
+        raise btle.BTLEGattError( "Bluetooth command failed", {'estat': [10], 'emsg': ['invalid handle']} )
+
+    def write(self, handle, value):
+        with self._lock:
+            self.writeCounter += 1
+        if handle == linak_service.Characteristic.DPG.handle():
+            response = self._handleDpg( bytes(value) )
+            if response is not None:
+                self.notify( handle, response )
+            return
+        if handle == linak_service.Characteristic.CONTROL.handle():
+            self._handleControl( bytes(value) )
+            return
+        if handle == linak_service.Characteristic.CTRL1.handle():
+            target = struct.unpack('<H', bytes(value[0:2]))[0]
+            self._moveTo( target )
+            return
+        ## other handles are silently accepted
+
+    ## ================= DPG =================
+
+    def _handleDpg(self, frame):
+        if len(frame) < 3 or frame[0] != 0x7F:
+            return bytes([0x00, 0x00])
+        commandType = DPGCommandType.findType( frame[1] )
+        isWrite = (frame[2] == 0x80)
+        payload = frame[3:]
+        with self._lock:
+            if isWrite:
+                return self._handleDpgWrite( commandType, payload )
+            return self._handleDpgRead( commandType )
+
+    def _handleDpgRead(self, commandType):
+        if commandType == DPGCommandType.PRODUCT_INFO:
+            return self._response( self.productInfo )
+        if commandType == DPGCommandType.USER_ID:
+            return self._response( self._userId )
+        if commandType == DPGCommandType.GET_CAPABILITIES:
+            capByte = (self.memSize & 7) | 8 | 16 | 32
+            return self._response( bytes([capByte, 0x01]) )
+        if commandType == DPGCommandType.DESK_OFFSET:
+            return self._response( bytes([0x01]) + struct.pack('<H', self._offset) )
+        if commandType == DPGCommandType.REMINDER_SETTING:
+            return self._response( bytes(self._reminder[0:7]) + struct.pack('<I', self._reminder[7]) )
+        favIndex = self._favoriteIndex( commandType )
+        if favIndex is not None:
+            pos, counter = self._favorites[favIndex]
+            if pos is None:
+                return self._response( bytes([0x00]) + struct.pack('<I', counter) )
+            return self._response( bytes([0x01]) + struct.pack('<H', pos) + struct.pack('<I', counter) )
+        ## GET_SETUP, GET_LOG_ENTRY and others -- confirmation only
+        return bytes([0x01, 0x00])
+
+    def _handleDpgWrite(self, commandType, payload):
+        if commandType == DPGCommandType.USER_ID:
+            self._userId = bytes([0x01]) + payload
+        elif commandType == DPGCommandType.DESK_OFFSET:
+            if len(payload) >= 3 and payload[0] == 1:
+                self._offset = struct.unpack('<H', payload[1:3])[0]
+        elif commandType == DPGCommandType.REMINDER_SETTING:
+            if len(payload) >= 7:
+                self._opCounter += 1
+                self._reminder = list(payload[0:7]) + [self._opCounter]
+        else:
+            favIndex = self._favoriteIndex( commandType )
+            if favIndex is not None:
+                self._opCounter += 1
+                if len(payload) >= 3 and payload[0] == 1:
+                    pos = struct.unpack('<H', payload[1:3])[0]
+                    self._favorites[favIndex] = [pos, self._opCounter]
+                else:
+                    self._favorites[favIndex] = [None, self._opCounter]
+        return bytes([0x01, 0x00])
+
+    def _response(self, payload):
+        return bytes([0x01, len(payload)]) + payload
+
+    def _favoriteIndex(self, commandType):
+        number = DPGCommandType.getMemoryPositionIndex( commandType )
+        if number is None:
+            return None
+        return number - 1
+
+    ## ================= motion =================
+
+    def _handleControl(self, value):
+        command = value[0]
+        if command == ControlCommand.MOVE_1_UP.value:
+            self._moveTo( self.MAX_HEIGHT )
+        elif command == ControlCommand.MOVE_1_DOWN.value:
+            self._moveTo( 0 )
+        elif command == ControlCommand.STOP_MOVING.value:
+            self._stop()
+
+    def _moveTo(self, target):
+        with self._lock:
+            target = max(0, min(target, self.MAX_HEIGHT))
+            now = monotonic()
+            self._lastKeepAlive = now
+            if target == self._height:
+                return
+            self._target = target
+            direction = 1 if target > self._height else -1
+            if self._direction == 0:
+                self._lastTick = now
+            self._direction = direction
+            if self._tickScheduled == False:
+                self._tickScheduled = True
+                self._scheduler.schedule( self.notifyInterval, self._tick )
+
+    def _stop(self):
+        with self._lock:
+            if self._direction == 0:
+                return
+            self._advance( monotonic() )
+            self._direction = 0
+            self._target = None
+            data = self._heightSpeedData()
+        self.notify( linak_service.Characteristic.HEIGHT_SPEED.handle(), data )
+
+    def _advance(self, now):
+        dt = now - self._lastTick
+        self._lastTick = now
+        if self._direction == 0:
+            return
+        step = int(round(self.speed * dt))
+        if self._direction > 0:
+            self._height = min(self._height + step, self._target)
+        else:
+            self._height = max(self._height - step, self._target)
+        if self._height == self._target:
+            self._direction = 0
+            self._target = None
+
+    def _tick(self):
+        with self._lock:
+            self._tickScheduled = False
+            if self._direction == 0:
+                return
+            now = monotonic()
+            self._advance( now )
+            if self._direction != 0 and now - self._lastKeepAlive > self.keepAliveTimeout:
+                ## move command was not repeated -- stop
+                self._direction = 0
+                self._target = None
+            data = self._heightSpeedData()
+            if self._direction != 0:
+                self._tickScheduled = True
+                self._scheduler.schedule( self.notifyInterval, self._tick )
+        self.notify( linak_service.Characteristic.HEIGHT_SPEED.handle(), data )
+
+    def _heightSpeedData(self):
+        speed = self._direction * self.speed
+        return struct.pack('<Hh', self._height, speed)
+
+SimulatedDesk.logger = _LOGGER.getChild(SimulatedDesk.__name__)
+
+
+class SimulatedPeripheral:
+    """Drop-in replacement of 'btle.Peripheral' connected to 'SimulatedDesk'."""
+
+    logger = None
+
+
+    def __init__(self, desk):
+        self.desk = desk
+        self.delegate = btle.DefaultDelegate()
+        self.addr = None
+        self.addrType = None
+        self.iface = None
+        self._connected = False
+        self._subscriptions = set()
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self._services = None
+        ## pipe readable while notifications are pending -- counterpart of bluepy-helper's output
+        self._pipeRead, self._pipeWrite = os.pipe()
+        os.set_blocking( self._pipeRead, False )
+
+    def __del__(self):
+        for fd in (self._pipeRead, self._pipeWrite):
+            try:
+                os.close( fd )
+            except OSError:
+                pass
+
+    def fileno(self):
+        return self._pipeRead
+
+    def withDelegate(self, delegate_):
+        self.delegate = delegate_
+        return self
+
+    def setDelegate(self, delegate_):
+        return self.withDelegate(delegate_)
+
+    def connect(self, addr, addrType=btle.ADDR_TYPE_PUBLIC, iface=None):
+        if len(addr.split(":")) != 6:
+            raise ValueError("Expected MAC address, got %s" % repr(addr))
+        if self.desk.connectTime > 0:
+            sleep( self.desk.connectTime )
+        if self.desk.reachable == False:
+            raise btle.BTLEDisconnectError( "Failed to connect to peripheral %s" % addr, None )
+        self.addr = addr
+        self.addrType = addrType
+        self.iface = iface
+        self._connected = True
+        self.desk.attach( self )
+
+    def disconnect(self):
+        if self._connected == False:
+            return
+        self._connected = False
+        self.desk.detach( self )
+        with self._cond:
+            self._subscriptions.clear()
+            while len(self._ready) > 0:
+                self._popReady()
+            self._cond.notify_all()
+
+    def linkLost(self):
+        """Drop connection without request -- next operation raises 'BTLEDisconnectError'."""
+        self.disconnect()
+        ## wake up waiting for data, as bluepy-helper does reporting disconnection
+        os.write( self._pipeWrite, b'\x01' )
+
+    def getState(self):
+        if self._connected:
+            return "conn"
+        return "disc"
+
+    def isSubscribed(self, handle):
+        return handle in self._subscriptions
+
+    ## ================= discovery =================
+
+    def getServices(self):
+        self._checkConnected()
+        if self._services is None:
+            ## Read By Group Type -- single 128-bit service per response
+            for _ in range(0, len(GATT_TABLE) + 1):
+                self.desk.roundTrip()
+            self._services = [ btle.Service(self, uuid, start, end) for (uuid, start, end, _) in GATT_TABLE ]
+        return self._services
+
+    def getServiceByUUID(self, uuidVal):
+        uuid = btle.UUID(uuidVal)
+        for serv in self.getServices():
+            if serv.uuid == uuid:
+                return serv
+        raise btle.BTLEGattError( "Service %s not found" % (uuid.getCommonName()), None )
+
+    def getCharacteristics(self, startHnd=1, endHnd=0xFFFF, uuid=None):
+        self._checkConnected()
+        uuidFilter = None
+        if uuid is not None:
+            uuidFilter = btle.UUID(uuid)
+        retList = []
+        for (_, _, _, charList) in GATT_TABLE:
+            for charEnum, props in charList:
+                valHandle = charEnum.handle()
+                if valHandle < startHnd or valHandle > endHnd:
+                    continue
+                if uuidFilter is not None and btle.UUID(charEnum.uuid()) != uuidFilter:
+                    continue
+                retList.append( btle.Characteristic(self, charEnum.uuid(), valHandle - 1, props, valHandle) )
+        ## Read By Type -- single 128-bit declaration per response, last request ends discovery
+        for _ in range(0, len(retList) + 1):
+            self.desk.roundTrip()
+        return retList
+
+    def getDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        return []
+
+    ## ================= data access =================
+
+    def readCharacteristic(self, handle):
+        self._checkConnected()
+        self.desk.roundTrip()
+        charEnum = linak_service.Characteristic.findByHandle( handle - 1 )
+        if charEnum is not None and self._isNotifiable(charEnum):
+            ## CCCD descriptor
+            value = bytes([0x01, 0x00]) if self.isSubscribed(handle - 1) else bytes([0x00, 0x00])
+        else:
+            value = self.desk.read( handle )
+        self._deliverReady()
+        return value
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        self._checkConnected()
+        if withResponse:
+            self.desk.roundTrip()
+        charEnum = linak_service.Characteristic.findByHandle( handle - 1 )
+        if charEnum is not None and self._isNotifiable(charEnum):
+            ## CCCD descriptor
+            with self._cond:
+                if len(val) > 0 and (val[0] & 0x03) != 0:
+                    self._subscriptions.add( handle - 1 )
+                else:
+                    self._subscriptions.discard( handle - 1 )
+        else:
+            self.desk.write( handle, val )
+        self._deliverReady()
+        return {'rsp': ['wr']}
+
+    def waitForNotifications(self, timeout):
+        self._checkConnected()
+        with self._cond:
+            if len(self._ready) < 1:
+                self._cond.wait_for( lambda: len(self._ready) > 0 or self._connected == False, timeout )
+            if len(self._ready) < 1:
+                return False
+            handle, data = self._popReady()
+        self._callDelegate( handle, data )
+        return True
+
+    ## ================= internals =================
+
+    def _isNotifiable(self, charEnum):
+        for (_, _, _, charList) in GATT_TABLE:
+            for item, props in charList:
+                if item == charEnum:
+                    return (props & (PROP_NOTIFY | PROP_INDICATE)) != 0
+        return False
+
+    def _checkConnected(self):
+        if self._connected == False:
+            raise btle.BTLEDisconnectError( "Device disconnected", None )
+
+    def _deliver(self, handle, data):
+        with self._cond:
+            if self._connected == False:
+                return
+            self._ready.append( (handle, data) )
+            os.write( self._pipeWrite, b'\x01' )
+            self._cond.notify_all()
+
+    def _deliverReady(self):
+        ## bluepy passes notifications received while waiting for response to delegate
+        while True:
+            with self._cond:
+                if len(self._ready) < 1:
+                    return
+                handle, data = self._popReady()
+            self._callDelegate( handle, data )
+
+    def _popReady(self):
+        item = self._ready.popleft()
+        try:
+            os.read( self._pipeRead, 1 )
+        except BlockingIOError:
+            pass
+        return item
+
+    def _callDelegate(self, handle, data):
+        delegate = self.delegate
+        if delegate is not None:
+            delegate.handleNotification( handle, data )
+
+SimulatedPeripheral.logger = _LOGGER.getChild(SimulatedPeripheral.__name__)
@@ -0,0 +1,87 @@
+#
+# Cache of DPG state of desks.
+#
+
+import os
+import logging
+
+from .file_cache import JsonFileCache
+from .command import DPGCommandType
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DeskState:
+    """Raw DPG responses of desk (dict 'DPGCommandType -> bytes') with firmware version."""
+
+    def __init__(self, firmware, blocks):
+        self.firmware = firmware
+        self.blocks = blocks
+
+    def get(self, commandType):
+        return self.blocks.get( commandType )
+
+    def to_dict(self):
+        data = dict()
+        data["firmware"] = self.firmware
+        data["blocks"] = { commandType.name: self.blocks[commandType].hex() for commandType in self.blocks }
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        blocks = dict()
+        for name, value in data["blocks"].items():
+            blocks[ DPGCommandType[name] ] = bytes.fromhex( value )
+        return cls( data["firmware"], blocks )
+
+    def __str__(self):
+        return "%s[firmware: %s blocks: %s]" % (self.__class__.__name__, self.firmware, ", ".join(item.name for item in self.blocks))
+
+
+class DeskStateCache(JsonFileCache):
+    """DPG state of desks stored in JSON file, keyed by MAC address.
+
+    Cached state allows to restore desk settings before reading them from device.
+    """
+
+    logger = None
+
+    DEFAULT_PATH = os.path.join( JsonFileCache.DEFAULT_DIR, "state.json" )
+
+    ## blocks stored in cache
+    BLOCKS = [ DPGCommandType.GET_CAPABILITIES,
+               DPGCommandType.DESK_OFFSET,
+               DPGCommandType.REMINDER_SETTING,
+               DPGCommandType.GET_SET_MEMORY_POSITION_1,
+               DPGCommandType.GET_SET_MEMORY_POSITION_2,
+               DPGCommandType.GET_SET_MEMORY_POSITION_3,
+               DPGCommandType.GET_SET_MEMORY_POSITION_4 ]
+
+    ## blocks that do not change for given firmware -- not read again
+    STATIC_BLOCKS = [ DPGCommandType.GET_CAPABILITIES ]
+
+
+    def __init__(self, path=None):
+        if path == None:
+            path = self.DEFAULT_PATH
+        JsonFileCache.__init__(self, path)
+
+    def load(self, mac):
+        """Returns 'DeskState' or None if not cached."""
+        entry = self.load_entry( mac )
+        if entry == None:
+            return None
+        try:
+            return DeskState.from_dict( entry )
+        except (KeyError, TypeError, ValueError) as e:
+            self.logger.warning( "invalid cache entry of %s: %s %s", mac, type(e), e )
+            return None
+
+    def store(self, mac, firmware, blocks):
+        cachedBlocks = { commandType: blocks[commandType] for commandType in self.BLOCKS if commandType in blocks }
+        state = DeskState( firmware, cachedBlocks )
+        self.store_entry( mac, state.to_dict() )
+        return state
+
+DeskStateCache.logger = _LOGGER.getChild(DeskStateCache.__name__)
@@ -0,0 +1,183 @@
+#
+# Keeping connection to desk alive.
+#
+
+import random
+import logging
+import threading
+
+from bluepy import btle
+
+import linak_dpg_bt.constants as constants
+from .threadcounter import getThreadName
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Backoff:
+    """Exponentially growing delays with random jitter.
+
+    Every delay is reduced by random fraction (up to 'jitter') of its value, so desks
+    dropped at the same moment do not reconnect in lockstep.
+    """
+
+    def __init__(self, initial, maximum, multiplier=2.0, jitter=0.5, seed=None):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._current = initial
+
+    def reset(self):
+        self._current = self.initial
+
+    def next(self):
+        """Returns next delay in seconds."""
+        delay = self._current
+        self._current = min( self._current * self.multiplier, self.maximum )
+        return delay * (1.0 - self.jitter * self._random.random())
+
+
+class ConnectionSupervisor:
+    """Reconnects desk after link loss.
+
+    Disconnection is reported by 'BTLEConnection' listener. Reconnection is attempted
+    with 'Backoff' delays in background thread; after success only notification
+    subscriptions and height are restored ('LinakDesk._restore_session()'), state read
+    by DPG handshake is kept. While supervised, connection does not connect implicitly,
+    operations fail with 'ConnectionError' until supervisor restores the link.
+
+    Listeners are called with supervisor and new state on every state change.
+    """
+
+    logger = None
+
+    ## connection states
+    CONNECTED       = "connected"
+    DISCONNECTED    = "disconnected"
+    RECONNECTING    = "reconnecting"
+    FAILED          = "failed"                  ## gave up after 'maxAttempts'
+    STOPPED         = "stopped"
+
+
+    def __init__(self, desk, backoff=None, maxAttempts=None):
+        """
+        :param desk: 'LinakDesk' object
+        :param backoff: 'Backoff' object, default delays are taken from 'constants'
+        :param maxAttempts: number of reconnection attempts after single link loss, unlimited if None
+        """
+        if backoff == None:
+            backoff = Backoff( constants.RECONNECT_INITIAL_DELAY, constants.RECONNECT_MAX_DELAY,
+                               constants.RECONNECT_MULTIPLIER, constants.RECONNECT_JITTER )
+        self.desk = desk
+        self.backoff = backoff
+        self.maxAttempts = maxAttempts
+        self.state = self.CONNECTED if desk.is_connected() else self.DISCONNECTED
+        self.attempts = 0                       ## attempts made after last link loss
+        self.reconnects = 0                     ## successful reconnections
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._lost = False
+        self._stopped = False
+        self._thread = None
+
+    def add_listener(self, callback):
+        self._listeners.append( callback )
+
+    def remove_listener(self, callback):
+        self._listeners.remove( callback )
+
+    def start(self):
+        conn = self.desk._conn
+        conn.autoConnect = False
+        conn.add_disconnected_listener( self._on_disconnected )
+        self._thread = threading.Thread( target=self.run, name=getThreadName("Supervisor") )
+        self._thread.daemon = True
+        self._thread.start()
+        if conn.isConnected() == False:
+            self._on_disconnected()
+        return self
+
+    def stop(self):
+        conn = self.desk._conn
+        conn.remove_disconnected_listener( self._on_disconnected )
+        conn.autoConnect = True
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread != None and threading.current_thread() != self._thread:
+            self._thread.join()
+        self._set_state( self.STOPPED )
+
+    def wait_for_state(self, state, timeout=None):
+        """Wait until supervisor gets given state. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for( lambda: self.state == state, timeout )
+
+    def _on_disconnected(self):
+        with self._cond:
+            if self._stopped:
+                return
+            self._lost = True
+            self._cond.notify_all()
+            if self.state == self.RECONNECTING:
+                ## failed attempt
+                return
+        self._set_state( self.DISCONNECTED )
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for( lambda: self._lost or self._stopped )
+                if self._stopped:
+                    return
+                self._lost = False
+            self._reconnect()
+
+    def _reconnect(self):
+        self.backoff.reset()
+        self.attempts = 0
+        self._set_state( self.RECONNECTING )
+        while True:
+            if self.maxAttempts != None and self.attempts >= self.maxAttempts:
+                self.logger.error("Giving up reconnecting %s after %s attempts", self.desk._bdaddr, self.attempts)
+                self._set_state( self.FAILED )
+                return
+            delay = self.backoff.next()
+            with self._cond:
+                if self._cond.wait_for( lambda: self._stopped, delay ):
+                    return
+                ## link loss reported during attempt is handled by this loop
+                self._lost = False
+            self.attempts += 1
+            try:
+                self.desk._restore_session()
+            except (btle.BTLEException, ConnectionError, OSError) as e:
+                self.logger.debug("Reconnect attempt %s failed: %s %s", self.attempts, type(e), e)
+                continue
+            except Exception as e:
+                ## e.g. malformed data of restored session -- keep trying, thread must not die
+                self.logger.exception("Reconnect attempt %s failed: %s %s", self.attempts, type(e), e)
+                continue
+            if self.desk.is_connected() == False:
+                continue
+            self.reconnects += 1
+            self.logger.info("Reconnected to %s after %s attempts", self.desk._bdaddr, self.attempts)
+            self._set_state( self.CONNECTED )
+            return
+
+    def _set_state(self, state):
+        with self._cond:
+            if self.state == state:
+                return
+            self.state = state
+            self._cond.notify_all()
+        for listener in list(self._listeners):
+            try:
+                listener( self, state )
+            except BaseException as e:
+                self.logger.error("Listener failed: %s %s", type(e), e)
+
+ConnectionSupervisor.logger = _LOGGER.getChild(ConnectionSupervisor.__name__)
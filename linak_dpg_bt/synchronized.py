@@ -17,10 +17,17 @@ Usage examples:
     def send_dpg_write_command(self, dpgCommandType, data):
         pass
 
+If object has '_lock_wait_observer' attribute then it is called with lock name and
+time spent on waiting whenever the lock was contended.
+
+Locks can be profiled (waiting and holding times, owners) after calling
+'enable_lock_profiling()', see 'LockProfiler.report()'.
+
 '''
 
 
 import threading
+from time import monotonic, perf_counter
 from functools import wraps
 
 
@@ -57,9 +64,261 @@ def checkMethod(func, method):
 
 
 
+##
+## Lock with priority
+##
+class PriorityRLock:
+    """Reentrant lock letting urgent acquirers in before normal ones.
+
+    'urgent' attribute is lock-like view of the same lock acquiring it with
+    priority -- it can be used by '@synchronized' as separate lock name.
+    Normal acquisition waits while any urgent acquirer is waiting.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition( threading.Lock() )
+        self._owner = None
+        self._depth = 0
+        self._urgentWaiting = 0
+        self._normalWaiting = 0
+        self.urgent = _UrgentLock(self)
+
+    def acquire(self, blocking=True, timeout=-1, urgent=False):
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            if urgent:
+                free = lambda: self._owner == None
+            else:
+                free = lambda: self._owner == None and self._urgentWaiting < 1
+            if free() == False:
+                if blocking == False:
+                    return False
+                if urgent:
+                    self._urgentWaiting += 1
+                else:
+                    self._normalWaiting += 1
+                try:
+                    if self._cond.wait_for( free, None if timeout < 0 else timeout ) == False:
+                        return False
+                finally:
+                    if urgent:
+                        self._urgentWaiting -= 1
+                        if self._urgentWaiting < 1:
+                            ## let normal waiters check again
+                            self._cond.notify_all()
+                    else:
+                        self._normalWaiting -= 1
+            self._owner = me
+            self._depth = 1
+            return True
+
+    def release(self):
+        with self._cond:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("cannot release un-acquired lock")
+            self._depth -= 1
+            if self._depth < 1:
+                self._owner = None
+                self._cond.notify_all()
+
+    def locked(self):
+        return self._owner != None
+
+    def waiting(self):
+        """Returns numbers of threads waiting for the lock: (normal, urgent)."""
+        with self._cond:
+            return (self._normalWaiting, self._urgentWaiting)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class _UrgentLock:
+    """View of 'PriorityRLock' acquiring it with priority."""
+
+    def __init__(self, lock):
+        self._lock = lock
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire( blocking, timeout, urgent=True )
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+
+##
+## Profiling of locks
+##
+class LockStats:
+    """Statistics of acquisitions of single lock by single decorated method."""
+
+    __slots__ = ('lockName', 'method', 'calls', 'contended', 'waitTotal', 'waitMax', 'holdTotal', 'holdMax')
+
+    def __init__(self, lockName, method):
+        self.lockName = lockName
+        self.method = method
+        self.calls = 0
+        self.contended = 0
+        self.waitTotal = 0.0
+        self.waitMax = 0.0
+        self.holdTotal = 0.0
+        self.holdMax = 0.0
+
+    def as_dict(self):
+        return { name: getattr(self, name) for name in self.__slots__ }
+
+
+class LockProfiler:
+    """Measures waiting and holding times of locks taken by '@synchronized'.
+
+    Enabled by 'enable_lock_profiling()'. Statistics are kept per (lock name, method),
+    owners are tracked per lock object (outermost acquisition of reentrant lock).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}                            ## (lock name, method) -> LockStats
+        self._owners = {}                           ## id(underlying lock) -> [lock name, object type, thread name, method, since, depth]
+
+    def call(self, obj, lock_name, lock, func, args, kws):
+        method = func.__qualname__
+        contended = False
+        startTime = perf_counter()
+        if lock.acquire(False) == False:
+            contended = True
+            lock.acquire()
+        acquiredTime = perf_counter()
+        waited = acquiredTime - startTime
+        if contended:
+            observer = getattr(obj, "_lock_wait_observer", None)
+            if observer != None:
+                observer( lock_name, waited )
+        ## urgent view and the lock itself are the same lock
+        lockId = id( lock._lock if isinstance(lock, _UrgentLock) else lock )
+        with self._lock:
+            owner = self._owners.get( lockId )
+            if owner == None:
+                owner = [ lock_name, type(obj).__name__, threading.current_thread().name, method, acquiredTime, 0 ]
+                self._owners[lockId] = owner
+            owner[5] += 1
+        try:
+            return func(obj, *args, **kws)
+        finally:
+            held = perf_counter() - acquiredTime
+            with self._lock:
+                owner[5] -= 1
+                if owner[5] < 1:
+                    self._owners.pop( lockId, None )
+                key = (lock_name, method)
+                stats = self._stats.get( key )
+                if stats == None:
+                    stats = LockStats( lock_name, method )
+                    self._stats[key] = stats
+                stats.calls += 1
+                if contended:
+                    stats.contended += 1
+                stats.waitTotal += waited
+                stats.waitMax = max( stats.waitMax, waited )
+                stats.holdTotal += held
+                stats.holdMax = max( stats.holdMax, held )
+            lock.release()
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self):
+        """Returns list of 'LockStats' copies, sorted by total waiting time (descending)."""
+        with self._lock:
+            ret = []
+            for item in self._stats.values():
+                stats = LockStats( item.lockName, item.method )
+                for name in LockStats.__slots__:
+                    setattr( stats, name, getattr(item, name) )
+                ret.append( stats )
+        ret.sort( key=lambda item: item.waitTotal, reverse=True )
+        return ret
+
+    def owners(self):
+        """Returns list of currently held locks: (lock name, object type, thread name, method, held for [s])."""
+        now = perf_counter()
+        with self._lock:
+            return [ (item[0], item[1], item[2], item[3], now - item[4]) for item in self._owners.values() ]
+
+    def report(self, output=None):
+        """Returns statistics as text table. If 'output' is given then text is written to it."""
+        lines = [ "%-16s %-48s %8s %8s %10s %10s %10s %10s" % ("lock", "method", "calls", "contended",
+                                                             "wait[ms]", "max[ms]", "hold[ms]", "max[ms]") ]
+        for item in self.stats():
+            lines.append( "%-16s %-48s %8d %8d %10.3f %10.3f %10.3f %10.3f" % (item.lockName, item.method, item.calls,
+                                                                             item.contended,
+                                                                             item.waitTotal * 1000, item.waitMax * 1000,
+                                                                             item.holdTotal * 1000, item.holdMax * 1000) )
+        owners = self.owners()
+        if len(owners) > 0:
+            lines.append( "held locks:" )
+            for lockName, typeName, threadName, method, heldFor in owners:
+                lines.append( "    %s of %s held by %s in %s for %.3fs" % (lockName, typeName, threadName, method, heldFor) )
+        text = "\n".join( lines )
+        if output != None:
+            output.write( text + "\n" )
+        return text
+
+
+## active profiler, None if disabled
+_profiler = None
+
+
+def enable_lock_profiling():
+    """Start profiling of '@synchronized' locks. Returns active 'LockProfiler'."""
+    global _profiler
+    if _profiler == None:
+        _profiler = LockProfiler()
+    return _profiler
+
+def disable_lock_profiling():
+    """Stop profiling. Returns profiler that was active (with gathered statistics) or None."""
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    return profiler
+
+def lock_profiler():
+    return _profiler
+
+
+
 ##
 ## Definition of function decorator
 ##
+
+## guards lazy creation of locks
+_creation_lock = threading.Lock()
+
+def create_lock(obj, lock_name):
+    """Returns lock of given name held by object, creating it if needed."""
+    with _creation_lock:
+        lock = getattr(obj, lock_name, None)
+        if lock == None:
+            lock = threading.RLock()
+            setattr(obj, lock_name, lock)
+        return lock
+
 def synchronized_with_arg(lock_name = None):
     if lock_name == None: 
         lock_name = "_methods_lock"
@@ -70,14 +329,23 @@ def synchronized_with_arg(lock_name = None):
 #             owner = extractSelf(func, decorator, *args)
 #             if owner == None:
 #                 return func(*args, **kws)
-            lock = None
-            if hasattr(self, lock_name) == False:
-                lock = threading.RLock()
-                setattr(self, lock_name, lock)
-            else:
-                lock = getattr(self, lock_name)
-            with lock:
+            lock = getattr(self, lock_name, None)
+            if lock == None:
+                lock = create_lock(self, lock_name)
+            profiler = _profiler
+            if profiler != None:
+                return profiler.call(self, lock_name, lock, func, args, kws)
+            if lock.acquire(False) == False:
+                ## contended -- measure waiting
+                startTime = monotonic()
+                lock.acquire()
+                observer = getattr(self, "_lock_wait_observer", None)
+                if observer != None:
+                    observer( lock_name, monotonic() - startTime )
+            try:
                 return func(self, *args, **kws)
+            finally:
+                lock.release()
         return decorator
 
     return synced_method
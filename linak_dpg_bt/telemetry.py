@@ -0,0 +1,100 @@
+#
+# History of height/speed notifications.
+#
+
+import threading
+from array import array
+
+
+class HeightSpeedHistory:
+    """Fixed-capacity ring buffer of (monotonic timestamp, raw height, raw speed) samples.
+
+    Samples are kept in typed arrays (12 bytes per sample), memory is allocated once
+    in constructor. Oldest samples are overwritten when buffer is full. Timestamps have
+    to be appended in non-decreasing order.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("invalid capacity: %s" % capacity)
+        self.capacity = capacity
+        self._times = array('d', bytes( 8 * capacity ))
+        self._heights = array('H', bytes( 2 * capacity ))
+        self._speeds = array('H', bytes( 2 * capacity ))
+        self._next = 0                      ## physical index of next sample
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, height, speed):
+        with self._lock:
+            index = self._next
+            self._times[index] = timestamp
+            self._heights[index] = height
+            self._speeds[index] = speed
+            self._next = (index + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def latest(self):
+        """Returns last sample as (timestamp, height, speed) or None if empty."""
+        with self._lock:
+            if self._count < 1:
+                return None
+            index = (self._next - 1) % self.capacity
+            return (self._times[index], self._heights[index], self._speeds[index])
+
+    def snapshot(self, since=None, until=None):
+        """Returns samples in time window [since, until] as tuple of arrays (timestamps, heights, speeds)."""
+        with self._lock:
+            first = 0
+            last = self._count
+            if since != None:
+                first = self._bisect( since, False )
+            if until != None:
+                last = self._bisect( until, True )
+            times = array('d')
+            heights = array('H')
+            speeds = array('H')
+            if first >= last:
+                return (times, heights, speeds)
+            start = (self._next - self._count + first) % self.capacity
+            end = start + (last - first)
+            if end <= self.capacity:
+                times.extend( self._times[start:end] )
+                heights.extend( self._heights[start:end] )
+                speeds.extend( self._speeds[start:end] )
+            else:
+                end -= self.capacity
+                for data, target in ((self._times, times), (self._heights, heights), (self._speeds, speeds)):
+                    target.extend( data[start:] )
+                    target.extend( data[:end] )
+            return (times, heights, speeds)
+
+    def samples(self, since=None, until=None):
+        """Returns samples in time window as list of (timestamp, height, speed) tuples."""
+        return list( zip( *self.snapshot( since, until ) ) )
+
+    def _bisect(self, timestamp, right):
+        ## binary search on logical indexes (0 is oldest sample)
+        offset = self._next - self._count
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            value = self._times[ (offset + middle) % self.capacity ]
+            if value < timestamp or (right and value == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __str__(self):
+        return "%s[samples: %s capacity: %s]" % (self.__class__.__name__, self._count, self.capacity)
@@ -0,0 +1,236 @@
+#
+# Append-only binary log of height/speed samples and DPG events.
+#
+# Data file: 16-byte header followed by 16-byte records '<dBBHi':
+#     timestamp (wall clock), kind, code, value, extra
+#         KIND_HEIGHT_SPEED:  code 0, value: raw height, extra: raw speed
+#         KIND_DPG:           code: DPG command type, value: payload length, extra: first 4 payload bytes
+# Index file ('<path>.idx'): '<dQ' entries (timestamp, record number) every 'INDEX_INTERVAL' records.
+#
+
+import os
+import mmap
+import struct
+import logging
+import threading
+from time import time, monotonic
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+RECORD = struct.Struct('<dBBHi')
+INDEX_ENTRY = struct.Struct('<dQ')
+HEADER = b"LINAKTL\x01" + bytes(8)
+
+KIND_HEIGHT_SPEED   = 1
+KIND_DPG            = 2
+
+
+class TelemetryLog:
+    """Writer of binary telemetry log.
+
+    Records are buffered in memory and written when buffer is full, after 'FLUSH_INTERVAL'
+    seconds or on 'flush()'. Timestamps never decrease (wall clock going back is clamped),
+    so records can be searched by time.
+    """
+
+    logger = None
+
+    INDEX_INTERVAL = 1024           ## records per index entry (16 KiB of data)
+    FLUSH_RECORDS = 256
+    FLUSH_INTERVAL = 5.0
+
+
+    def __init__(self, path):
+        self.path = path
+        self.indexPath = path + ".idx"
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._indexBuffer = bytearray()
+        self._buffered = 0
+        self._flushTime = None
+        dirPath = os.path.dirname( path )
+        if dirPath:
+            os.makedirs( dirPath, exist_ok=True )
+        self._file = open( path, "ab" )
+        self._indexFile = open( self.indexPath, "ab" )
+        size = self._file.tell()
+        if size > len(HEADER) and (size - len(HEADER)) % RECORD.size != 0:
+            ## partial record written before crash
+            size -= (size - len(HEADER)) % RECORD.size
+            self._file.truncate( size )
+        if size == 0:
+            self._file.write( HEADER )
+            size = len(HEADER)
+        self._count = (size - len(HEADER)) // RECORD.size
+        self._lastTime = 0.0
+        if self._count > 0:
+            with open( path, "rb" ) as dataFile:
+                dataFile.seek( len(HEADER) + (self._count - 1) * RECORD.size )
+                self._lastTime = RECORD.unpack( dataFile.read( RECORD.size ) )[0]
+
+    @classmethod
+    def for_desk(cls, directory, mac):
+        """Log of given desk in directory (one file per desk)."""
+        return cls( os.path.join( directory, mac.upper().replace(":", "") + ".tlog" ) )
+
+    def __len__(self):
+        return self._count
+
+    def append_height_speed(self, height, speed, timestamp=None):
+        self._append( timestamp, KIND_HEIGHT_SPEED, 0, height, speed )
+
+    def append_dpg(self, commandType, data, timestamp=None):
+        payload = bytes(data[2:6])
+        extra = int.from_bytes( payload, "little", signed=True ) if len(payload) == 4 else int.from_bytes( payload, "little" )
+        self._append( timestamp, KIND_DPG, commandType.value & 0xFF, len(data) - 2, extra )
+
+    def _append(self, timestamp, kind, code, value, extra):
+        if timestamp == None:
+            timestamp = time()
+        with self._lock:
+            if self._file == None:
+                return
+            timestamp = max( timestamp, self._lastTime )
+            self._lastTime = timestamp
+            if self._count % self.INDEX_INTERVAL == 0:
+                self._indexBuffer += INDEX_ENTRY.pack( timestamp, self._count )
+            self._buffer += RECORD.pack( timestamp, kind, code, value & 0xFFFF, extra )
+            self._count += 1
+            self._buffered += 1
+            now = monotonic()
+            if self._flushTime == None:
+                self._flushTime = now + self.FLUSH_INTERVAL
+            if self._buffered >= self.FLUSH_RECORDS or now >= self._flushTime:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._file == None or self._buffered < 1:
+            return
+        try:
+            ## data first -- index never points behind end of data
+            self._file.write( self._buffer )
+            self._file.flush()
+            self._indexFile.write( self._indexBuffer )
+            self._indexFile.flush()
+        except OSError as e:
+            self.logger.warning( "unable to write telemetry log %s: %s %s", self.path, type(e), e )
+        self._buffer = bytearray()
+        self._indexBuffer = bytearray()
+        self._buffered = 0
+        self._flushTime = None
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file != None:
+                self._file.close()
+                self._indexFile.close()
+                self._file = None
+                self._indexFile = None
+
+TelemetryLog.logger = _LOGGER.getChild(TelemetryLog.__name__)
+
+
+class TelemetryLogReader:
+    """Memory-mapped reader of 'TelemetryLog' file.
+
+    Time range is located by binary search over sparse index and then over records
+    of single index block, so only touched pages are read from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = self._map( path )
+        self._index = self._map( path + ".idx" )
+        if self._data != None and self._data[0:len(HEADER)] != HEADER:
+            self.close()
+            raise ValueError("not a telemetry log: %s" % path)
+        self._count = 0
+        if self._data != None:
+            self._count = (len(self._data) - len(HEADER)) // RECORD.size
+        self._indexCount = 0
+        if self._index != None:
+            self._indexCount = len(self._index) // INDEX_ENTRY.size
+
+    def _map(self, path):
+        try:
+            with open( path, "rb" ) as mapFile:
+                if os.fstat( mapFile.fileno() ).st_size == 0:
+                    return None
+                return mmap.mmap( mapFile.fileno(), 0, access=mmap.ACCESS_READ )
+        except FileNotFoundError:
+            return None
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for mapped in (self._data, self._index):
+            if mapped != None:
+                mapped.close()
+        self._data = None
+        self._index = None
+
+    def record(self, number):
+        """Returns record as tuple (timestamp, kind, code, value, extra)."""
+        return RECORD.unpack_from( self._data, len(HEADER) + number * RECORD.size )
+
+    def query(self, since=None, until=None, kind=None):
+        """Yields records with timestamp in range [since, until]."""
+        first = 0
+        if since != None:
+            first = self._find( since, False )
+        last = self._count
+        if until != None:
+            last = self._find( until, True )
+        for number in range(first, last):
+            item = self.record( number )
+            if kind == None or item[1] == kind:
+                yield item
+
+    def _timestamp(self, number):
+        return struct.unpack_from( '<d', self._data, len(HEADER) + number * RECORD.size )[0]
+
+    def _find(self, timestamp, right):
+        """Number of first record with time after 'timestamp' ('right') or not before it."""
+        def before(value):
+            return value < timestamp or (right and value == timestamp)
+
+        ## index block containing searched record
+        low = 0
+        high = self._count
+        indexLow = 0
+        indexHigh = self._indexCount
+        while indexLow < indexHigh:
+            middle = (indexLow + indexHigh) // 2
+            entryTime, entryRecord = INDEX_ENTRY.unpack_from( self._index, middle * INDEX_ENTRY.size )
+            if entryRecord >= self._count:
+                ## index ahead of data (writer crashed between writes)
+                indexHigh = middle
+            elif before( entryTime ):
+                low = entryRecord
+                indexLow = middle + 1
+            else:
+                high = entryRecord
+                indexHigh = middle
+
+        ## records of block
+        while low < high:
+            middle = (low + high) // 2
+            if before( self._timestamp( middle ) ):
+                low = middle + 1
+            else:
+                high = middle
+        return low
@@ -0,0 +1,46 @@
+#
+#
+#
+
+import threading
+from time import monotonic
+
+
+class VariableMonitor:
+    """Tracks versions of named variables and wakes up threads waiting for their changes.
+
+    Every call to 'updated(name)' increments version of the variable and notifies all waiters.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._versions = {}
+
+    def updated(self, name):
+        with self._cond:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._cond.notify_all()
+
+    def version(self, name):
+        with self._cond:
+            return self._versions.get(name, 0)
+
+    def wait_for(self, predicate, timeout=None):
+        """Wait until predicate returns True. Returns last predicate value."""
+        with self._cond:
+            return self._cond.wait_for( predicate, timeout )
+
+    def wait_for_update(self, name, version, timeout=None):
+        """Wait until version of variable is different than given one. Returns current version or None on timeout."""
+        deadline = None
+        if timeout is not None:
+            deadline = monotonic() + timeout
+        with self._cond:
+            while self._versions.get(name, 0) == version:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return None
+                self._cond.wait( remaining )
+            return self._versions.get(name, 0)
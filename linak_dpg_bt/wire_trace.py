@@ -0,0 +1,99 @@
+#
+# Cheap recording of raw BLE frames.
+#
+
+import threading
+from array import array
+from time import monotonic
+
+
+class HexDump:
+    """Bytes formatted as hex only when converted to string -- for logging arguments."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return " ".join("0x{:02X}".format(x) for x in self.data)
+
+    __repr__ = __str__
+
+
+class WireTrace:
+    """Ring buffer of raw frames sent to and received from desk.
+
+    Memory is preallocated: frame payloads are truncated to 'frameSize' bytes (ATT payload
+    with default MTU is 20 bytes). Recording does not format anything, frames are
+    converted to text only by 'dump()'.
+    """
+
+    ## directions of frames
+    WRITE   = 0
+    NOTIFY  = 1
+    READ    = 2
+
+    DIRECTION_NAMES = { WRITE: "W", NOTIFY: "N", READ: "R" }
+
+
+    def __init__(self, capacity=4096, frameSize=20):
+        self.capacity = capacity
+        self.frameSize = frameSize
+        self._times = array('d', bytes( 8 * capacity ))
+        self._handles = array('H', bytes( 2 * capacity ))
+        self._directions = array('B', bytes( capacity ))
+        self._lengths = array('H', bytes( 2 * capacity ))
+        self._payloads = bytearray( capacity * frameSize )
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, direction, handle, data):
+        with self._lock:
+            index = self._next
+            size = min( len(data), self.frameSize )
+            offset = index * self.frameSize
+            self._payloads[offset:offset + size] = data[0:size]
+            self._times[index] = monotonic()
+            self._handles[index] = handle
+            self._directions[index] = direction
+            self._lengths[index] = len(data)
+            self._next = (index + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def frames(self):
+        """Returns recorded frames, oldest first, as list of (timestamp, direction, handle, bytes, length)."""
+        with self._lock:
+            ret = []
+            first = (self._next - self._count) % self.capacity
+            for i in range(self._count):
+                index = (first + i) % self.capacity
+                length = self._lengths[index]
+                offset = index * self.frameSize
+                payload = bytes( self._payloads[offset:offset + min(length, self.frameSize)] )
+                ret.append( (self._times[index], self._directions[index], self._handles[index], payload, length) )
+            return ret
+
+    def dump(self, output=None):
+        """Returns frames as text (one line per frame). If 'output' is given then text is written to it."""
+        lines = []
+        for timestamp, direction, handle, payload, length in self.frames():
+            truncated = ""
+            if length > len(payload):
+                truncated = " ... (%s bytes)" % length
+            lines.append( "%.6f %s 0x%04X %s%s" % (timestamp, self.DIRECTION_NAMES.get(direction, "?"),
+                                                  handle, HexDump(payload), truncated) )
+        text = "\n".join( lines )
+        if output != None:
+            output.write( text + "\n" )
+        return text
@@ -58,6 +58,8 @@ if __name__ == '__main__':
     parser.add_argument('-cov', '--coverage', action="store_true", help='Measure code coverage' )
     parser.add_argument('--profile', action="store_true", help='Profile the code' )
     parser.add_argument('--pfile', action='store', default=None, help='Profile the code and output data to file' )
+    parser.add_argument('-b', '--benchmark', action="store_true", help='Run latency benchmarks instead of tests' )
+    parser.add_argument('--boutput', action='store', default=None, help='Store benchmark JSON results to file' )
     
     args = parser.parse_args()
     
@@ -91,7 +93,13 @@ if __name__ == '__main__':
             profiler.enable()
             
         ## run proper tests
-        if args.untilfailure == True:
+        if args.benchmark == True:
+            from linak_dpg_bt import benchmark
+            benchArgs = []
+            if args.boutput != None:
+                benchArgs += ["--output", args.boutput]
+            benchmark.main( benchArgs )
+        elif args.untilfailure == True:
             counter = 1
             while True:
                 print( "Tests iteration:", counter )
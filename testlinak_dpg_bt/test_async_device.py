@@ -0,0 +1,108 @@
+#
+#
+#
+
+
+import unittest
+import asyncio
+import threading
+
+from linak_dpg_bt.async_device import AsyncLinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.command import DPGCommandType
+from linak_dpg_bt.desk_mover import MotionController
+import linak_dpg_bt.constants as constants
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class AsyncLinakDeskTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.sim = SimulatedDesk(speed=5000, notifyInterval=0.01, latency=0.002)
+        self.desk = AsyncLinakDesk(MAC, self.sim.createPeripheral)
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        pass
+
+    def run_async(self, coroutine):
+        async def wrapper():
+            await self.desk.connect()
+            try:
+                return await coroutine()
+            finally:
+                await self.desk.disconnect()
+        return asyncio.run( wrapper() )
+
+    def test_connect(self):
+        async def check():
+            return (self.desk.name, self.desk.desk_offset.cm, self.desk.favorite_position(2).raw)
+        self.assertEqual( ("Desk 8335", 62, 4000), self.run_async(check) )
+
+    def test_read_dpg(self):
+        async def check():
+            return await self.desk.read_dpg( DPGCommandType.GET_CAPABILITIES )
+        caps = self.run_async(check)
+        self.assertEqual( 2, caps.memSize )
+
+    def test_move_to_cm(self):
+        threadsBefore = threading.active_count()
+        async def check():
+            threadCount = threading.active_count()
+            reached = await self.desk.move_to_cm( 80 )
+            return (reached, threadCount)
+        reached, threadCount = self.run_async(check)
+        self.assertTrue( reached )
+        ## target is reached within tolerance of 'MotionController'
+        self.assertLessEqual( abs( 1800 - self.sim.height ), constants.MOVE_TOLERANCE )
+        ## no notification thread is started
+        self.assertLessEqual( threadCount, threadsBefore + 2 )
+
+    def test_height_stream(self):
+        async def check():
+            samples = []
+            async def collect():
+                async for hs in self.desk.height_speed_updates():
+                    samples.append( hs )
+                    if hs.speed.raw == 0:
+                        break
+            task = asyncio.ensure_future( collect() )
+            await asyncio.sleep(0)
+            await self.desk.move_to_raw( 1000 )
+            await asyncio.wait_for( task, 5.0 )
+            return samples
+        samples = self.run_async(check)
+        self.assertGreater( len(samples), 1 )
+        self.assertEqual( 1000, samples[-1].height.raw )
+
+    def test_subscriptions(self):
+        async def check():
+            peripheral = self.desk.connection.connection._conn
+            return [ charEnum for charEnum, _ in self.desk.desk._notification_subscriptions()
+                     if peripheral.isSubscribed( charEnum.handle() ) == False ]
+        ## same subscriptions as synchronous desk
+        self.assertEqual( [], self.run_async(check) )
+
+    def test_lazy(self):
+        async def check():
+            result = await self.desk.connect( lazy=True )
+            try:
+                self.assertIn( "capabilities", result.deferred )
+                self.assertEqual( None, self.desk.capabilities )
+                caps = await self.desk.fetch( '_capabilities' )
+                return caps.memSize
+            finally:
+                await self.desk.disconnect()
+        self.assertEqual( 2, asyncio.run( check() ) )
+
+    def test_move_cancel(self):
+        async def check():
+            task = asyncio.ensure_future( self.desk.move_to_raw( 6000 ) )
+            await asyncio.sleep( 0.05 )
+            task.cancel()
+            with self.assertRaises( asyncio.CancelledError ):
+                await task
+            return self.desk.desk._motion.state
+        self.assertEqual( MotionController.CANCELLED, self.run_async(check) )
@@ -0,0 +1,73 @@
+#
+#
+#
+
+
+import os
+import unittest
+import tempfile
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.capture import ReplayDesk, read_capture, feed_notifications
+from linak_dpg_bt.desk_mover import MotionController
+from linak_dpg_bt.wire_trace import WireTrace
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join( self.tmpDir.name, "desk.cap" )
+
+        ## record session with simulated desk
+        sim = SimulatedDesk(latency=0.002, speed=10000, notifyInterval=0.02)
+        desk = LinakDesk(MAC, sim.createPeripheral)
+        desk.start_capture( self.path )
+        try:
+            self.assertTrue( desk.initialize() )
+            self.assertEqual( MotionController.ARRIVED, desk.move_to_raw( 2000 ).state )
+        finally:
+            desk.stop_capture()
+            desk.disconnect()
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.tmpDir.cleanup()
+
+    def test_read(self):
+        records = read_capture( self.path )
+        directions = set( record.direction for record in records )
+        self.assertEqual( set([WireTrace.WRITE, WireTrace.NOTIFY, WireTrace.READ]), directions )
+        timestamps = [ record.timestamp for record in records ]
+        self.assertEqual( sorted(timestamps), timestamps )
+
+    def test_replay(self):
+        replay = ReplayDesk.from_file( self.path )
+        desk = LinakDesk(MAC, replay.createPeripheral)
+        try:
+            self.assertTrue( desk.initialize() )
+            self.assertEqual( 4000, desk.favorite_position_2.raw )
+            motion = desk.move_to_raw( 2000 )
+            self.assertEqual( MotionController.ARRIVED, motion.state )
+            self.assertEqual( 0, replay.mismatches )
+            ## desk did not really move -- heights come from capture
+            self.assertEqual( 0, replay.height )
+        finally:
+            desk.disconnect()
+
+    def test_feed_notifications(self):
+        records = read_capture( self.path )
+        desk = LinakDesk(MAC, SimulatedDesk().createPeripheral)
+        for characteristic, callback in desk._notification_subscriptions():
+            desk._conn.set_callback( characteristic.handle(), callback )
+        count = feed_notifications( desk._conn, records )
+        self.assertEqual( len([ item for item in records if item.direction == WireTrace.NOTIFY ]), count )
+        self.assertEqual( 2000, desk.current_height.raw )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#
+#
+#
+
+
+import unittest
+import threading
+from time import monotonic, sleep
+
+from bluepy import btle
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.command import DPGCommandType, DPGCommandTimeoutError
+from linak_dpg_bt.datatype.capabilities import Capabilities
+import linak_dpg_bt.constants as constants
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class DPGCommandTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.responseTimeout = constants.DPG_RESPONSE_TIMEOUT
+        constants.DPG_RESPONSE_TIMEOUT = 0.1
+        self.sim = SimulatedDesk(latency=0.005)
+        self.desk = LinakDesk(MAC, self.sim.createPeripheral)
+        self.desk.initialize()
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.desk.disconnect()
+        constants.DPG_RESPONSE_TIMEOUT = self.responseTimeout
+
+    def test_read_result(self):
+        caps = self.desk._conn.send_dpg_read_command( DPGCommandType.GET_CAPABILITIES )
+        self.assertIsInstance( caps, Capabilities )
+        self.assertEqual( 2, caps.memSize )
+
+    def test_write_confirmation(self):
+        ret = self.desk._conn.send_dpg_write_command( DPGCommandType.USER_ID, LinakDesk.CLIENT_ID )
+        self.assertEqual( True, ret )
+
+    def test_pump_does_not_block(self):
+        ## notification handler thread is running -- command has to wait only for radio round trip
+        for _ in range(5):
+            startTime = monotonic()
+            self.desk.stopMoving()
+            self.assertLess( monotonic() - startTime, 0.2 )
+
+    def test_move_does_not_wait_for_notification(self):
+        self.sim.dropRate = 1.0
+        startTime = monotonic()
+        self.assertTrue( self.desk.moveTo( 2000 ) )
+        self.assertLess( monotonic() - startTime, 0.2 )
+        startTime = monotonic()
+        self.desk.stopMoving()
+        self.assertLess( monotonic() - startTime, 0.2 )
+        self.assertFalse( self.sim.isMoving() )
+
+    def test_response_timeout(self):
+        self.sim.dropRate = 1.0
+        startTime = monotonic()
+        self.assertRaises( DPGCommandTimeoutError, self.desk._conn.send_dpg_read_command, DPGCommandType.GET_CAPABILITIES )
+        duration = monotonic() - startTime
+        self.assertLess( duration, constants.DPG_COMMAND_ATTEMPTS * 0.1 + 1.0 )
+        self.assertEqual( None, self.desk._conn.currentCommand )
+
+    def test_state_does_not_wait_for_io(self):
+        conn = self.desk._conn
+        self.sim.dropRate = 1.0
+        sender, errors = self._start_sender( conn )
+        startTime = monotonic()
+        self.assertTrue( conn.isConnected() )
+        conn.set_callback( 0x7F, lambda handle, data: None )
+        self.assertLess( monotonic() - startTime, 0.05 )
+        sender.join()
+        self.assertEqual( [DPGCommandTimeoutError], [ type(error) for error in errors ] )
+
+    def test_disconnect_does_not_wait_for_io(self):
+        constants.DPG_RESPONSE_TIMEOUT = 1.0
+        conn = self.desk._conn
+        self.sim.dropRate = 1.0
+        sender, errors = self._start_sender( conn )
+        startTime = monotonic()
+        conn.disconnect()
+        self.assertLess( monotonic() - startTime, 0.05 )
+        self.assertFalse( conn.isConnected() )
+        sender.join()
+        ## pending command fails, link is closed after it
+        self.assertEqual( 1, len(errors) )
+        self.assertIsInstance( errors[0], btle.BTLEException )
+        deadline = monotonic() + 2.0
+        while len(self.sim._peripherals) > 0 and monotonic() < deadline:
+            sleep( 0.01 )
+        self.assertEqual( [], self.sim._peripherals )
+
+    def _start_sender(self, conn):
+        """Send DPG command in other thread, returns the thread and list receiving its error."""
+        errors = []
+        def send():
+            try:
+                conn.send_dpg_read_command( DPGCommandType.GET_CAPABILITIES )
+            except BaseException as e:
+                errors.append( e )
+        sender = threading.Thread( target=send, daemon=True )
+        sender.start()
+        deadline = monotonic() + 2.0
+        while conn.currentCommand == None and monotonic() < deadline:
+            sleep( 0.001 )
+        self.assertNotEqual( None, conn.currentCommand )
+        return sender, errors
@@ -0,0 +1,88 @@
+#
+#
+#
+
+
+import os
+import json
+import socket
+import unittest
+import tempfile
+import threading
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.fleet import DeskFleet
+from linak_dpg_bt.daemon import DeskDaemon, DaemonClient
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class DeskDaemonTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.socketPath = os.path.join( self.tmpDir.name, "daemon.sock" )
+        self.sim = SimulatedDesk(latency=0.001)
+        self.fleet = DeskFleet()
+        self.fleet.add( MAC, LinakDesk(MAC, self.sim.createPeripheral) )
+        for result in self.fleet.connect_all():
+            self.assertTrue( result.ok )
+        self.daemon = DeskDaemon( self.fleet, self.socketPath )
+        self.daemon.start()
+        self.thread = threading.Thread( target=self.daemon.serve_forever, daemon=True )
+        self.thread.start()
+        self.client = DaemonClient( self.socketPath )
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.daemon.shutdown()
+        self.thread.join()
+        self.fleet.close()
+        self.tmpDir.cleanup()
+
+    def test_available(self):
+        self.assertTrue( self.client.available() )
+        self.assertFalse( DaemonClient( os.path.join( self.tmpDir.name, "none.sock" ) ).available() )
+
+    def test_request(self):
+        results = self.client.request( "name", [MAC] )
+        self.assertEqual( 1, len(results) )
+        self.assertTrue( results[0].ok )
+        self.assertEqual( MAC, results[0].mac )
+        self.assertEqual( self.fleet.desk(MAC).name, results[0].value )
+
+        results = self.client.request( "get_height", [MAC.lower()] )
+        self.assertEqual( self.fleet.desk(MAC).current_height_with_offset.human_cm, results[0].value )
+
+    def test_unknown_command(self):
+        self.assertRaises( RuntimeError, self.client.request, "unknown", [MAC] )
+
+    def test_malformed_request(self):
+        requests = [ '[1, 2]', '{"command": "name", "macs": 5}', '{"command": "name", "macs": "%s"}' % MAC,
+                     '{"command": "name", "args": [1]}', 'not json' ]
+        for request in requests:
+            response = self._send_raw( request )
+            ## error reported, not closed connection
+            self.assertTrue( "error" in response, (request, response) )
+        self.assertEqual( [MAC], self.fleet.macs() )
+
+    def _send_raw(self, line):
+        sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        try:
+            sock.connect( self.socketPath )
+            sock.sendall( (line + "\n").encode("utf-8") )
+            with sock.makefile("rb") as sockFile:
+                return json.loads( sockFile.readline().decode("utf-8") )
+        finally:
+            sock.close()
+
+    def test_socket_removed(self):
+        self.daemon.shutdown()
+        self.thread.join()
+        self.assertFalse( os.path.exists( self.socketPath ) )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+#
+#
+#
+
+
+import struct
+import unittest
+
+import linak_dpg_bt.datatype as datatype
+
+
+class DatatypeTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        pass
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        pass
+
+    def test_height_speed(self):
+        payload = struct.pack('<Hh', 3000, -380)
+        for data in (payload, bytearray(payload), memoryview(payload)):
+            hs = datatype.HeightSpeed.from_bytes( data )
+            self.assertEqual( 3000, hs.height.raw )
+            self.assertEqual( 0xFFF & (-380), hs.speed.raw )
+        self.assertRaises( AttributeError, setattr, hs, "extra", 1 )
+
+    def test_favorite_position(self):
+        data = bytes([0x01, 0x07, 0x01]) + struct.pack('<H', 800) + struct.pack('<I', 5)
+        fav = datatype.FavoritePosition( data )
+        self.assertEqual( 800, fav.raw )
+        self.assertEqual( 5, fav.counter() )
+        fav = datatype.FavoritePosition( bytes([0x01, 0x05, 0x00]) + struct.pack('<I', 9) )
+        self.assertEqual( None, fav.position )
+        self.assertEqual( 9, fav.counter() )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+#
+#
+#
+
+
+import unittest
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.desk_mover import MotionController
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class MotionControllerTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.sim = SimulatedDesk(latency=0.001, speed=4000, notifyInterval=0.02, keepAliveTimeout=0.4)
+        self.desk = LinakDesk(MAC, self.sim.createPeripheral)
+        self.assertTrue( self.desk.initialize() )
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.desk.disconnect()
+
+    def test_arrive(self):
+        progress = []
+        motion = MotionController(self.desk, 3000, keepAliveInterval=0.2,
+                                  progressCallback=lambda item: progress.append( item.progress ))
+        motion.start()
+        self.assertTrue( motion.wait( 5.0 ) )
+        self.assertEqual( MotionController.ARRIVED, motion.state )
+        self.assertLessEqual( abs(self.sim.height - 3000), motion.tolerance )
+        self.assertEqual( 1.0, motion.progress )
+        self.assertGreater( len(progress), 1 )
+        self.assertEqual( sorted(progress), progress )
+        ## move takes ~0.75s -- command repeated only on keep-alive
+        self.assertLessEqual( motion.writes, 6 )
+
+    def test_no_move_needed(self):
+        motion = self.desk.move_to_raw( 5 )
+        self.assertEqual( MotionController.ARRIVED, motion.state )
+        self.assertEqual( 0, motion.writes )
+
+    def test_cancel(self):
+        motion = self.desk.move_to_raw( 6000, wait=False )
+        self.assertFalse( motion.finished )
+        self.desk.stopMoving()
+        self.assertEqual( MotionController.CANCELLED, motion.state )
+        self.assertTrue( motion.finished )
+
+    def test_timeout(self):
+        motion = MotionController(self.desk, 6000, timeout=0.1).start()
+        self.assertFalse( motion.wait( 5.0 ) )
+        self.assertEqual( MotionController.TIMEOUT, motion.state )
+
+
+if __name__ == "__main__":
+    unittest.main()
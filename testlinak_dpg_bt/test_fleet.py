@@ -0,0 +1,74 @@
+#
+#
+#
+
+
+import unittest
+from time import monotonic, sleep
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.fleet import DeskFleet
+
+
+MACS = [ "AA:BB:CC:DD:EE:0%d" % i for i in range(4) ]
+
+
+class DeskFleetTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.sims = {}
+        self.fleet = DeskFleet(maxConcurrency=2)
+        for i, mac in enumerate(MACS):
+            sim = SimulatedDesk(height=100 * i, latency=0.005, keepAliveTimeout=10.0)
+            self.sims[mac] = sim
+            self.fleet.add( mac, LinakDesk(mac, sim.createPeripheral) )
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.fleet.close()
+
+    def test_connect_and_read(self):
+        results = list( self.fleet.connect_all() )
+        self.assertEqual( len(MACS), len(results) )
+        self.assertTrue( all(result.ok for result in results) )
+
+        heights = self.fleet.run_all( lambda desk: desk.current_height.raw )
+        for i, mac in enumerate(MACS):
+            self.assertEqual( 100 * i, heights[mac].value )
+
+    def test_failure_is_reported(self):
+        results = self.fleet.run_all( lambda desk: desk.move_to_fav(7) )
+        self.assertEqual( len(MACS), len(results) )
+        self.assertFalse( any(result.ok for result in results.values()) )
+
+    def test_push_reminder_settings(self):
+        self.assertTrue( all( result.ok for result in self.fleet.connect_all() ) )
+        setting = self.fleet.desk( MACS[0] ).reminder_settings()
+        setting.setCmUnit( False )
+        results = list( self.fleet.push_reminder_settings( setting ) )
+        self.assertTrue( all( result.ok for result in results ), results )
+        self.assertTrue( all( result.value.inchEnabled for result in results ) )
+
+    def test_mac_case(self):
+        mac = MACS[0].lower()
+        self.assertTrue( mac in self.fleet )
+        self.assertIs( self.fleet.desk( MACS[0] ), self.fleet.desk( mac ) )
+        self.fleet.add( mac )
+        self.assertEqual( len(MACS), len(self.fleet) )
+        results = list( self.fleet.run( lambda desk: desk._bdaddr, [mac] ) )
+        self.assertEqual( MACS[0], results[0].mac )
+
+    def test_stop_without_iteration(self):
+        self.fleet.run_all( lambda desk: desk.moveUp() )
+        self.assertTrue( all( sim.isMoving() for sim in self.sims.values() ) )
+        ## result is not iterated -- STOP has to be sent anyway
+        self.fleet.stop_all()
+        deadline = monotonic() + 5.0
+        while any( sim.isMoving() for sim in self.sims.values() ) and monotonic() < deadline:
+            sleep( 0.01 )
+        self.assertFalse( any( sim.isMoving() for sim in self.sims.values() ) )
+
+
+if __name__ == "__main__":
+    unittest.main()
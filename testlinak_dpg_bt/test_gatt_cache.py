@@ -0,0 +1,79 @@
+#
+#
+#
+
+
+import os
+import unittest
+import tempfile
+from time import sleep
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.gatt_cache import GattCache
+import linak_dpg_bt.linak_service as linak_service
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class GattCacheTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cachePath = os.path.join( self.tmpDir.name, "gatt.json" )
+        self.sim = SimulatedDesk(latency=0.001)
+        self.discoveries = 0
+        self.desks = []
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        for desk in self.desks:
+            desk.disconnect()
+        self.tmpDir.cleanup()
+
+    def createPeripheral(self, *args, **kwargs):
+        peripheral = self.sim.createPeripheral()
+        getServices = peripheral.getServices
+        def countedGetServices():
+            self.discoveries += 1
+            return getServices()
+        peripheral.getServices = countedGetServices
+        return peripheral
+
+    def connect(self):
+        ## new cache object -- data is read from file
+        desk = LinakDesk(MAC, self.createPeripheral, GattCache(self.cachePath))
+        self.desks.append( desk )
+        self.assertTrue( desk.initialize() )
+        return desk
+
+    def test_reconnect_skips_discovery(self):
+        self.connect()
+        self.assertEqual( 1, self.discoveries )
+        table = GattCache(self.cachePath).load( MAC )
+        self.assertEqual( "1.5.1.0", table.firmware )
+        self.assertTrue( table.isReadable( linak_service.Characteristic.HEIGHT_SPEED.handle() ) )
+
+        self.connect()
+        self.assertEqual( 1, self.discoveries )
+
+    def test_firmware_change(self):
+        self.connect()
+        self.sim.productInfo = bytes([0x02, 0x00])
+        self.connect()
+        self.assertEqual( 2, self.discoveries )
+        self.assertEqual( "2.0", GattCache(self.cachePath).load( MAC ).firmware )
+
+    def test_service_changed(self):
+        self.connect()
+        self.sim.notify( linak_service.Characteristic.SERVICE_CHANGED.handle(), bytes([0x01, 0x00, 0xFF, 0xFF]) )
+        for _ in range(100):
+            if GattCache(self.cachePath).load( MAC ) == None:
+                break
+            sleep(0.01)
+        self.assertEqual( None, GattCache(self.cachePath).load( MAC ) )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#
+#
+#
+
+
+import os
+import sys
+import stat
+import unittest
+import tempfile
+
+from bluepy import btle
+
+from linak_dpg_bt.helper_pool import HelperPool, PooledPeripheral
+from linak_dpg_bt.metrics import MetricsRegistry
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+UNREACHABLE_MAC = "00:00:00:00:00:00"
+
+
+## minimal bluepy-helper speaking its line protocol (connect, disconnect, quit)
+FAKE_HELPER = """#!%s
+import sys
+for line in sys.stdin:
+    args = line.split()
+    if len(args) < 1:
+        continue
+    if args[0] == "quit":
+        break
+    if args[0] == "conn":
+        state = "disc" if args[1] == "%s" else "conn"
+        sys.stdout.write( "rsp=$stat\\x1estate=$%%s\\n" %% state )
+    elif args[0] == "disc":
+        sys.stdout.write( "rsp=$stat\\x1estate=$disc\\n" )
+    sys.stdout.flush()
+""" % (sys.executable, UNREACHABLE_MAC)
+
+
+class HelperPoolTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.tmpDir = tempfile.TemporaryDirectory()
+        helperPath = os.path.join( self.tmpDir.name, "bluepy-helper" )
+        with open( helperPath, "w" ) as helperFile:
+            helperFile.write( FAKE_HELPER )
+        os.chmod( helperPath, stat.S_IRWXU )
+        self.pool = HelperPool( maxIdle=1, helperPath=helperPath, registry=MetricsRegistry() )
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.pool.close()
+        self.tmpDir.cleanup()
+
+    def test_reuse(self):
+        for _ in range(3):
+            peripheral = PooledPeripheral( pool=self.pool )
+            peripheral.connect( MAC, btle.ADDR_TYPE_RANDOM )
+            peripheral.disconnect()
+        self.assertEqual( { "spawned": 1, "reused": 2, "stopped": 0, "idle": 1 }, self.pool.stats() )
+
+    def test_failed_attempt(self):
+        peripheral = PooledPeripheral( pool=self.pool )
+        self.assertRaises( btle.BTLEDisconnectError, peripheral.connect, UNREACHABLE_MAC, btle.ADDR_TYPE_RANDOM )
+        ## retry gets helper of failed attempt
+        peripheral = PooledPeripheral( pool=self.pool )
+        peripheral.connect( MAC, btle.ADDR_TYPE_RANDOM )
+        self.assertEqual( 1, self.pool.spawned )
+        self.assertEqual( 1, self.pool.reused )
+        peripheral.disconnect()
+
+    def test_limits(self):
+        peripherals = [ PooledPeripheral( pool=self.pool ) for _ in range(2) ]
+        for peripheral in peripherals:
+            peripheral.connect( MAC, btle.ADDR_TYPE_RANDOM )
+        for peripheral in peripherals:
+            peripheral.disconnect()
+        ## only 'maxIdle' helpers are kept
+        self.assertEqual( { "spawned": 2, "reused": 0, "stopped": 1, "idle": 1 }, self.pool.stats() )
+        ## dead helper is not reused
+        self.pool._idle[None][0].process.kill()
+        self.pool._idle[None][0].process.wait()
+        peripheral = PooledPeripheral( pool=self.pool )
+        peripheral.connect( MAC, btle.ADDR_TYPE_RANDOM )
+        self.assertEqual( 3, self.pool.spawned )
+        peripheral.disconnect()
+        self.pool.close()
+        self.assertEqual( 0, self.pool.stats()["idle"] )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#
+#
+#
+
+
+import unittest
+from time import monotonic
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.init_pipeline import InitPipeline
+from linak_dpg_bt.command import DPGCommandTimeoutError
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class ExpiringPipeline(InitPipeline):
+    """Time budget ends after reading height."""
+
+    def _step_height(self, conn):
+        InitPipeline._step_height(self, conn)
+        self.deadline = monotonic()
+
+
+class InitPipelineTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.sim = SimulatedDesk(latency=0.002)
+        self.desk = LinakDesk(MAC, self.sim.createPeripheral)
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.desk.disconnect()
+
+    def test_order(self):
+        pipeline = InitPipeline(self.desk, required=["favorites", "height"])
+        self.assertEqual( ["capabilities", "favorites", "height", "desk_offset"], pipeline.order()[0:4] )
+        self.assertRaises( ValueError, InitPipeline, self.desk, required=["unknown"] )
+
+    def test_complete(self):
+        result = self.desk.connect()
+        self.assertTrue( result.complete )
+        self.assertEqual( 4000, self.desk.favorite_position(2, timeout=0).raw )
+
+    def test_partial(self):
+        result = ExpiringPipeline(self.desk, required=["capabilities", "height"]).run()
+        self.assertTrue( result.ready )
+        self.assertFalse( result.complete )
+        self.assertEqual( ["capabilities", "height"], result.completed )
+        self.assertIn( "favorites", result.pending )
+        self.assertEqual( 0, self.desk.current_height.raw )
+
+    def test_lazy(self):
+        result = self.desk.connect( lazy=True )
+        self.assertTrue( result.ready )
+        self.assertIn( "capabilities", result.deferred )
+        self.assertEqual( None, self.desk._capabilities )
+        self.assertEqual( None, self.desk._firmware )
+
+        self.assertEqual( 0, self.desk.current_height.raw )
+        self.assertEqual( 4000, self.desk.favorite_position(2).raw )
+        self.assertEqual( "1.5.1.0", self.desk.firmware )
+        ## not touched
+        self.assertEqual( None, self.desk._fav_position_1 )
+        self.assertEqual( None, self.desk._reminder )
+
+    def test_mandatory_failure(self):
+        self.sim.dropRate = 1.0
+        result = self.desk.connect( timeout=0.2 )
+        self.assertFalse( result.ready )
+        self.assertIsInstance( result.error, DPGCommandTimeoutError )
+        self.assertLess( result.duration, 1.0 )
+
+    def test_unreachable(self):
+        self.sim.reachable = False
+        result = self.desk.connect()
+        self.assertFalse( result.ready )
+        self.assertIsInstance( result.error, ConnectionRefusedError )
+        ## old interface raises
+        self.assertRaises( ConnectionRefusedError, self.desk._connect )
+        self.assertRaises( ConnectionRefusedError, self.desk.read_dpg_data )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -50,6 +50,10 @@ class CharacteristicTest(unittest.TestCase):
         self.assertEqual( Characteristic.DPG.uuid(), value.uuid() )
         self.assertEqual( Characteristic.DPG.handle(), value.handle() )
         
+    def test_find_unknown(self):
+        self.assertEqual( None, Characteristic.find( 0xFFFF ) )
+        self.assertEqual( None, Characteristic.find( "00000000-0000-1000-8000-00805F9B34FB" ) )
+
     def test_find_handle(self):
         value = Characteristic.find( Characteristic.DPG.handle() )
         self.assertEqual( Characteristic.DPG.uuid(), value.uuid() )
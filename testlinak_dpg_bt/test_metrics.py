@@ -0,0 +1,109 @@
+#
+#
+#
+
+
+import unittest
+import threading
+import urllib.request
+
+from linak_dpg_bt.metrics import MetricsRegistry, Histogram, DeskMetrics, MetricsServer
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.command import DPGCommandType
+from linak_dpg_bt.synchronized import synchronized
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class LockedMock():
+
+    def __init__(self):
+        self.waits = []
+
+    def _lock_wait_observer(self, lockName, waited):
+        self.waits.append( (lockName, waited) )
+
+    @synchronized
+    def hold(self, started, release):
+        started.set()
+        release.wait()
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.registry = MetricsRegistry()
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        pass
+
+    def test_histogram(self):
+        histogram = Histogram()
+        self.assertEqual( None, histogram.percentile( 0.5 ) )
+        for i in range(1, 1001):
+            histogram.observe( i / 1000.0 )
+        self.assertEqual( 1000, histogram.count )
+        median = histogram.percentile( 0.5 )
+        self.assertTrue( 0.5 <= median <= 0.5 * (1 + 1.0 / Histogram.SUB_BUCKETS), median )
+        self.assertEqual( 1.0, histogram.percentile( 1.0 ) )
+        ## huge values go to last bucket
+        histogram.observe( 10 ** 9 )
+        self.assertEqual( 10 ** 9, histogram.max )
+
+    def test_prometheus_text(self):
+        self.registry.counter( "test_total", "Test counter", mac=MAC ).inc( 3 )
+        self.registry.histogram( "test_seconds", mac=MAC ).observe( 0.25 )
+        text = self.registry.prometheus_text()
+        self.assertIn( "# TYPE test_total counter", text )
+        self.assertIn( 'test_total{mac="%s"} 3' % MAC, text )
+        self.assertIn( 'test_seconds_count{mac="%s"} 1' % MAC, text )
+        self.assertRaises( ValueError, self.registry.histogram, "test_total" )
+
+    def test_server(self):
+        self.registry.counter( "test_total" ).inc()
+        server = MetricsServer( self.registry, port=0 ).start()
+        try:
+            url = "http://%s:%s/metrics" % server.address[0:2]
+            with urllib.request.urlopen( url, timeout=5 ) as response:
+                self.assertIn( "test_total 1", response.read().decode() )
+        finally:
+            server.stop()
+
+    def test_lock_wait(self):
+        obj = LockedMock()
+        started = threading.Event()
+        release = threading.Event()
+        holder = threading.Thread( target=obj.hold, args=(started, release) )
+        holder.start()
+        started.wait()
+        threading.Timer( 0.05, release.set ).start()
+        obj.hold( threading.Event(), release )
+        holder.join()
+        self.assertEqual( 1, len(obj.waits) )
+        self.assertEqual( "_methods_lock", obj.waits[0][0] )
+        self.assertGreater( obj.waits[0][1], 0.01 )
+
+    def test_desk(self):
+        sim = SimulatedDesk(latency=0.001, speed=10000, notifyInterval=0.02)
+        desk = LinakDesk(MAC, sim.createPeripheral)
+        desk._conn.metrics = DeskMetrics( MAC, self.registry )
+        try:
+            self.assertTrue( desk.initialize() )
+            desk.move_to_raw( 2000 )
+        finally:
+            desk.disconnect()
+        metrics = desk.metrics
+        self.assertEqual( 1, metrics.connects.value )
+        ## user id is read and written during initialization
+        self.assertEqual( 2, metrics.command_latency( DPGCommandType.USER_ID ).count )
+        snapshot = metrics.snapshot()
+        notifications = { item["labels"]["characteristic"]: item["value"] for item in snapshot["linak_notifications_total"] }
+        self.assertGreater( notifications["HEIGHT_SPEED"], 0 )
+        self.assertEqual( 1, snapshot["linak_motions_total"][0]["value"] )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#
+#
+#
+
+
+import os
+import unittest
+import threading
+from time import monotonic, sleep
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.reactor import NotificationReactor
+from linak_dpg_bt.fleet import DeskFleet
+from linak_dpg_bt.desk_mover import MotionController
+from linak_dpg_bt.supervisor import Backoff, ConnectionSupervisor
+
+
+DESKS_NUM = 20
+
+
+class PipeConnection:
+    """Connection with own pipe as data descriptor."""
+
+    def __init__(self):
+        self.readFd, self.writeFd = os.pipe()
+        self.connected = True
+        self.handled = 0
+
+    def isConnected(self):
+        return self.connected
+
+    def fileno(self):
+        return self.readFd
+
+    def handle_available_notifications(self, blocking=True):
+        os.read( self.readFd, 1 )
+        self.handled += 1
+        return True
+
+    def close(self):
+        self.connected = False
+        os.close( self.readFd )
+        os.close( self.writeFd )
+
+
+class NotificationReactorTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.reactor = NotificationReactor()
+        self.sims = {}
+        self.fleet = DeskFleet(maxConcurrency=8, useReactor=False)
+        for i in range(DESKS_NUM):
+            mac = "AA:BB:CC:DD:EE:%02X" % i
+            sim = SimulatedDesk(latency=0.001, speed=4000, notifyInterval=0.02)
+            self.sims[mac] = sim
+            self.fleet.add( mac, LinakDesk(mac, sim.createPeripheral, reactor=self.reactor) )
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.fleet.close()
+        self.reactor.stop()
+
+    def test_fleet(self):
+        threadsBefore = set( threading.enumerate() )
+        results = self.fleet.run_all( lambda desk: desk.initialize() )
+        self.assertTrue( all( result.value for result in results.values() ), results )
+        self.assertEqual( DESKS_NUM, len(self.reactor) )
+        ## single reactor thread instead of thread per desk
+        names = [ thread.name for thread in set( threading.enumerate() ) - threadsBefore ]
+        self.assertEqual( [], [ name for name in names if name.startswith("NotifHndlr") ] )
+        self.assertEqual( 1, len([ name for name in names if name.startswith("Reactor") ]) )
+        results = self.fleet.run_all( lambda desk: desk.move_to_raw( 2000 ).state )
+        self.assertEqual( set([MotionController.ARRIVED]), set( result.value for result in results.values() ) )
+        ## idle -- reactor waits without timeout (after pending busy retries are done)
+        deadline = monotonic() + 5.0
+        while len(self.reactor._busy) + len(self.reactor._polled) > 0 and monotonic() < deadline:
+            sleep( 0.01 )
+        self.assertEqual( None, self.reactor._timeout() )
+
+    def test_link_loss(self):
+        mac = self.fleet.macs()[0]
+        desk = self.fleet.desk( mac )
+        self.assertTrue( desk.initialize() )
+        supervisor = desk.supervise( Backoff( 0.01, 0.05 ) )
+        self.sims[mac].dropLinks()
+        ## disconnection detected by reactor, notifications handled again after reconnect
+        self.assertTrue( supervisor.wait_for_state( ConnectionSupervisor.RECONNECTING, 5 ) )
+        self.assertTrue( supervisor.wait_for_state( ConnectionSupervisor.CONNECTED, 5 ) )
+        self.assertEqual( MotionController.ARRIVED, desk.move_to_raw( 1000 ).state )
+
+    def test_reused_descriptor(self):
+        reactor = NotificationReactor()
+        first = PipeConnection()
+        reactor._connections.add( first )
+        reactor._sync( first )
+        fileno = first.fileno()
+        first.close()
+        second = PipeConnection()
+        try:
+            if second.fileno() != fileno:
+                self.skipTest( "descriptor not reused" )
+            reactor._connections.add( second )
+            ## new owner of descriptor synchronized before stale one
+            reactor._sync( second )
+            reactor._sync( first )
+            os.write( second.writeFd, b'\x01' )
+            ready = [ key.data for key, _ in reactor._selector.select( 1.0 ) ]
+            self.assertEqual( [second], ready )
+        finally:
+            second.close()
+            reactor._selector.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
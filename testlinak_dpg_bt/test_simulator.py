@@ -0,0 +1,102 @@
+#
+#
+#
+
+
+import unittest
+from time import sleep
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.command import DPGCommandType
+import linak_dpg_bt.linak_service as linak_service
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class SetupDesk(LinakDesk):
+    """Decodes GET_SETUP responses by custom handler."""
+    pass
+
+SetupDesk.register_dpg_handler( DPGCommandType.GET_SETUP, lambda desk, commandType, data: "setup" )
+
+
+class SimulatedDeskTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.sim = SimulatedDesk(speed=20000, notifyInterval=0.01)
+        self.desk = LinakDesk(MAC, self.sim.createPeripheral)
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.desk.disconnect()
+
+    def test_initialize(self):
+        self.assertTrue( self.desk.initialize() )
+        self.assertEqual( "Desk 8335", self.desk.name )
+        self.assertEqual( "DPG1C Linak", self.desk.deviceType )
+        self.assertEqual( 62, self.desk.desk_offset.cm )
+        self.assertEqual( 800, self.desk.favorite_position_1.raw )
+        self.assertEqual( 4000, self.desk.favorite_position_2.raw )
+        self.assertEqual( 2, self.desk.read_favorite_number() )
+        self.assertEqual( 0, self.desk.current_height.raw )
+
+    def test_services(self):
+        self.desk.initialize()
+        peripheral = self.desk._conn._conn
+        serviceUUIDs = [ str(s.uuid).upper() for s in peripheral.getServices() ]
+        self.assertIn( linak_service.Service.DPG.uuid(), serviceUUIDs )
+        charList = peripheral.getCharacteristics( uuid=linak_service.Characteristic.DPG.uuid() )
+        self.assertEqual( 1, len(charList) )
+        self.assertEqual( linak_service.Characteristic.DPG.handle(), charList[0].getHandle() )
+
+    def test_write_favorite(self):
+        self.desk.initialize()
+        self.desk.set_favorite_position(0, 100)
+        self.desk.send_fav(0)
+        self.assertEqual( 3800, self.sim.favorite(1) )
+        self.desk._conn.send_dpg_read_command( DPGCommandType.GET_SET_MEMORY_POSITION_1 )
+        self.assertEqual( 3800, self.desk.favorite_position_1.raw )
+
+    def test_dpg_handler(self):
+        self.assertEqual( b"\x01\x00", self.desk._decode_dpg_response( DPGCommandType.GET_SETUP, b"\x01\x00" ) )
+        desk = SetupDesk(MAC, self.sim.createPeripheral)
+        try:
+            self.assertTrue( desk.initialize() )
+            self.assertEqual( "setup", desk._decode_dpg_response( DPGCommandType.GET_SETUP, b"\x01\x00" ) )
+            self.assertEqual( 800, desk._conn.send_dpg_read_command( DPGCommandType.GET_SET_MEMORY_POSITION_1 ).raw )
+        finally:
+            desk.disconnect()
+
+    def test_move(self):
+        self.desk.initialize()
+        self.desk.moveTo( 2000 )
+        for _ in range(100):
+            if self.sim.height == 2000:
+                break
+            sleep(0.01)
+        self.assertEqual( 2000, self.sim.height )
+        sleep(0.05)
+        self.assertEqual( 2000, self.desk.current_height.raw )
+        self.assertEqual( 0, self.desk.current_speed.raw )
+
+    def test_stop(self):
+        self.desk.initialize()
+        self.sim.speed = 1000
+        self.desk.moveTo( 6000 )
+        sleep(0.1)
+        self.desk.stopMoving()
+        sleep(0.05)
+        self.assertFalse( self.sim.isMoving() )
+        self.assertEqual( self.sim.height, self.desk.current_height.raw )
+        self.assertEqual( 0, self.desk.current_speed.raw )
+
+    def test_keep_alive(self):
+        self.sim.speed = 1000
+        self.sim.keepAliveTimeout = 0.05
+        self.desk.initialize()
+        self.desk.moveTo( 6000 )
+        sleep(0.2)
+        self.assertFalse( self.sim.isMoving() )
+        self.assertLess( self.sim.height, 6000 )
@@ -0,0 +1,77 @@
+#
+#
+#
+
+
+import os
+import struct
+import unittest
+import tempfile
+from time import sleep
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.state_cache import DeskStateCache
+from linak_dpg_bt.command import DPGCommand, DPGCommandType
+import linak_dpg_bt.linak_service as linak_service
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class DeskStateCacheTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cachePath = os.path.join( self.tmpDir.name, "state.json" )
+        self.sim = SimulatedDesk(latency=0.001)
+        self.desks = []
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        for desk in self.desks:
+            desk.disconnect()
+        self.tmpDir.cleanup()
+
+    def createDesk(self):
+        desk = LinakDesk(MAC, self.sim.createPeripheral, stateCache=DeskStateCache(self.cachePath))
+        self.desks.append( desk )
+        return desk
+
+    def test_restore(self):
+        self.assertTrue( self.createDesk().initialize() )
+        state = DeskStateCache(self.cachePath).load( MAC )
+        self.assertEqual( "1.5.1.0", state.firmware )
+        self.assertNotEqual( None, state.get( DPGCommandType.GET_SET_MEMORY_POSITION_2 ) )
+
+        desk = self.createDesk()
+        desk._restore_state()
+        ## available without connection
+        self.assertEqual( 800, desk.favorite_position(1, timeout=0).raw )
+        self.assertEqual( 6200, desk.desk_offset.raw )
+
+    def test_changed_block_is_refreshed(self):
+        self.assertTrue( self.createDesk().initialize() )
+
+        ## other client changes favorite
+        command = DPGCommand.get_write_command( DPGCommandType.GET_SET_MEMORY_POSITION_1, bytes([0x01]) + struct.pack('<H', 2500) )
+        self.sim.write( linak_service.Characteristic.DPG.handle(), command.wrap_command() )
+
+        desk = self.createDesk()
+        self.assertTrue( desk.initialize() )
+        for _ in range(100):
+            if desk.favorite_position(1).raw == 2500:
+                break
+            sleep(0.01)
+        self.assertEqual( 2500, desk.favorite_position(1).raw )
+
+        for _ in range(100):
+            cachedData = DeskStateCache(self.cachePath).load( MAC ).get( DPGCommandType.GET_SET_MEMORY_POSITION_1 )
+            if cachedData == desk._dpgBlocks[ DPGCommandType.GET_SET_MEMORY_POSITION_1 ]:
+                break
+            sleep(0.01)
+        self.assertEqual( desk._dpgBlocks[ DPGCommandType.GET_SET_MEMORY_POSITION_1 ], cachedData )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#
+#
+#
+
+
+import unittest
+import threading
+
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.supervisor import Backoff, ConnectionSupervisor
+from linak_dpg_bt.desk_mover import MotionController
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class BackoffTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        pass
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        pass
+
+    def test_delays(self):
+        backoff = Backoff( 1.0, 5.0, multiplier=2.0, jitter=0.5, seed=1 )
+        limits = [ 1.0, 2.0, 4.0, 5.0, 5.0 ]
+        for limit in limits:
+            delay = backoff.next()
+            self.assertTrue( limit * 0.5 <= delay <= limit, (delay, limit) )
+        backoff.reset()
+        self.assertLessEqual( backoff.next(), 1.0 )
+
+
+class ConnectionSupervisorTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.sim = SimulatedDesk(latency=0.002, speed=2000, notifyInterval=0.02)
+        self.desk = LinakDesk(MAC, self.sim.createPeripheral)
+        self.assertTrue( self.desk.initialize() )
+        self.states = []
+        self.reconnected = threading.Event()
+        self.supervisor = self.desk.supervise( Backoff( 0.01, 0.05 ) )
+        self.supervisor.add_listener( self._state_changed )
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.desk.disconnect()
+
+    def _state_changed(self, supervisor, state):
+        self.states.append( state )
+        if state == ConnectionSupervisor.CONNECTED:
+            self.reconnected.set()
+
+    def test_reconnect(self):
+        writes = self.sim.writeCounter
+        self.sim.dropLinks()
+        ## link loss is detected asynchronously -- wait for listener
+        self.assertTrue( self.reconnected.wait( 5 ) )
+        self.assertEqual( [ConnectionSupervisor.DISCONNECTED, ConnectionSupervisor.RECONNECTING,
+                           ConnectionSupervisor.CONNECTED], self.states )
+        self.assertEqual( 1, self.supervisor.reconnects )
+        ## session restored without DPG handshake
+        self.assertEqual( writes, self.sim.writeCounter )
+        self.assertEqual( MotionController.ARRIVED, self.desk.move_to_raw( 1000 ).state )
+
+    def test_unreachable(self):
+        self.sim.reachable = False
+        self.sim.dropLinks()
+        self.assertTrue( self.supervisor.wait_for_state( ConnectionSupervisor.RECONNECTING, 5 ) )
+        self.assertRaises( ConnectionError, self.desk.moveUp )
+        while self.supervisor.attempts < 3:
+            self.supervisor.wait_for_state( ConnectionSupervisor.CONNECTED, 0.01 )
+        self.sim.reachable = True
+        self.assertTrue( self.supervisor.wait_for_state( ConnectionSupervisor.CONNECTED, 5 ) )
+
+    def test_motion_survives_link_loss(self):
+        motion = self.desk.move_to_raw( 3000, wait=False )
+        self.desk._monitor.wait_for( lambda: self.sim.height > 500, 5 )
+        self.sim.dropLinks()
+        self.assertTrue( motion.wait( 10 ) )
+        self.assertEqual( 1, self.supervisor.reconnects )
+
+    def test_restore_error(self):
+        restore = self.desk._restore_session
+        failures = []
+        def failingRestore():
+            if len(failures) < 2:
+                failures.append( True )
+                raise ValueError( "malformed data" )
+            restore()
+        self.desk._restore_session = failingRestore
+        self.sim.dropLinks()
+        ## supervisor keeps trying after unexpected error
+        self.assertTrue( self.reconnected.wait( 5 ) )
+        self.assertEqual( 2, len(failures) )
+        self.assertEqual( 3, self.supervisor.attempts )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,12 @@
 #
 
 
+import io
 import unittest
+import threading
+from time import monotonic, sleep
 
-from linak_dpg_bt.synchronized import synchronized
+from linak_dpg_bt.synchronized import synchronized, enable_lock_profiling, disable_lock_profiling, PriorityRLock
 
 
 @synchronized
@@ -54,6 +57,27 @@ class ObjectMock():
         '''Description'''
         return -1
 
+    @synchronized("test_lock")
+    def holdLock(self, started, release):
+        started.set()
+        release.wait()
+
+
+class PriorityMock():
+
+    def __init__(self):
+        self._methods_lock = PriorityRLock()
+        self._urgent_lock = self._methods_lock.urgent
+        self.profiler = None
+
+    @synchronized
+    def outer(self):
+        return self.inner()
+
+    @synchronized("_urgent_lock")
+    def inner(self):
+        return len( self.profiler.owners() )
+
 
 class SynchronizedTest(unittest.TestCase):
     def setUp(self):
@@ -102,6 +126,88 @@ class SynchronizedTest(unittest.TestCase):
         self.assertEquals( -1, obj.static1() )
 
     
+    def test_lock_creation(self):
+        obj = ObjectMock()
+        barrier = threading.Barrier( 8 )
+        locks = []
+        def worker():
+            barrier.wait()
+            obj.methodA1()
+            locks.append( obj._methods_lock )
+        threads = [ threading.Thread( target=worker ) for _ in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual( 1, len(set( id(lock) for lock in locks )) )
+
+    def test_profiler(self):
+        profiler = enable_lock_profiling()
+        try:
+            obj = ObjectMock()
+            started = threading.Event()
+            release = threading.Event()
+            thread = threading.Thread( target=obj.holdLock, args=(started, release), name="Holder" )
+            thread.daemon = True
+            thread.start()
+            started.wait()
+            owners = profiler.owners()
+            self.assertEqual( 1, len(owners) )
+            self.assertEqual( ("test_lock", "ObjectMock", "Holder"), owners[0][0:3] )
+            threading.Timer( 0.05, release.set ).start()
+            self.assertEqual( 3, obj.methodA3() )
+            thread.join()
+        finally:
+            self.assertIs( profiler, disable_lock_profiling() )
+        stats = { item.method: item for item in profiler.stats() }
+        self.assertEqual( 1, stats["ObjectMock.methodA3"].contended )
+        self.assertGreater( stats["ObjectMock.methodA3"].waitTotal, 0.01 )
+        self.assertGreater( stats["ObjectMock.holdLock"].holdMax, 0.01 )
+        self.assertEqual( [], profiler.owners() )
+        output = io.StringIO()
+        profiler.report( output )
+        self.assertIn( "ObjectMock.methodA3", output.getvalue() )
+
+    def test_priority_lock(self):
+        lock = PriorityRLock()
+        order = []
+        def worker(name, acquirer):
+            with acquirer:
+                order.append( name )
+        lock.acquire()
+        self.assertTrue( lock.acquire() )                ## reentrant
+        lock.release()
+        normal = threading.Thread( target=worker, args=("normal", lock), daemon=True )
+        normal.start()
+        self.assertTrue( self._wait_until( lambda: lock.waiting() == (1, 0) ) )
+        urgent = threading.Thread( target=worker, args=("urgent", lock.urgent), daemon=True )
+        urgent.start()
+        self.assertTrue( self._wait_until( lambda: lock.waiting() == (1, 1) ) )
+        lock.release()
+        normal.join()
+        urgent.join()
+        self.assertEqual( ["urgent", "normal"], order )
+        self.assertFalse( lock.locked() )
+
+    def test_profiler_urgent_owner(self):
+        profiler = enable_lock_profiling()
+        try:
+            obj = PriorityMock()
+            obj.profiler = profiler
+            ## urgent view is the same lock -- single owner entry
+            self.assertEqual( 1, obj.outer() )
+        finally:
+            disable_lock_profiling()
+        self.assertEqual( [], profiler.owners() )
+
+    def _wait_until(self, condition, timeout=5.0):
+        deadline = monotonic() + timeout
+        while condition() == False:
+            if monotonic() >= deadline:
+                return False
+            sleep( 0.001 )
+        return True
+
     def test_synchronized_mockFunction1_fail(self):
         self.assertEquals( "Description", mockFunction1.__doc__ )
         self.assertRaises(TypeError, mockFunction1)
@@ -0,0 +1,65 @@
+#
+#
+#
+
+
+import unittest
+
+from linak_dpg_bt.telemetry import HeightSpeedHistory
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class HeightSpeedHistoryTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.history = HeightSpeedHistory(4)
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        pass
+
+    def test_empty(self):
+        self.assertEqual( 0, len(self.history) )
+        self.assertEqual( None, self.history.latest() )
+        self.assertEqual( [], self.history.samples() )
+        self.assertRaises( ValueError, HeightSpeedHistory, 0 )
+
+    def test_overwrite(self):
+        for i in range(6):
+            self.history.append( float(i), 100 * i, i )
+        self.assertEqual( 4, len(self.history) )
+        self.assertEqual( (5.0, 500, 5), self.history.latest() )
+        self.assertEqual( [(2.0, 200, 2), (3.0, 300, 3), (4.0, 400, 4), (5.0, 500, 5)], self.history.samples() )
+
+    def test_window(self):
+        for i in range(7):
+            self.history.append( float(i), 100 * i, i )
+        ## buffer wrapped: 3, 4, 5, 6
+        self.assertEqual( [4.0, 5.0], [ item[0] for item in self.history.samples( 3.5, 5.0 ) ] )
+        self.assertEqual( [5.0, 6.0], [ item[0] for item in self.history.samples( since=5.0 ) ] )
+        self.assertEqual( [3.0], [ item[0] for item in self.history.samples( until=3.0 ) ] )
+        self.assertEqual( [], self.history.samples( 10.0 ) )
+        times, heights, speeds = self.history.snapshot( 4.0, 6.0 )
+        self.assertEqual( 'H', heights.typecode )
+        self.assertEqual( [400, 500, 600], list(heights) )
+
+    def test_desk_notifications(self):
+        sim = SimulatedDesk(latency=0.001, speed=20000, notifyInterval=0.01)
+        desk = LinakDesk(MAC, sim.createPeripheral)
+        try:
+            self.assertTrue( desk.initialize() )
+            desk.move_to_raw( 2000 )
+            heights = list( desk.telemetry.snapshot()[1] )
+            self.assertGreater( len(heights), 2 )
+            self.assertEqual( sorted(heights), heights )
+            self.assertEqual( desk.current_height.raw, desk.telemetry.latest()[1] )
+        finally:
+            desk.disconnect()
+
+
+if __name__ == "__main__":
+    unittest.main()
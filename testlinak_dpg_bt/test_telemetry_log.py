@@ -0,0 +1,87 @@
+#
+#
+#
+
+
+import os
+import unittest
+import tempfile
+
+from linak_dpg_bt.telemetry_log import TelemetryLog, TelemetryLogReader, KIND_HEIGHT_SPEED, KIND_DPG, HEADER, RECORD
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+from linak_dpg_bt.command import DPGCommandType
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class SmallIndexLog(TelemetryLog):
+    INDEX_INTERVAL = 8
+    FLUSH_RECORDS = 5
+
+
+class TelemetryLogTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join( self.tmpDir.name, "desk.tlog" )
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        self.tmpDir.cleanup()
+
+    def writeSamples(self, count, start=0):
+        log = SmallIndexLog( self.path )
+        for i in range(start, start + count):
+            log.append_height_speed( i * 10, 5, timestamp=1000.0 + i )
+        log.close()
+
+    def test_query(self):
+        self.writeSamples( 100 )
+        with TelemetryLogReader( self.path ) as reader:
+            self.assertEqual( 100, len(reader) )
+            self.assertEqual( (1000.0, KIND_HEIGHT_SPEED, 0, 0, 5), reader.record(0) )
+            items = list( reader.query( 1010.0, 1020.0 ) )
+            self.assertEqual( 11, len(items) )
+            self.assertEqual( 100, items[0][3] )
+            self.assertEqual( 200, items[-1][3] )
+            self.assertEqual( 100, len( list( reader.query() ) ) )
+            self.assertEqual( [], list( reader.query( since=2000.0 ) ) )
+
+    def test_reopen_and_append(self):
+        self.writeSamples( 10 )
+        ## partial record left by crash
+        with open( self.path, "ab" ) as dataFile:
+            dataFile.write( bytes(5) )
+        self.writeSamples( 10, start=10 )
+        self.assertEqual( len(HEADER) + 20 * RECORD.size, os.path.getsize( self.path ) )
+        with TelemetryLogReader( self.path ) as reader:
+            self.assertEqual( [1015.0, 1016.0], [ item[0] for item in reader.query( 1015.0, 1016.0 ) ] )
+
+    def test_clock_going_back(self):
+        log = TelemetryLog( self.path )
+        log.append_height_speed( 1, 0, timestamp=50.0 )
+        log.append_height_speed( 2, 0, timestamp=40.0 )
+        log.close()
+        with TelemetryLogReader( self.path ) as reader:
+            self.assertEqual( [50.0, 50.0], [ item[0] for item in reader.query() ] )
+
+    def test_desk_events(self):
+        sim = SimulatedDesk(latency=0.001)
+        log = TelemetryLog.for_desk( self.tmpDir.name, MAC )
+        desk = LinakDesk(MAC, sim.createPeripheral, telemetryLog=log)
+        try:
+            self.assertTrue( desk.initialize() )
+        finally:
+            desk.disconnect()
+            log.close()
+        with TelemetryLogReader( log.path ) as reader:
+            codes = [ item[2] for item in reader.query( kind=KIND_DPG ) ]
+            self.assertIn( DPGCommandType.DESK_OFFSET.value, codes )
+            heights = list( reader.query( kind=KIND_HEIGHT_SPEED ) )
+            self.assertGreater( len(heights), 0 )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+#
+#
+#
+
+
+import unittest
+import threading
+from time import monotonic
+
+from linak_dpg_bt.variable_monitor import VariableMonitor
+
+
+class VariableMonitorTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.monitor = VariableMonitor()
+        self.value = None
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        pass
+
+    def _set_value(self, value):
+        self.value = value
+        self.monitor.updated("value")
+
+    def test_version(self):
+        self.assertEqual( 0, self.monitor.version("value") )
+        self._set_value( 1 )
+        self._set_value( 2 )
+        self.assertEqual( 2, self.monitor.version("value") )
+
+    def test_wait_for_wakeup(self):
+        timer = threading.Timer( 0.05, self._set_value, (5,) )
+        timer.start()
+        startTime = monotonic()
+        ready = self.monitor.wait_for( lambda: self.value is not None, 5.0 )
+        self.assertTrue( ready )
+        self.assertEqual( 5, self.value )
+        self.assertLess( monotonic() - startTime, 1.0 )
+
+    def test_wait_for_timeout(self):
+        ready = self.monitor.wait_for( lambda: self.value is not None, 0.05 )
+        self.assertFalse( ready )
+
+    def test_wait_for_update(self):
+        version = self.monitor.version("value")
+        timer = threading.Timer( 0.05, self._set_value, (7,) )
+        timer.start()
+        newVersion = self.monitor.wait_for_update( "value", version, 5.0 )
+        self.assertEqual( version + 1, newVersion )
+        self.assertEqual( None, self.monitor.wait_for_update( "value", newVersion, 0.05 ) )
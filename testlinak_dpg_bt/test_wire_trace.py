@@ -0,0 +1,60 @@
+#
+#
+#
+
+
+import io
+import unittest
+
+from linak_dpg_bt.wire_trace import WireTrace, HexDump
+from linak_dpg_bt.linak_device import LinakDesk
+from linak_dpg_bt.simulator import SimulatedDesk
+import linak_dpg_bt.linak_service as linak_service
+
+
+MAC = "AA:BB:CC:DD:EE:FF"
+
+
+class WireTraceTest(unittest.TestCase):
+    def setUp(self):
+        ## Called before testfunction is executed
+        self.trace = WireTrace(capacity=3, frameSize=4)
+
+    def tearDown(self):
+        ## Called after testfunction was executed
+        pass
+
+    def test_hex_dump(self):
+        self.assertEqual( "0x01 0xAB", str( HexDump( b"\x01\xab" ) ) )
+
+    def test_ring(self):
+        for i in range(5):
+            self.trace.record( WireTrace.WRITE, 0x14, bytes([i, 1, 2, 3, 4, 5]) )
+        frames = self.trace.frames()
+        self.assertEqual( 3, len(frames) )
+        self.assertEqual( bytes([2, 1, 2, 3]), frames[0][3] )
+        self.assertEqual( 6, frames[0][4] )
+        output = io.StringIO()
+        self.trace.dump( output )
+        lines = output.getvalue().splitlines()
+        self.assertEqual( 3, len(lines) )
+        self.assertIn( "W 0x0014 0x04 0x01 0x02 0x03 ... (6 bytes)", lines[-1] )
+
+    def test_desk(self):
+        sim = SimulatedDesk(latency=0.001)
+        desk = LinakDesk(MAC, sim.createPeripheral)
+        self.assertEqual( None, desk.wire_trace )
+        trace = desk.enable_wire_trace()
+        try:
+            self.assertTrue( desk.initialize() )
+        finally:
+            desk.disconnect()
+        frames = trace.frames()
+        dpgHandle = linak_service.Characteristic.DPG.handle()
+        self.assertIn( (WireTrace.WRITE, dpgHandle), [ (item[1], item[2]) for item in frames ] )
+        self.assertIn( (WireTrace.NOTIFY, dpgHandle), [ (item[1], item[2]) for item in frames ] )
+        self.assertIn( WireTrace.READ, [ item[1] for item in frames ] )
+
+
+if __name__ == "__main__":
+    unittest.main()